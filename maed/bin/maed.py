@@ -8,13 +8,13 @@ __author__ = 'Jim Hefferon'
 __license__ = 'GPL 3'
 TODO = []
 
-import sys, os, os.path, re, pprint, argparse, traceback, time
-
-import csv # read the course data
-
-import cgi
-import cgitb
-cgitb.enable()
+import sys, os, time
+import io, marshal  # compiled snapshot of the course data
+import bisect  # course search
+# So that a request loads only what it needs, these are imported where they
+# are used: csv and hashlib to read the course file, json for the APIs, re
+# for the course search index, urllib.parse for escaped form data, zlib to 
+# gzip, random and cProfile to profile, and cgitb once there is an error.
 
 import datetime  # determine year 
 THISYEAR = datetime.date.today().year
@@ -26,6 +26,26 @@ DEBUG = False
 class maedException(Exception):
     pass
 
+class diagnostic(str):
+    """A message from one of the tests.  It is the string shown to the
+    student, and also says which test gave it and what it is about.
+      check  string or None  the test, one of TESTS
+      course  string or None  catalogue designation of the course concerned
+      semester  string or None  the semester concerned
+    """
+    def __new__(cls, message, check=None, course=None, semester=None):
+        self = str.__new__(cls, message)
+        self.check = check
+        self.course = course
+        self.semester = semester
+        return self
+
+    def as_dict(self):
+        return {'check': self.check,
+                'course': self.course,
+                'semester': self.semester,
+                'message': str(self)}
+
 
 def warn(s):
     t = 'WARNING: '+s+"\n"
@@ -39,27 +59,96 @@ def error(s):
     sys.exit(10)
 
 
-SEMESTERS = ["BEFORE", 
-             "ONE_FALL", "ONE_SPRING", "ONE_SUMMER",
-             "TWO_FALL", "TWO_SPRING", "TWO_SUMMER",
-             "THREE_FALL", "THREE_SPRING", "THREE_SUMMER",
-             "FOUR_FALL", "FOUR_SPRING", 
-             "AFTER"]
+# The course data lives next to this script.
+COURSEFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maed.csv")
+# The catalog of a given year, if it differs from the current one in maed.csv
+YEAR_COURSEFILE = os.path.join(os.path.dirname(COURSEFILE), "maed-{year}.csv")
+
+# The term calendar.  The program is made of academic years, each of some
+# of the seasons below, with a semester for the courses transferred in
+# before it and one for those taken after.
+class season(object):
+    """A season of the academic year.
+      name  string  as it ends the names of semesters, say 'FALL'
+      long_name  string  in English
+      year_offset  integer  calendar years after that of the Fall of its
+        academic year; 0 for the Fall, 1 for a later Spring or Summer
+      summer  boolean  a summer term, taken by choice
+      min_credits, max_credits  integers or None  the fewest credits for a
+        full-time load, and the most allowed; None for no such limit
+      offered  string or None  the course attribute that says whether a
+        course is given in this season; None for any course
+    """
+    def __init__(self, name, long_name, year_offset, summer=False, min_credits=None, max_credits=None, offered=None):
+        self.name = name
+        self.long_name = long_name
+        self.year_offset = year_offset
+        self.summer = summer
+        self.min_credits = min_credits
+        self.max_credits = max_credits
+        self.offered = offered
+
+class term(object):
+    """A semester of the program.
+      name  string  as in SEMESTERS, say 'TWO_SPRING'
+      long_name  string  in English
+      year  integer or None  the academic year, 0 for the first; None for
+        BEFORE and AFTER
+      season  season instance or None  None for BEFORE and AFTER
+    """
+    def __init__(self, name, long_name, year=None, season=None):
+        self.name = name
+        self.long_name = long_name
+        self.year = year
+        self.season = season
+
+# In academic order.  A J-term would go between the Fall and the Spring, as
+#   season('JTERM', 'January term', 1, max_credits=4)
+SEASONS = [season('FALL', 'Fall', 0, min_credits=12, max_credits=18, offered='fall'),
+           season('SPRING', 'Spring', 1, min_credits=12, max_credits=18, offered='spring'),
+           season('SUMMER', 'Summer', 1, summer=True)]
+# The years of the program, as they start the names of its semesters; a
+# five-year program adds 'FIVE'
+PROGRAM_YEARS = ['ONE', 'TWO', 'THREE', 'FOUR']
+PROGRAM_YEARS_LONG = {'ONE': 'First year', 'TWO': 'Second year', 'THREE': 'Third year',
+                      'FOUR': 'Fourth year', 'FIVE': 'Fifth year', 'SIX': 'Sixth year'}
+# The years without all of the seasons: the summer after the last year is
+# not planned
+YEAR_SEASONS = {'FOUR': ['FALL', 'SPRING']}
+
+def make_calendar(program_years=PROGRAM_YEARS, seasons=SEASONS, year_seasons=YEAR_SEASONS):
+    """Return the list of the semesters of the program, as term instances,
+    in order.
+    """
+    r = [term('BEFORE', 'Transfered in')]
+    for i, y in enumerate(program_years):
+        for ssn in seasons:
+            if y in year_seasons and ssn.name not in year_seasons[y]:
+                continue
+            r.append(term(y+'_'+ssn.name, PROGRAM_YEARS_LONG[y]+' '+ssn.long_name, i, ssn))
+    r.append(term('AFTER', 'After SMC'))
+    return r
 
+# Plan codes list the semesters in this order, so a change to the calendar
+# needs a new PLAN_TOKEN_FORMAT
+TERM_CALENDAR = make_calendar()
+TERMS = dict((t.name, t) for t in TERM_CALENDAR)
+# The names of the semesters, in order ..
+SEMESTERS = [t.name for t in TERM_CALENDAR]
 # .. and an English version
-SEMESTERS_LONG = {"BEFORE": "Transfered in", 
-                  "ONE_FALL": "First year Fall", 
-                  "ONE_SPRING": "First year Spring", 
-                  "ONE_SUMMER": "First year Summer",
-                  "TWO_FALL": "Second year Fall", 
-                  "TWO_SPRING": "Second year Spring", 
-                  "TWO_SUMMER": "Second year Summer",
-                  "THREE_FALL": "Third year Fall", 
-                  "THREE_SPRING": "Third year Spring", 
-                  "THREE_SUMMER": "Third year Summer",
-                  "FOUR_FALL": "Fourth year Fall", 
-                  "FOUR_SPRING": "Fourth year Spring", 
-                  "AFTER": "After SMC"}
+SEMESTERS_LONG = dict((t.name, t.long_name) for t in TERM_CALENDAR)
+
+# The programs, such as 'primary' and 'secondary', are defined by the files
+# in programs/; see program_definitions()
+
+# Set this to the file name of a plan store (see maed_store.py) to keep each
+# plan that is submitted as Done with a name
+STORE_VAR = 'MAED_STORE'
+
+# Where the validation API answers; see validate_json()
+API_VALIDATE = '/api/validate'
+# .. and the course search; see search_json()
+API_SEARCH = '/api/search'
 
 CSS = """
   <STYLE> 
@@ -416,7 +505,7 @@ MAJOR_REQUIREMENTS = """
 <P>
   This digraph gives the prerequisite structure of the Math program.
   </P>  
-  <IMG src='/math.png' alt='Mathematics prerequisite structure' style='width: 5in'>
+  <IMG src='?graph=math' alt='Mathematics prerequisite structure' style='max-width: 100%'>
 
 <h4>Elementary Education</h4>
 
@@ -450,9 +539,10 @@ MAJOR_REQUIREMENTS = """
   <li>Student teaching consists of the two  courses ED&nbsp;428 
     and ED&nbsp;475
   </ul>
+
+<P>This is the Education's prerequisite structure.</P>  
+<IMG src='?graph=ed' alt='Education prerequisite structure' style='max-width: 100%'>
 """
-# <P>This is the Education's prerequisite structure.</P>  
-# <IMG src='/ed.png' alt='Education prerequisite structure' style='width: 100%'>
 
 COURSES_OFFERED = """
 <H3>When courses are offered</H3>
@@ -539,18 +629,28 @@ class course(object):
       s = "{catalogue}: {name}  Credits: {credits}\n  Years with odd fall? {year_odd_fall}  Even fall? {year_even_fall} Fall semester? {fall} Spring? {spring}\n  Prerequisites: {prereqs}\n  Notes: {notes}".format(catalogue=self.catalogue, name=self.name, credits=self.credits, year_odd_fall=self.year_odd_fall, year_even_fall=self.year_even_fall, fall=self.fall, spring=self.spring, prereqs=" ".join([x for x in self.prerequisites]), notes=self.notes)
       return s
 
-  def check_prequisite_courses(self, prior_courses, current_courses):
+  def check_prequisite_courses(self, prior_courses, current_courses, semester=None, courses=None):
       """Check that the prerequisites are among the prior courses
         prior_courses  set of catalogue designations
         current_courses  set of catalogue designations
+        semester  string or None  the semester of this course, for the messages
+        courses  catalog or None  if given, a missing prerequisite's message
+          also lists the courses missing further back along its chain
       """
       r = []
       for c in self.corequisites:
           if not c in prior_courses | current_courses:
-              r.append("Pre- or co-requisite not met: before you take "+self.catalogue+" you must take "+c+" (or you can take them at the same time).")
+              r.append(diagnostic("Pre- or co-requisite not met: before you take "+self.catalogue+" you must take "+c+" (or you can take them at the same time).", 'prerequisites', self.catalogue, semester))
       for c in self.prerequisites:
           if not c in prior_courses:
-              r.append("Prerequisite not met: before you take "+self.catalogue+" you must take "+c+".")
+              chain = []
+              if courses is not None:
+                  chain = [cd for cd in courses.designations_in(courses[c].prerequisite_closure) if cd not in prior_courses]
+              if chain:
+                  chain.sort(key=lambda cd: (courses[cd].prerequisite_depth, cd))
+                  r.append(diagnostic("Prerequisite not met: before you take "+self.catalogue+" you must take "+c+", and before that "+_and_list(chain)+".", 'prerequisites', self.catalogue, semester))
+              else:
+                  r.append(diagnostic("Prerequisite not met: before you take "+self.catalogue+" you must take "+c+".", 'prerequisites', self.catalogue, semester))
       return r
 
   def check_semester(self, fall_odd, fall_sem):
@@ -573,6 +673,13 @@ class course(object):
               r.append('This course is not offered in the spring')
       
 
+def _and_list(items):
+    """Return the strings joined as in English: 'A', 'A and B', 'A, B, and C'.
+    """
+    if len(items) < 3:
+        return ' and '.join(items)
+    return ', '.join(items[:-1])+', and '+items[-1]
+
 class semester(object):
     """A semester is a set of courses
     """
@@ -653,43 +760,326 @@ def bool_read(s):
     else:
         return(True)
 
-def read_coursefile(fn = "maed.csv"):
-    d = {}
-    with open(fn, newline='') as csvfile:
-        coursefilereader = csv.reader(csvfile, quoting=csv.QUOTE_MINIMAL)
-        for row in coursefilereader:
-            dept = row[0]
-            if dept[0]=='#':  # comment line
-                continue
-            num = int(row[1])
-            name = row[2] 
-            credits = int(row[3]) 
-            year_odd_fall = bool_read(row[4]) 
-            year_even_fall = bool_read(row[5])
-            fall = bool_read(row[6]) 
-            spring = bool_read(row[7]) 
-            notes = row[8].strip()
-            prerequisites = row[9].strip()
-            corequisites = row[10].strip()
-            c = course(dept, num, name, credits, year_odd_fall, year_even_fall, fall, spring, notes, prerequisites, corequisites)
-            d[c.catalogue] = c
+# The course attributes saying when it is offered
+OFFERING_FLAGS = ('year_odd_fall', 'year_even_fall', 'fall', 'spring')
+
+class catalog(dict):
+    """The courses, as a dictionary catalogue_designation -> course instance.
+    version  string  hash of the course file it was read from
+    stats  dictionary  how it was loaded, and how long that took
+    After index_courses(), each catalogue designation has a dense integer
+    id, so a set of courses can be kept as an integer bitmask.
+    designations  list of strings  id -> catalogue designation
+    ids  dictionary  catalogue designation -> id
+    offered  dictionary  offering flag -> mask of courses with that flag set
+    dependents  dictionary  id -> mask of the courses having it as a
+      prerequisite
+    unconditional  integer  mask of the courses with no prerequisites
+    trigrams  dictionary  three letters -> mask of the courses with them in
+      a word of the name; see index_names()
+    word_starts  dictionary  first one or two letters of a word -> mask of
+      the courses with a word of the name starting that way
+    """
+    # Attributes saved in the snapshot along with the courses
+    SNAPSHOT_ATTRIBUTES = ('designations', 'ids', 'offered', 'dependents', 'unconditional', 'trigrams', 'word_starts')
+    # How many prior-course masks eligible() remembers
+    ELIGIBLE_CACHE_SIZE = 4096
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.version = None
+        self.stats = {}
+        self.designations = []
+        self.ids = {}
+        self.offered = {}
+        self.dependents = {}
+        self.unconditional = 0
+        self.trigrams = {}
+        self.word_starts = {}
+        self._eligible = {}
+
+    def index_courses(self):
+        """Assign the ids, and set each course's id, prerequisite_mask, and
+        corequisite_mask.  Also find the reverse-prerequisite index, and
+        check the prerequisite graph; see index_prerequisites().
+        """
+        missing = []
+        for cd in sorted(self.keys()):
+            c = self[cd]
+            for p in sorted(c.prerequisites | c.corequisites):
+                if p not in self:
+                    missing.append(cd+" needs "+p)
+        if missing:
+            raise maedException("The course data names courses that it does not list: "+"; ".join(missing)+".")
+        self.designations = sorted(self.keys())
+        self.ids = dict((cd, i) for (i, cd) in enumerate(self.designations))
+        self.offered = dict((flag, 0) for flag in OFFERING_FLAGS)
+        self.dependents = {}
+        self.unconditional = 0
+        self._eligible = {}
+        for cd, c in self.items():
+            c.id = self.ids[cd]
+            c.prerequisite_mask = self.mask(c.prerequisites)
+            c.corequisite_mask = self.mask(c.corequisites)
+            for flag in OFFERING_FLAGS:
+                if getattr(c, flag):
+                    self.offered[flag] |= 1 << c.id
+            if c.prerequisites:
+                for p in c.prerequisites:
+                    i = self.ids[p]
+                    self.dependents[i] = self.dependents.get(i, 0) | (1 << c.id)
+            else:
+                self.unconditional |= 1 << c.id
+        self.index_prerequisites()
+        self.index_names()
+
+    def index_names(self):
+        """Index the words of the course names for search_courses(): the
+        trigrams of each word, and for words too short to have any, the
+        first one or two letters.
+        """
+        self.trigrams = {}
+        self.word_starts = {}
+        for cd, c in self.items():
+            bit = 1 << c.id
+            for word in name_words(c.name):
+                for i in range(len(word)-2):
+                    t = word[i:i+3]
+                    self.trigrams[t] = self.trigrams.get(t, 0) | bit
+                for t in (word[:1], word[:2]):
+                    self.word_starts[t] = self.word_starts.get(t, 0) | bit
+
+    def index_prerequisites(self):
+        """Check that no course is, through its prerequisites, a prerequisite
+        of itself.  Set each course's prerequisite_closure, the mask of all
+        the courses that must come before it, following prerequisites back
+        as far as they go, and prerequisite_depth, the length of the longest
+        such chain.
+        """
+        # Take the courses in an order where prerequisites come first
+        waiting = dict((cd, len(c.prerequisites)) for (cd, c) in self.items())
+        ready = sorted(cd for (cd, n) in waiting.items() if n == 0)
+        order = []
+        while ready:
+            cd = ready.pop()
+            order.append(cd)
+            m = self.dependents.get(self[cd].id, 0)
+            for d in self.designations_in(m):
+                waiting[d] -= 1
+                if waiting[d] == 0:
+                    ready.append(d)
+        if len(order) < len(self):
+            # Walk back along prerequisites not yet placed until one repeats
+            placed = set(order)
+            cd = min(cd for cd in self if cd not in placed)
+            path = []
+            while cd not in path:
+                path.append(cd)
+                cd = min(p for p in self[cd].prerequisites if p not in placed)
+            cycle = path[path.index(cd):]+[cd]
+            raise maedException("The prerequisites in the course data go in a circle: "+" needs ".join(cycle)+".")
+        for cd in order:
+            c = self[cd]
+            c.prerequisite_closure = 0
+            c.prerequisite_depth = 0
+            for p in c.prerequisites:
+                crs = self[p]
+                c.prerequisite_closure |= (1 << crs.id) | crs.prerequisite_closure
+                c.prerequisite_depth = max(c.prerequisite_depth, 1+crs.prerequisite_depth)
+
+    def mask(self, catalogue_designations):
+        """Return the bitmask of the courses.
+        """
+        m = 0
+        for cd in catalogue_designations:
+            m |= 1 << self.ids[cd]
+        return m
+
+    def eligible(self, prior):
+        """Return the mask of the courses whose prerequisites are all in
+        prior.  Only the dependents of the courses in prior can newly qualify,
+        so just those are looked at.  The answers are remembered, since the
+        same plan's prior masks come back on every render.
+        prior  integer  mask of the courses already taken
+        """
+        m = self._eligible.get(prior)
+        if m is not None:
+            return m
+        m = self.unconditional
+        rest = prior
+        while rest:
+            low = rest & -rest
+            candidates = self.dependents.get(low.bit_length()-1, 0) & ~m
+            while candidates:
+                b = candidates & -candidates
+                if not(self[self.designations[b.bit_length()-1]].prerequisite_mask & ~prior):
+                    m |= b
+                candidates ^= b
+            rest ^= low
+        if len(self._eligible) >= self.ELIGIBLE_CACHE_SIZE:
+            self._eligible.clear()
+        self._eligible[prior] = m
+        return m
+
+    def designations_in(self, m):
+        """Return the sorted list of catalogue designations in bitmask m.
+        """
+        r = []
+        while m:
+            low = m & -m
+            r.append(self.designations[low.bit_length()-1])
+            m ^= low
+        return sorted(r)
+
+
+def read_coursefile(fn = COURSEFILE):
+    """Parse the course file.  Return a catalog.
+    """
+    import csv, hashlib
+    with open(fn, 'rb') as f:
+        data = f.read()
+    d = catalog()
+    d.version = hashlib.sha1(data).hexdigest()
+    coursefilereader = csv.reader(io.StringIO(data.decode('utf-8'), newline=''), quoting=csv.QUOTE_MINIMAL)
+    for row in coursefilereader:
+        dept = row[0]
+        if dept[0]=='#':  # comment line
+            continue
+        num = int(row[1])
+        name = row[2] 
+        credits = int(row[3]) 
+        year_odd_fall = bool_read(row[4]) 
+        year_even_fall = bool_read(row[5])
+        fall = bool_read(row[6]) 
+        spring = bool_read(row[7]) 
+        notes = row[8].strip()
+        prerequisites = row[9].strip()
+        corequisites = row[10].strip()
+        c = course(dept, num, name, credits, year_odd_fall, year_even_fall, fall, spring, notes, prerequisites, corequisites)
+        d[c.catalogue] = c
+    d.index_courses()
+    return d
+
+# The compiled snapshot sits next to the course file.  It holds the
+# attributes of each course instance, so loading it is one read and one
+# marshal.loads(), with no parsing.  Bump the format if the course
+# attributes change.
+SNAPSHOT_SUFFIX = '.snapshot'
+SNAPSHOT_FORMAT = 5
+
+def _write_snapshot(fn, st, d):
+    """Save the catalog d read from the course file fn, whose stat is st.
+    A course file in a directory we cannot write is fine; we just don't save.
+    """
+    records = dict((cd, c.__dict__) for (cd, c) in d.items())
+    attributes = dict((a, getattr(d, a)) for a in catalog.SNAPSHOT_ATTRIBUTES)
+    data = marshal.dumps((SNAPSHOT_FORMAT, st.st_mtime_ns, st.st_size, d.version, records, attributes))
+    tmp = fn+SNAPSHOT_SUFFIX+'.'+str(os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, fn+SNAPSHOT_SUFFIX)
+    except OSError as e:
+        if VERBOSE:
+            warn("unable to save the course snapshot: "+str(e))
+
+def _read_snapshot(fn):
+    """Return the contents of the snapshot for course file fn, or None.
+    """
+    try:
+        with open(fn+SNAPSHOT_SUFFIX, 'rb') as f:
+            snapshot = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if snapshot[0] != SNAPSHOT_FORMAT:
+        return None
+    return snapshot
+
+def load_catalog(fn = COURSEFILE):
+    """Return the catalog for the course file, from its compiled snapshot if
+    that is current.  The snapshot is rebuilt if the course file's mtime or 
+    size has changed and its contents hash differently.
+    """
+    start_time = time.perf_counter()
+    st = os.stat(fn)
+    snapshot = _read_snapshot(fn)
+    source = 'snapshot'
+    if (snapshot is not None
+        and (snapshot[1] != st.st_mtime_ns
+             or snapshot[2] != st.st_size)):
+        import hashlib
+        with open(fn, 'rb') as f:
+            if hashlib.sha1(f.read()).hexdigest() == snapshot[3]:
+                source = 'snapshot, revalidated'  # touched but not changed
+            else:
+                snapshot = None
+    if snapshot is None:
+        d = read_coursefile(fn)
+        source = 'csv'
+    else:
+        d = catalog()
+        d.version = snapshot[3]
+        for cd, record in snapshot[4].items():
+            c = course.__new__(course)
+            c.__dict__ = record
+            d[cd] = c
+        for a, value in snapshot[5].items():
+            setattr(d, a, value)
+    if source != 'snapshot':
+        _write_snapshot(fn, st, d)
+    d.stats = {'source': source,
+               'courses': len(d),
+               'bytes': st.st_size,
+               'seconds': time.perf_counter()-start_time}
+    if VERBOSE:
+        warn("loaded {courses} courses from {source} in {seconds:.6f} secs".format(**d.stats))
     return d
 
+# The catalogs read so far by this process, most recently used last.  Maps
+# file name -> (mtime, size, catalog).  A process only reads the catalogs of
+# the years it is asked about, and holds on to this many of them.
+_CATALOGS = {}
+CATALOG_CACHE_SIZE = 6
+
+def catalog_file(year):
+    """Return the name of the course file for the catalog of that year:
+    maed-<year>.csv if there is one, and otherwise maed.csv .
+    year  integer  catalog year
+    """
+    fn = YEAR_COURSEFILE.format(year=year)
+    if os.path.exists(fn):
+        return fn
+    return COURSEFILE
+
+def catalog_for(year, fn=None):
+    """Return the catalog for the year, reading it only if this process has 
+    not got it or its course file has changed.
+    year  integer  catalog year
+    fn  string or None  if given, the course file to use whatever the year
+    """
+    if fn is None:
+        fn = catalog_file(year)
+    st = os.stat(fn)
+    entry = _CATALOGS.pop(fn, None)
+    if entry is None or entry[:2] != (st.st_mtime_ns, st.st_size):
+        entry = (st.st_mtime_ns, st.st_size, load_catalog(fn))
+    _CATALOGS[fn] = entry  # a dict keeps its order, so this is now last
+    if len(_CATALOGS) > CATALOG_CACHE_SIZE:
+        del _CATALOGS[next(iter(_CATALOGS))]
+    return entry[2]
+
 def make_program(program='secondary'):
     """Make the select widget for the program.
-    program  string  one of 'primary', 'secondary'
+    program  string  one of program_names()
     """
+    definitions = program_definitions()
     r=["<SELECT name='program'>\n"]
-    if program=='primary':
-        s = ' SELECTED'
-    else:
-        s=''
-    r.append("  <OPTION value='primary'{s}>Primary Education</OPTION>\n".format(s=s))
-    if program=='secondary':
-        s = ' SELECTED'
-    else:
-        s=''
-    r.append("  <OPTION value='secondary'{s}>Secondary Education</OPTION>\n".format(s=s))
+    for name in program_names():
+        if program==name:
+            s = ' SELECTED'
+        else:
+            s=''
+        r.append("  <OPTION value='{name}'{s}>{title}</OPTION>\n".format(name=name, s=s, title=definitions[name]['title']))
     r.append("  </SELECT>")
     return ''.join(r)
 
@@ -718,91 +1108,208 @@ def make_year(selected=THISYEAR):
     r.append("  </SELECT>\n")
     return "".join(r)
 
-def _make_select_tag(name, courses, catalogue_designations, selected_course):
+# The <OPTION> lines for every course in a catalog, rendered once per catalog
+# version.  Maps version -> (catalogue_designations, options, offsets) where
+# options is the block of <OPTION> lines and offsets[cd] is the place in it 
+# to patch in the SELECTED marker for course cd.
+_OPTIONS_CACHE = {}
+_OPTIONS_CACHE_SIZE = 8
+
+def _course_options(courses):
+    """Return the sorted catalogue designations, the rendered <OPTION> lines,
+    the offsets of the SELECTED markers, and each course's own line.  Cached
+    by catalog version.
+    courses  dictionary catalogue_designation -> course instance
+    """
+    version = getattr(courses, 'version', None)
+    if version is not None and version in _OPTIONS_CACHE:
+        return _OPTIONS_CACHE[version]
+    catalogue_designations = sorted(courses.keys())
+    r, offsets, lines, n = [], {}, {}, 0
+    for cd in catalogue_designations:
+        c = courses[cd]
+        head = "  <OPTION value='{catalogue}'".format(catalogue=c.catalogue)
+        offsets[cd] = n+len(head)
+        line = head+">{catalogue} {name}</OPTION>\n".format(catalogue=c.catalogue, name=c.name)
+        r.append(line)
+        lines[cd] = line
+        n += len(line)
+    entry = (catalogue_designations, ''.join(r), offsets, lines)
+    if version is not None:
+        if len(_OPTIONS_CACHE) >= _OPTIONS_CACHE_SIZE:
+            _OPTIONS_CACHE.clear()
+        _OPTIONS_CACHE[version] = entry
+    return entry
+
+def _make_suggested_options(courses, suggested):
+    """Return as a string the <OPTGROUP> of the suggested courses, to go
+    ahead of the full list in an empty <SELECT>.
+    courses  dictionary catalogue_designation -> course instance
+    suggested  list of catalogue designations
+    """
+    if not(suggested):
+        return ''
+    catalogue_designations, options, offsets, lines = _course_options(courses)
+    r = ["  <OPTGROUP label='Eligible this semester'>\n"]
+    for cd in suggested:
+        r.append(lines[cd])
+    r.append("  </OPTGROUP>\n")
+    return ''.join(r)
+
+def _make_select_tag(name, courses, selected_course, suggestions=''):
     """Return as a string the <SELECT name='name'> .. tag
     name  string  HTML name of the tag
     courses  dictionary catalogue_designation -> course instance
-    catalogue_designations  list of strings  ordered list
     selected_course  string or None catalogue designation of course selected
+    suggestions  string  <OPTGROUP> of suggested courses, for an empty tag
     """
+    catalogue_designations, options, offsets, lines = _course_options(courses)
     r=["<SELECT name='",
        name,
        "'>\n"]
-    if selected_course and selected_course in catalogue_designations:        
+    if selected_course and selected_course in offsets:
+       i = offsets[selected_course]
        r.append("  <OPTION value=''> </OPTION>\n")
+       r.append(options[:i])
+       r.append(' SELECTED')
+       r.append(options[i:])
+    elif suggestions:
+       r.append("  <OPTION value='' SELECTED> </OPTION>\n")
+       r.append(suggestions)
+       r.append("  <OPTGROUP label='All courses'>\n")
+       r.append(options)
+       r.append("  </OPTGROUP>\n")
     else:
        r.append("  <OPTION value='' SELECTED> </OPTION>\n")
-    for cd in catalogue_designations:
-        c = courses[cd]
-        if selected_course==cd:
-            s = ' SELECTED'
-        else:
-            s = ''
-        r.append("  <OPTION value='{catalogue}'{s}>{catalogue} {name}</OPTION>\n".format(catalogue=c.catalogue, name=c.name, s=s))
+       r.append(options)
     r.append("  </SELECT>\n")
     return "".join(r)
 
+def _make_search_tag(name, selected_course):
+    """Return as a string the <INPUT> for a course, for a catalog too large
+    for select lists.  The script in SEARCH_SCRIPT fills in its <DATALIST>
+    from the search API as the user types.
+    name  string  HTML name of the tag, the semester
+    selected_course  string or None catalogue designation of course selected
+    """
+    return "<INPUT type='text' name='{name}' value='{value}' list='{name}_found' class='course_search' size='8' autocomplete='off'>\n".format(name=name, value=selected_course or '')
+
+def _make_found_list(courses, name, suggested):
+    """Return as a string the <DATALIST> shared by a semester's search boxes,
+    starting with the suggested courses.
+    """
+    r = ["<DATALIST id='{name}_found'>\n".format(name=name)]
+    for cd in suggested or []:
+        r.append("  <OPTION value='{cd}'>{cd} {name}</OPTION>\n".format(cd=cd, name=courses[cd].name))
+    r.append("  </DATALIST>\n")
+    return ''.join(r)
+
 COURSE_CHOICES = 6
-def make_html_semester(student_sem, courses):
+def make_html_semester(student_sem, courses, suggested=None):
+    """Produce the HTML table of one semester's course selections.  If the
+    catalog has more than LARGE_CATALOG courses they are search boxes, 
+    otherwise select lists.
+    student_sem  student_semester instance
+    courses  dictionary  catalogue_designation -> course
+    suggested  list of catalogue designations or None  courses to offer
+      first in the semester's first empty selection
+    """
+    name = student_sem.semester
+    large = len(courses) > LARGE_CATALOG
+    if large:
+        suggestions = ''
+    else:
+        suggestions = _make_suggested_options(courses, suggested)
     r=["<TABLE class='semester' name='{semester}'>\n".format(semester=student_sem.semester)]
     selected_courses = sorted(student_sem.courses)
-    catalogue_designations = sorted(courses.keys())
     selected_courses = selected_courses+([None,]*COURSE_CHOICES) # pad list 
     for i in range(COURSE_CHOICES):
         r.append("  <TR><TD>\n")
-        name = student_sem.semester
         selected_course = selected_courses[i]
-        r.append("    "+_make_select_tag(name, courses, catalogue_designations, selected_course))
+        if large:
+            r.append("    "+_make_search_tag(name, selected_course))
+        else:
+            r.append("    "+_make_select_tag(name, courses, selected_course, suggestions))
+            if not(selected_course):
+                suggestions = ''  # only the first empty selection has them
         r.append("    </TD></TR>\n")
     r.append("  </TABLE>\n")
+    if large:
+        r.append(_make_found_list(courses, name, suggested))
     return ''.join(r)
 
-def make_html_tables(courses, student):
+# Fills in the <DATALIST> of a search box from the search API as the user
+# types, limited to the courses offered in that semester
+SEARCH_SCRIPT = """<SCRIPT>
+(function () {
+  var api = location.pathname.replace(/\\/$/, '') + '%(api)s';
+  var pending = {};
+  document.querySelectorAll('input.course_search').forEach(function (box) {
+    box.addEventListener('input', function () {
+      var q = box.value.trim();
+      if (q.length < 2) { return; }
+      var list = document.getElementById(box.getAttribute('list'));
+      var year = box.form.elements['catalogue_year'].value;
+      clearTimeout(pending[box.name]);
+      pending[box.name] = setTimeout(function () {
+        fetch(api + '?q=' + encodeURIComponent(q) + '&semester=' + box.name + '&year=' + year)
+          .then(function (answer) { return answer.json(); })
+          .then(function (found) {
+            list.innerHTML = '';
+            (found.courses || []).forEach(function (c) {
+              var option = document.createElement('option');
+              option.value = c.course;
+              option.textContent = c.course + ' ' + c.name;
+              list.appendChild(option);
+            });
+          });
+      }, 150);
+    });
+  });
+})();
+</SCRIPT>
+""" % {'api': API_SEARCH}
+
+def make_html_tables(courses, student, year=None):
     """Produce the HTML for the course selection tables
     courses  dictionary  catalogue_designation -> course
     student  dictionary  semester_name -> student_semester
+    year  integer or None  year the student starts; if given, the first
+      empty selection of each semester suggests the courses the student
+      could take then
     """
+    if year is None:
+        suggested = {}
+    else:
+        suggested = suggest_courses(student, courses, year)
     r=["<TABLE name='student_choices'>\n"]
     r.append("  <TR>\n")
     r.append("  <TD>Transferred in</TD>\n")
     r.append("  <TD>\n")
-    r.append("  "+make_html_semester(student[SEMESTERS[0]], courses))
+    r.append("  "+make_html_semester(student[SEMESTERS[0]], courses))  # no suggestions for transfers
     r.append("  </TD></TR>\n")
-    r.append("  <TR><TH></TH> <TH>Fall</TH> <TH>Spring</TH> <TH>Summer</TH> </TR>\n")
-    for y in ['ONE', 'TWO', 'THREE']:
+    r.append("  <TR><TH></TH> "+''.join("<TH>"+ssn.long_name+"</TH> " for ssn in SEASONS)+"</TR>\n")
+    # A row for each year, with the seasons it has
+    for i, y in enumerate(PROGRAM_YEARS):
         r.append("  <TR>\n")
-        if y=='ONE':
-            s='First year'
-        elif y=='TWO':
-            s='Second year'
-        else:
-            s='Third year'
-        r.append("  <TD>"+s+"</TD>\n")
-        for w in ['FALL', 'SPRING', 'SUMMER']:
-            x = y+'_'+w
+        r.append("  <TD>"+PROGRAM_YEARS_LONG[y]+"</TD>\n")
+        for t in TERM_CALENDAR:
+            if t.year != i:
+                continue
             r.append("    <TD>\n")
-            student_sem = student[x]
-            r.append("    "+make_html_semester(student_sem, courses))
+            student_sem = student[t.name]
+            r.append("    "+make_html_semester(student_sem, courses, suggested.get(t.name)))
             r.append("    </TD>\n")
         r.append("  </TR>\n")
-    # year FOUR has no summer
-    y = 'FOUR'
-    r.append("  <TR>\n")
-    r.append("  <TD>Fourth year</TD>\n")
-    for w in ['FALL', 'SPRING']:
-        x = y+'_'+w
-        r.append("    <TD>\n")
-        student_sem = student[x]
-        r.append("    "+make_html_semester(student_sem, courses))
-        r.append("    </TD>\n")
-    r.append("  </TR>\n")
     # AFTER is different
     r.append("  <TR>\n")
-    r.append("  <TD>After four</TD>\n")
+    r.append("  <TD>After "+PROGRAM_YEARS[-1].lower()+"</TD>\n")
     r.append("  <TD>\n")
-    r.append("  "+make_html_semester(student[SEMESTERS[12]], courses))
+    r.append("  "+make_html_semester(student[SEMESTERS[-1]], courses, suggested.get(SEMESTERS[-1])))
     r.append("  </TD></TR>\n")
     r.append("  </TABLE>\n")
+    if len(courses) > LARGE_CATALOG:
+        r.append(SEARCH_SCRIPT)
     return ''.join(r)
 
 def _make_html_courses(courses,header,notes):
@@ -863,12 +1370,23 @@ def make_html_courses(courses):
     r.append(_make_html_courses(other_courses,"Other courses",""))
     return ''.join(r)
     
-def make_html(courses, student, year=THISYEAR, program='secondary', name='', submit=None, extra=""):
+def make_html(courses, student, year=THISYEAR, program='secondary', name='', submit=None, extra="", header=True):
     """Produce the HTML page.
+    header  boolean  Start with the CGI Content-type line?
+    """
+    return "".join(iter_html(courses, student, year, program, name, submit, extra, header))
+
+def iter_html(courses, student, year=THISYEAR, program='secondary', name='', submit=None, extra="", header=True):
+    """Generate the HTML page in pieces.  The form and the notes on the plan
+    come first, and each of the reference sections after them is only made
+    when it is reached, so a client can start showing the page early.
+    header  boolean  Start with the CGI Content-type line?
     """
     if name is None:
         name = ''
-    r=["Content-type: text/html\n\n"]
+    r = []
+    if header:
+        r.append("Content-type: text/html\n\n")
     r.append("<HTML>\n")
     r.append("<HEAD><TITLE>SMC Math-Education plan</TITLE>\n")
     r.append(CSS)
@@ -877,12 +1395,14 @@ def make_html(courses, student, year=THISYEAR, program='secondary', name='', sub
     r.append("<H2>Your plan for a Math-Education double major</H2>\n")
     r.append("<P>This worksheet helps you develop a plan to major in Mathematics and Education.\n")
     r.append("Fill out the form fields.  <a href='#sample_plans'>This list of sample plans</a> will help you get started.  Then hit <I>Submit</I>.</P>\n")
-    r.append("<P>Below the form will appear notes saying which of the many rules the entered plan does not meet.  Make some changes and hit <I>Submit</I> again.  You may take a few iterations.  When you are finished hit <I>Done</I> and you will get a summary, to print.  <B>This form does not save any data so to keep your work you must print the summary</B>.</P>\n")
+    r.append("<P>Below the form will appear notes saying which of the many rules the entered plan does not meet.  Make some changes and hit <I>Submit</I> again.  You may take a few iterations.  When you are finished hit <I>Done</I> and you will get a summary, to print.  <B>This form does not save any data so to keep your work you must print the summary</B>, or keep the link to the plan that appears below the form.</P>\n")
     r.append("<FORM action='' method='post'>\n")
     r.append("<P>Select the year that were a First Year student: "+make_year(selected=year)+".\n")
     r.append(" Select your program: "+make_program(program)+".\n")
     r.append(" Enter your name: <input type='text' name='name' value='{name}'></P>\n".format(name=name))
-    r.append(make_html_tables(courses,student))
+    yield "".join(r)
+    r = []
+    r.append(make_html_tables(courses,student,year))
     r.append("  <INPUT type='submit' name='submit' value='Submit'>\n")
     r.append("  <INPUT type='submit' name='submit' value='Done'>\n")
     r.append("</FORM>\n")
@@ -894,36 +1414,54 @@ def make_html(courses, student, year=THISYEAR, program='secondary', name='', sub
             r.append("  <LI>"+msg+"</LI>\n")
         r.append("  </OL>")
         r.append("<P><I>About any waivers or substitutions:</I> you should discuss them with your advisor and they must be approved by the Department Chairs.</P>\n")
+    if any(student[sem].courses for sem in SEMESTERS):
+        token = encode_plan(student, year, program, courses)
+        r.append("<P><A href='?plan={token}'>A link to this plan</A>; bookmark it, or send it to your advisor, to come back to the plan later.\n".format(token=token))
+        r.append("  <A href='?graph=plan&amp;plan={token}'>See the prerequisites in this plan as a graph.</A></P>\n".format(token=token))
+    yield "".join(r)
     # Include a reference list of courses
     # r.append("<HR>")
-    r.append("<H2>Reference information</H2>\n")
-    r.append(SAMPLE_PLAN_INTRO)
+    yield "<H2>Reference information</H2>\n"
+    yield SAMPLE_PLAN_INTRO
     firstyear, sophmore, junior, senior = year, year+1, year+2, year+3
-    if (year % 2) == 0:
-        r.append(SAMPLE_EVEN.format(firstyear=firstyear, sophmore=sophmore, junior=junior, senior=senior))
+    import maed_plan
+    samples = maed_plan.make_html_sample_plans(courses, year)
+    if samples:
+        yield samples
+    elif (year % 2) == 0:
+        yield SAMPLE_EVEN.format(firstyear=firstyear, sophmore=sophmore, junior=junior, senior=senior)
     else:
-        r.append(SAMPLE_ODD.format(firstyear=firstyear, sophmore=sophmore, junior=junior, senior=senior))  
-    r.append(MAJOR_REQUIREMENTS)
-    r.append(COURSES_OFFERED)
-    r.append("<H3>All courses</H3\n>")
-    r.append(make_html_courses(courses))
+        yield SAMPLE_ODD.format(firstyear=firstyear, sophmore=sophmore, junior=junior, senior=senior)
+    yield MAJOR_REQUIREMENTS
+    yield COURSES_OFFERED
+    yield "<H3>All courses</H3\n>"
+    yield make_html_courses(courses)
     # Get out
-    r.append("</BODY>\n")
-    r.append("</HTML>")
-    return "".join(r)
+    yield "</BODY>\n</HTML>"
 
 #------------------------------------
 # Make the plain text saveable version
-def make_plain(courses, student, year=THISYEAR, program='secondary', name=None, submit=None, extra=[]):
+def make_plain(courses, student, year=THISYEAR, program='secondary', name=None, submit=None, extra=[], header=True):
+    """Produce the plain text summary.
+    header  boolean  Start with the CGI Content-type line?
     """
+    return ''.join(iter_plain(courses, student, year, program, name, submit, extra, header))
+
+def iter_plain(courses, student, year=THISYEAR, program='secondary', name=None, submit=None, extra=[], header=True):
+    """Generate the plain text summary in pieces: the plan, then which courses
+    meet the Mathematics requirements, then the messages.
+    header  boolean  Start with the CGI Content-type line?
     """
-    r=["Content-type: text/plain\n\n"]
+    r = []
+    if header:
+        r.append("Content-type: text/plain\n\n")
     r.append("Summary of Mathematics-Education {program} Program\n\n".format(program=program.capitalize()))
     if name:
         r.append("Name: "+name+"\n")
     else:
         r.append("Name: --no name given--\n")
-    r.append("Date: {date}\n\n".format(date=datetime.datetime.now().strftime("%Y-%b-%d")))
+    r.append("Date: {date}\n".format(date=datetime.datetime.now().strftime("%Y-%b-%d")))
+    r.append("Plan code: {token}\n\n".format(token=encode_plan(student, year, program, courses)))
     for sem in SEMESTERS[1:-1]:
         if sem in student:
             course_list = student[sem].courses
@@ -935,7 +1473,16 @@ def make_plain(courses, student, year=THISYEAR, program='secondary', name=None,
         else:
             courses_this_sem = ' --'
         r.append("{sem_long}: {c}\n".format(sem_long=SEMESTERS_LONG[sem], c=courses_this_sem))
+    yield ''.join(r)
+    # Which course meets which requirement
+    r = []
+    r.append("\n\nCourses meeting the Mathematics requirements\n")
+    r.append("============================================\n")
+    for slot_name, c in program_checker_for(program, courses).assignment('math', plan_index(student, courses)):
+        r.append("  {slot}: {c}\n".format(slot=slot_name, c=c or '--not met--'))
+    yield ''.join(r)
     # Messages
+    r = []
     if extra:
         r.append("\n\nMessages about this program\n")
         r.append("===========================\n")
@@ -943,341 +1490,1690 @@ def make_plain(courses, student, year=THISYEAR, program='secondary', name=None,
         for msg in extra:
             r.append("  "+str(dex)+") "+msg+"\n")
             dex += 1
-    return ''.join(r)
+    yield ''.join(r)
 
 
 # -------------------------------------
 # Parse returned results
-def parse_data():
-    form = cgi.FieldStorage()
+# Limits on what a request may send; the form has 78 course boxes
+MAX_BODY = 64*1024  # bytes
+MAX_FIELDS = 256
+
+class bad_request(maedException):
+    """A request that cannot be read.
+      status  string  HTTP status to answer with
+    """
+    def __init__(self, message, status='400 Bad Request'):
+        maedException.__init__(self, message)
+        self.status = status
+
+class form_data(object):
+    """The fields of a submitted form, from read_form().  It has the two
+    methods of cgi.FieldStorage that the rest of this uses.
+      fields  dictionary  name -> list of values, in the order sent
+    """
+    def __init__(self, fields=None):
+        if fields is None:
+            fields = {}
+        self.fields = fields
+
+    def getfirst(self, name, default=None):
+        values = self.fields.get(name)
+        if values:
+            return values[0]
+        return default
+
+    def getlist(self, name):
+        return self.fields.get(name, [])
+
+def parse_fields(data, fields, max_fields=MAX_FIELDS):
+    """Add the fields of urlencoded data, such as a query string, to fields.
+    As with cgi.FieldStorage, fields with blank values are left out.
+    data  string  name=value pairs joined with &
+    fields  dictionary  name -> list of values
+    """
+    n = sum(len(values) for values in fields.values())
+    for pair in data.split('&'):
+        if not pair:
+            continue
+        n += 1
+        if n > max_fields:
+            raise bad_request("The form has more than {n} fields.".format(n=max_fields), '413 Content Too Large')
+        name, sep, value = pair.partition('=')
+        if not value:
+            continue
+        if '%' in pair or '+' in pair:
+            import urllib.parse
+            name, value = urllib.parse.unquote_plus(name), urllib.parse.unquote_plus(value)
+        values = fields.get(name)
+        if values is None:
+            fields[name] = [value]
+        else:
+            values.append(value)
+    return fields
+
+def read_body(environ=None, fp=None, max_body=MAX_BODY):
+    """Return the body of a request as bytes.  Raise bad_request if its
+    length is not a number or is more than max_body.
+    environ  dictionary or None  the CGI or WSGI environment; if None,
+      os.environ
+    fp  binary file or None  where the body is; if None, standard input
+    """
+    if environ is None:
+        environ = os.environ
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        raise bad_request("The content length is not a number.")
+    if length > max_body:
+        raise bad_request("The request is more than {n} bytes.".format(n=max_body), '413 Content Too Large')
+    if length <= 0:
+        return b''
+    if fp is None:
+        fp = sys.stdin.buffer
+    return fp.read(length)
+
+def read_form(environ=None, fp=None, max_body=MAX_BODY, max_fields=MAX_FIELDS):
+    """Read the form data of a request, from the query string and, for a 
+    POST, from an application/x-www-form-urlencoded body of at most 
+    max_body bytes.  Return a form_data instance.
+    environ  dictionary or None  the CGI or WSGI environment; if None, 
+      os.environ
+    fp  binary file or None  the request body; if None, standard input
+    """
+    if environ is None:
+        environ = os.environ
+    fields = {}
+    if environ.get('REQUEST_METHOD', 'GET') == 'POST':
+        content_type = environ.get('CONTENT_TYPE', '').split(';')[0].strip().lower()
+        if content_type not in ('', 'application/x-www-form-urlencoded'):
+            raise bad_request("Send the form as application/x-www-form-urlencoded.", '415 Unsupported Media Type')
+        body = read_body(environ, fp, max_body)
+        if body:
+            parse_fields(body.decode('utf-8', 'replace'), fields, max_fields)
+    parse_fields(environ.get('QUERY_STRING', ''), fields, max_fields)
+    return form_data(fields)
+
+def parse_data(form=None):
+    """Get the student's plan from the submitted form.
+    form  form_data instance, cgi.FieldStorage, or None  If None, read the
+      CGI request.
+    """
+    if form is None:
+        form = read_form()
     program = form.getfirst('program','secondary')
-    year = int(form.getfirst('catalogue_year', THISYEAR))
+    if program not in program_definitions():
+        raise bad_request("There is no program "+program+".")
+    year = plan_year(form.getfirst('catalogue_year', THISYEAR))
     name = form.getfirst('name','')
     submit = form.getfirst('submit',None)
-    # Student's program data
+    # Student's program data; typed into a search box, 'ma 160' is MA160
+    student = make_student(dict((s, [''.join(c.split()).upper() for c in form.getlist(s)]) for s in SEMESTERS))
+    return student, year, program, name, submit
+
+# A plan's year must fit in the two bytes it has in a plan token
+FIRST_YEAR, LAST_YEAR = 1900, 2999
+
+def plan_year(value):
+    """Return the year of a plan as an integer.  Raise bad_request if it is
+    not a number or is not between FIRST_YEAR and LAST_YEAR.
+    value  string or integer  the year as given
+    """
+    try:
+        year = int(value)
+    except (ValueError, TypeError):
+        raise bad_request("The year "+str(value)+" is not a number.")
+    if not(FIRST_YEAR <= year <= LAST_YEAR):
+        raise bad_request("The year {y} is not between {a} and {b}.".format(y=year, a=FIRST_YEAR, b=LAST_YEAR))
+    return year
+
+def make_student(plan):
+    """Return the student's program, a dictionary semester -> student_semester.
+    plan  dictionary  semester -> list of catalogue designations
+    """
     student = {}  # map semester -> student_semester
     for s in SEMESTERS:
         student[s] = student_semester(s)
-        course_list = form.getlist(s)
+        course_list = plan.get(s)
         if course_list:
             for c in course_list:
                 d = c.strip()
                 if d:
                     student[s].add_course(d)
-    return student, year, program, name, submit
+    for s in plan:
+        if s not in student:
+            raise maedException("No such semester: "+str(s))
+    return student
+
+def drop_unknown_courses(student, courses):
+    """Take out of the student's plan any courses not in the catalog, as can
+    be typed into a search box.  Return a list of messages naming them.
+    """
+    r = []
+    for sem in SEMESTERS:
+        student_sem = student[sem]
+        unknown = [c for c in student_sem.courses if c not in courses]
+        if unknown:
+            student_sem.courses = [c for c in student_sem.courses if c in courses]
+            for c in unknown:
+                r.append(diagnostic("Not a course in the catalog: "+c, check='catalog', course=c, semester=sem))
+    return r
+
+def plan_from_record(record, courses=None):
+    """Return the student, year, and program of a plan given as a record.
+    record  dictionary  either with the key 'token' giving a plan token from
+      encode_plan(), or with the key 'plan' giving a dictionary semester ->
+      list of catalogue designations, or with a key per semester giving the 
+      catalogue designations separated by spaces (as in a CSV row), and the
+      keys 'year' and 'program'
+    courses  catalog or None  for a token, the catalog it is for; if None,
+      that of the plan's year
+    """
+    if record.get('token'):
+        if not isinstance(record['token'], str):
+            raise bad_request("The plan code must be a string.")
+        return decode_plan(record['token'], courses)
+    year = plan_year(record.get('year') or THISYEAR)
+    program = record.get('program') or 'secondary'
+    if not isinstance(program, str):
+        raise bad_request("The program must be a string.")
+    if 'plan' in record:
+        plan = record['plan']
+        if not isinstance(plan, dict):
+            raise bad_request("The plan must be an object giving for each semester a list of courses.")
+        for (s, course_list) in plan.items():
+            if not(isinstance(course_list, list) and all(isinstance(c, str) for c in course_list)):
+                raise bad_request("The courses for "+str(s)+" must be a list of catalogue designations, like [\"MA150\", \"CS111\"].")
+    else:
+        plan = {}
+        for s in SEMESTERS:
+            if record.get(s):
+                if not isinstance(record[s], str):
+                    raise bad_request("The courses for "+s+" must be a string of catalogue designations.")
+                plan[s] = record[s].split()
+    return make_student(plan), year, program
 
 # -------------------------------------
-# Test the results
-def total_credits(student, courses):
-    total = 0
+# Plan tokens: a plan packed into a short string that can go in a URL
+# The bytes are: the format, a CRC-32 of the catalog version, the year, the
+# program, then for each semester the number of courses and their ids,
+# ascending and each as the gap from the one before, then a CRC-32 of all
+# that.  Numbers are varints: seven bits to a byte, low bits
+# first, the high bit set on all but the last byte.  The whole is base64url
+# with no padding.  Course ids are only good for the catalog they came from,
+# so a token is tied to that catalog's version.
+PLAN_TOKEN_FORMAT = 1
+
+def _put_varint(r, n):
+    """Append the varint of the integer n to the bytearray r.
+    """
+    while n >= 0x80:
+        r.append((n & 0x7f) | 0x80)
+        n >>= 7
+    r.append(n)
+
+def _get_varint(data, i):
+    """Return the varint at data[i:], and the index after it.
+    """
+    n, shift = 0, 0
+    while True:
+        b = data[i]
+        i += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, i
+        shift += 7
+
+def _catalog_tag(courses):
+    """Return the four bytes of a token that say which catalog it is for.
+    """
+    import binascii
+    return binascii.crc32(str(courses.version).encode('utf-8')).to_bytes(4, 'big')
+
+def encode_plan(student, year, program, courses):
+    """Return the plan as a token, a short string safe to use in a URL.
+    courses  catalog  the one the plan is tested against
+    """
+    import binascii
+    r = bytearray([PLAN_TOKEN_FORMAT])
+    r += _catalog_tag(courses)
+    r += year.to_bytes(2, 'big')
+    r.append(program_definitions()[program]['code'])
     for sem in SEMESTERS:
-        if sem in student:
-            total += student[sem].compute_credits(courses)
-    return total
+        ids = sorted(courses.ids[c] for c in student[sem].courses)
+        _put_varint(r, len(ids))
+        last = 0
+        for i in ids:
+            _put_varint(r, i-last)
+            last = i
+    r += binascii.crc32(r).to_bytes(4, 'big')
+    token = binascii.b2a_base64(bytes(r), newline=False).decode('ascii')
+    return token.rstrip('=').replace('+', '-').replace('/', '_')
+
+def decode_plan(token, courses=None):
+    """Return the student, year, and program of the plan in a token from
+    encode_plan().  Raise bad_request if the token is damaged or is for
+    another version of the catalog.
+    courses  catalog or None  if None, the catalog of the plan's year
+    """
+    import binascii
+    try:
+        token = token.strip().replace('-', '+').replace('_', '/')
+        data = binascii.a2b_base64(token+'='*(-len(token) % 4))
+    except (ValueError, UnicodeError):
+        raise bad_request("This plan code is damaged.")
+    if len(data) < 12 or binascii.crc32(data[:-4]) != int.from_bytes(data[-4:], 'big'):
+        raise bad_request("This plan code is damaged.")
+    if data[0] != PLAN_TOKEN_FORMAT:
+        raise bad_request("This plan code is from another version of the checker.")
+    year = int.from_bytes(data[5:7], 'big')
+    programs = [name for (name, d) in program_definitions().items() if d['code'] == data[7]]
+    if not programs:
+        raise bad_request("This plan code is for a program that there is no longer.")
+    program = programs[0]
+    if courses is None:
+        courses = catalog_for(year)
+    if data[1:5] != _catalog_tag(courses):
+        raise bad_request("This plan code is from another version of the course catalog.")
+    plan = {}
+    i, end = 8, len(data)-4
+    try:
+        for sem in SEMESTERS:
+            n, i = _get_varint(data, i)
+            course_list, last = [], 0
+            for k in range(n):
+                gap, i = _get_varint(data, i)
+                last += gap
+                course_list.append(courses.designations[last])
+            plan[sem] = course_list
+    except IndexError:
+        raise bad_request("This plan code is damaged.")
+    if i != end:
+        raise bad_request("This plan code is damaged.")
+    return make_student(plan), year, program
 
-def credits_test(student, courses):
+# -------------------------------------
+# Test the results
+class plan_index(object):
+    """What the tests need to know about a student's plan, found in one pass
+    over the semesters so that each test does not walk the plan again.
+      semesters  list of strings  the plan's semesters, in order
+      course_lists  dictionary  semester -> list of catalogue designations
+      course_sets  dictionary  semester -> set of catalogue designations
+      prior  dictionary  semester -> set of the courses in earlier semesters
+      credits  dictionary  semester -> number of credits
+      total_credits  integer  credits over all semesters
+      all_courses  set of all catalogue designations in the plan
+      lsc_four, lsc_two  integers  number of LSC full and half courses
+      first_semester  dictionary  catalogue designation -> earliest semester
+      masks  dictionary  semester -> bitmask of its courses
+      prior_masks  dictionary  semester -> bitmask of the earlier courses
+      all_mask  integer  bitmask of all the courses in the plan
+    The sets are shared, so the tests must not change them.
+    """
+    def __init__(self, student, courses):
+        self.semesters = []
+        self.course_lists = {}
+        self.course_sets = {}
+        self.prior = {}
+        self.credits = {}
+        self.total_credits = 0
+        self.all_courses = set()
+        self.lsc_four, self.lsc_two = 0, 0
+        self.first_semester = {}
+        self.masks = {}
+        self.prior_masks = {}
+        so_far = 0
+        for sem in SEMESTERS:
+            if sem in student:
+                self.semesters.append(sem)
+                course_list = student[sem].courses
+                self.course_lists[sem] = course_list
+                self.course_sets[sem] = set(course_list)
+                self.prior[sem] = set(self.all_courses)
+                credits, m = 0, 0
+                for c in course_list:
+                    crs = courses[c]
+                    credits += crs.credits
+                    m |= 1 << crs.id
+                    if c == 'LSC004':
+                        self.lsc_four += 1
+                    if c == 'LSC002':
+                        self.lsc_two += 1
+                    if c not in self.first_semester:
+                        self.first_semester[c] = sem
+                self.credits[sem] = credits
+                self.total_credits += credits
+                self.masks[sem] = m
+                self.prior_masks[sem] = so_far
+                so_far |= m
+                self.all_courses |= self.course_sets[sem]
+        self.all_mask = so_far
+
+def total_credits(student, courses, index=None):
+    if index is None:
+        index = plan_index(student, courses)
+    return index.total_credits
+
+def credits_test(student, courses, index=None):
     """Test that the student will have the number of credits needed to graduate.
     Return a list of strings.
     """
     r = []
-    creds = total_credits(student, courses)
+    creds = total_credits(student, courses, index)
     if creds < 128:
-        r.append("Number of credits={creds} is less than the 128 required to graduate.".format(creds=str(creds)))
+        r.append(diagnostic("Number of credits={creds} is less than the 128 required to graduate.".format(creds=str(creds)), 'credits'))
     return r
 
-def credits_per_semester_test(student, courses):
+def credits_per_semester_test(student, courses, index=None):
     """Test that each semester does not have too many or too few credits.
     Return a list of strings 
     """
+    if index is None:
+        index = plan_index(student, courses)
+    r = []
+    for sem in index.semesters:
+        r += _credits_semester_test(sem, index)
+    return r
+
+def _credits_semester_test(sem, index):
+    """The credits_per_semester_test() messages for one semester.
+    """
     r = []
     s = "Problem with the number of credits in a semester: "
-    for sem in SEMESTERS[1:-1]:
-        if sem in student:
-            courses_this_sem = student[sem].courses
-            credits_this_sem = 0
-            for c in courses_this_sem:
-                credits_this_sem += courses[c].credits 
-            if credits_this_sem == 0:
-                pass
-            elif ((credits_this_sem < 12)
-                  and (sem.endswith('FALL') or sem.endswith('SPRING'))):
-                r.append(s+"with only "+str(credits_this_sem)+" credits in "+SEMESTERS_LONG[sem]+" semester you may have trouble with financial aid because full time requires 12 credits.")
-            elif ((credits_this_sem > 18)
-                  and (sem.endswith('FALL') or sem.endswith('SPRING'))):
-                r.append(s+"you cannot take "+str(credits_this_sem)+" credits in "+SEMESTERS_LONG[sem]+" semester because the maximum is 18.")
+    ssn = TERMS[sem].season
+    if ssn is not None:
+        credits_this_sem = index.credits[sem]
+        if credits_this_sem == 0:
+            pass
+        elif ((ssn.min_credits is not None)
+              and (credits_this_sem < ssn.min_credits)):
+            r.append(diagnostic(s+"with only "+str(credits_this_sem)+" credits in "+SEMESTERS_LONG[sem]+" semester you may have trouble with financial aid because full time requires "+str(ssn.min_credits)+" credits.", 'credits_per_semester', None, sem))
+        elif ((ssn.max_credits is not None)
+              and (credits_this_sem > ssn.max_credits)):
+            r.append(diagnostic(s+"you cannot take "+str(credits_this_sem)+" credits in "+SEMESTERS_LONG[sem]+" semester because the maximum is "+str(ssn.max_credits)+".", 'credits_per_semester', None, sem))
     return r
 
-def prerequisites_test(student, courses):
+def prerequisites_test(student, courses, index=None):
     """Test that the courses are arranged so their prerequisites and 
     corequisites are satisfied.  Return a list of strings 
     """
+    if index is None:
+        index = plan_index(student, courses)
     r = []
-    courses_so_far = set()
-    for sem in SEMESTERS:
-        if sem in student:
-            courses_this_sem = set(student[sem].courses)
-            for c in courses_this_sem:
-                r += courses[c].check_prequisite_courses(courses_so_far,courses_this_sem)
-            courses_so_far |= courses_this_sem
+    for sem in index.semesters:
+        r += _prerequisites_semester_test(sem, courses, index)
+    return r
+
+def _prerequisites_semester_test(sem, courses, index):
+    """The prerequisites_test() messages for the courses of one semester.
+    """
+    r = []
+    prior_mask = index.prior_masks[sem]
+    through_mask = prior_mask | index.masks[sem]
+    courses_so_far = index.prior[sem]
+    courses_this_sem = index.course_sets[sem]
+    for c in courses_this_sem:
+        crs = courses[c]
+        # Only a course with something missing needs the messages
+        if ((crs.prerequisite_mask & ~prior_mask)
+            or (crs.corequisite_mask & ~through_mask)):
+            r += crs.check_prequisite_courses(courses_so_far,courses_this_sem,sem,courses)
     return r
 
-def lsc_test(student, courses):
+def lsc_test(student, courses, index=None):
     """Test that there are enough LSC's.  Return a list of strings 
     """
+    if index is None:
+        index = plan_index(student, courses)
     r = []
-    lsc_four_credit_total = 0
-    lsc_two_credit_total = 0
-    for sem in SEMESTERS:
-        if sem in student:
-            courses_this_sem = student[sem].courses
-            for c in courses_this_sem:
-                if c == 'LSC004':
-                    lsc_four_credit_total += 1
-                if c == 'LSC002':
-                    lsc_two_credit_total += 1
+    lsc_four_credit_total = index.lsc_four
+    lsc_two_credit_total = index.lsc_two
     if lsc_four_credit_total < 9:
-        r.append("You have "+str(lsc_four_credit_total)+" LSC full courses but you need to list nine of them.")
+        r.append(diagnostic("You have "+str(lsc_four_credit_total)+" LSC full courses but you need to list nine of them.", 'lsc', 'LSC004'))
     if lsc_two_credit_total < 1:
-        r.append("You don't have any LSC half courses but you need to list one for the arts requirement.")
+        r.append(diagnostic("You don't have any LSC half courses but you need to list one for the arts requirement.", 'lsc', 'LSC002'))
     return r
 
-def get_all_courses(student,courses):
+def get_all_courses(student,courses,index=None):
     """Return a set of the catalogue description strings of all the 
     courses in the program.  Note that it returns a set, not a list.
+    The caller may change the set.
     """
-    courses_so_far = set()
-    for sem in SEMESTERS:
-        if sem in student:
-            courses_this_sem = set(student[sem].courses)
-            courses_so_far |= courses_this_sem
-    return courses_so_far
+    if index is None:
+        index = plan_index(student, courses)
+    return set(index.all_courses)
+
+class requirement_slot(object):
+    """A place in a program's requirements that one course can fill.
+    name  string  what to call the slot
+    courses  set of catalogue designations that fill it
+    prefixes  tuple of strings  any course starting with one of these fills it
+    """
+    def __init__(self, name, courses=(), prefixes=()):
+        self.name = name
+        self.courses = set(courses)
+        self.prefixes = tuple(prefixes)
 
-def math_requirements_test(student, courses, program):
-    """Check that the math requirements have been met.  Return a list of error
-    strings.
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return "requirement_slot("+self.name+")"
+
+    def accepts(self, c):
+        return (c in self.courses) or c.startswith(self.prefixes)
+
+def match_slots(slots, candidates):
+    """Fill as many slots as possible, each course filling at most one slot.
+    It is a maximum bipartite matching, built by finding an augmenting path
+    for each slot in turn.  A slot once filled stays filled, so the slots
+    earlier in the list have priority when not all can be filled.  Return
+    a list, parallel to slots, of the catalogue designation filling each
+    slot or None.
+    slots  list of requirement_slot instances
+    candidates  set of catalogue designations
     """
-    r = []
-    s = "Mathematics major requirement not met: "
-    all_courses = get_all_courses(student,courses)
-    # MA 150
-    c = 'MA150'
-    if not(c) in all_courses:
-        r.append(s+"you must take "+c+".  If you transfered it into SMC then enter it into the first set of selections.")
-    all_courses.discard(c)
-    # Other required courses
-    for c in ['CS111', 'MA160', 'MA211', 'MA213', 'MA240']:
-        if not(c) in all_courses:
-            r.append(s+"you must take "+c+".")
-        all_courses.discard(c)
-    # MA381 or MA380
-    c1, c2 = 'MA381', 'MA380'
-    if (not(c1 in all_courses)
-        and not(c2 in all_courses)):
-        r.append(s+"you must take one of "+c1+" or "+c2+".")
-    all_courses.discard(c1)
-    all_courses.discard(c2)
-    # MA 401 or MA 406
-    c1, c2 = 'MA401', 'MA406'
-    if (not(c1 in all_courses)
-        and not(c2 in all_courses)):
-        if program=='primary':            
-            r.append(s+"you must take one of "+c1+" or "+c2+" (unless it is waived, with a substitute of ED421).")
+    candidates = sorted(candidates)  # so the assignment is repeatable
+    edges = [[c for c in candidates if slot.accepts(c)] for slot in slots]
+    filled_by = {}  # catalogue designation -> index of slot it fills
+
+    def augment(i, seen):
+        for c in edges[i]:
+            if c in seen:
+                continue
+            seen.add(c)
+            if (c not in filled_by) or augment(filled_by[c], seen):
+                filled_by[c] = i
+                return True
+        return False
+
+    for i in range(len(slots)):
+        augment(i, set())
+    r = [None]*len(slots)
+    for c, i in filled_by.items():
+        r[i] = c
+    return r
+
+# -------------------------------------
+# Programs
+# Each program is defined by a file NAME.json in PROGRAM_DIR, an object with
+#   title  what the form calls it
+#   code  integer 0 to 255, unique, that stands for it in plan codes; do not
+#     reuse the code of a program that has been dropped
+#   checks  object check -> what starts its messages; the checks are the
+#     tests of PROGRAM_CHECKS, and the messages go with that test's
+#   requirements  list of rules, each with its check and one of
+#     "required": course
+#     "one_of": [course, ..]
+#     "at_level": [prefix, ..], with "count" and "name", for count courses
+#       whose designations start with one of the prefixes
+#     "substitute": course, with "with": [course, ..] that the student may
+#       get permission to take instead
+#     "together": [course, ..], with "alone" true if they must be the only
+#       courses in their semester
+#   The rules say what is wrong in a "message" or, for "at_level", in
+#   "messages", one for each number of the courses that the plan has; for
+#   "substitute", "substitute_message" is used when the plan has one of the
+#   substitutes, and for "together", "messages" has one for each course,
+#   given when that is the first one missing, and "semester_message" is
+#   given when they are in a semester wrongly.  These have defaults.
+# The required, one_of, at_level, and substitute rules of a check each fill
+# requirement slots, filled by match_slots() in the order of the rules.
+PROGRAM_DIR = os.path.join(os.path.dirname(COURSEFILE), 'programs')
+PROGRAM_SUFFIX = '.json'
+# The definitions are kept compiled, so that a request need not parse JSON
+PROGRAM_SNAPSHOT = os.path.join(PROGRAM_DIR, 'programs'+SNAPSHOT_SUFFIX)
+PROGRAM_SNAPSHOT_FORMAT = 1
+PROGRAM_CHECKS = ('math', 'ed')
+RULE_KINDS = ('required', 'one_of', 'at_level', 'substitute', 'together')
+ORDINALS = ('first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh', 'eighth', 'ninth', 'tenth')
+
+# The definitions read, the triple stamp of the files, dictionary name ->
+# definition, and when the files were last looked at
+_PROGRAMS = None
+# Seconds between looks at whether the files have changed
+PROGRAM_RECHECK = 1.0
+
+def _program_error(fn, s):
+    return maedException("In the program file "+fn+": "+s)
+
+def _string_list(fn, rule, key):
+    """Return the rule's list of strings, checking that it is one.
+    """
+    value = rule.get(key, [])
+    if not isinstance(value, list) or not all(isinstance(x, str) and x for x in value):
+        raise _program_error(fn, "the "+key+" of a rule must be a list of strings.")
+    return value
+
+def _read_rule(fn, rule, checks):
+    """Return the rule with the defaults filled in, as the dictionary with
+    the keys check, kind, name, courses, prefixes, count, substitutes, 
+    alone, course (the one its messages are about, or None), messages, and 
+    semester_message.
+    """
+    if not isinstance(rule, dict):
+        raise _program_error(fn, "each requirement must be an object.")
+    kinds = [kind for kind in RULE_KINDS if kind in rule]
+    if len(kinds) != 1:
+        raise _program_error(fn, "each requirement must have one of "+", ".join(RULE_KINDS)+".")
+    kind = kinds[0]
+    check = rule.get('check')
+    if check not in checks:
+        raise _program_error(fn, "the check of a rule must be one of those in checks, not "+str(check)+".")
+    r = {'check': check, 'kind': kind, 'name': rule.get('name'), 'courses': [], 'prefixes': [],
+         'count': 1, 'substitutes': [], 'alone': False, 'course': None, 'semester_message': None}
+    if kind in ('required', 'substitute'):
+        c = rule[kind]
+        if not isinstance(c, str) or not c:
+            raise _program_error(fn, "the "+kind+" course must be a string.")
+        r['courses'] = [c]
+        r['course'] = c
+        r['name'] = r['name'] or c
+        if kind == 'required':
+            messages = ["you must take "+c+"."]
         else:
-            r.append(s+"you must take one of "+c1+" or "+c2+".")
-    if c1 in all_courses:
-        all_courses.discard(c1)
-    elif c2 in all_courses:
-        all_courses.discard(c2)
-    # MA410
-    c = 'MA410'
-    if not(c) in all_courses:
-        r.append(s+"you must take "+c+" (unless it is waived, with a substitute of ED427).")
-    all_courses.discard(c)
-    # One more course numbered 400+
-    found, c400 = False, None
-    for c in all_courses:
-        if c[:3]=='MA4':
-            found, c400 = True, c
-            break
-    if not(found):
-        r.append(s+"you must take an additional 400-level class.")
-    if not(c400 is None):
-        all_courses.discard(c400)
-    # Two more courses numbered 200+
-    c1, c2 = None, None
-    for c in all_courses:
-        prefix = c[:3]
-        if prefix in ['MA2', 'MA3', 'MA4']:
-            if c1 is None:
-                c1 = c
+            r['substitutes'] = _string_list(fn, rule, 'with')
+            if not r['substitutes']:
+                raise _program_error(fn, "a substitute rule must say what can be taken instead.")
+            alternatives = " or ".join(r['substitutes'])
+            messages = ["you must take "+c+", although if you take "+alternatives+" you may be allowed to substitute that course for this one.",
+                        "you must take "+c+", unless you have permission to substitute "+alternatives+" for it."]
+            messages[1] = rule.get('substitute_message', messages[1])
+    elif kind == 'one_of':
+        r['courses'] = _string_list(fn, rule, 'one_of')
+        if not r['courses']:
+            raise _program_error(fn, "a one_of rule must list courses.")
+        r['name'] = r['name'] or " or ".join(r['courses'])
+        messages = ["you must take one of "+" or ".join(r['courses'])+"."]
+    elif kind == 'at_level':
+        r['prefixes'] = _string_list(fn, rule, 'at_level')
+        count = rule.get('count', 1)
+        if not r['prefixes'] or not r['name'] or not isinstance(count, int) or not (1 <= count <= len(ORDINALS)):
+            raise _program_error(fn, "an at_level rule must list prefixes, and have a name and a count from 1 to "+str(len(ORDINALS))+".")
+        r['count'] = count
+        messages = ["you must take "+str(count-k)+" more "+r['name']+(" courses." if count-k > 1 else " course.") for k in range(count)]
+        if 'messages' in rule:
+            messages = _string_list(fn, rule, 'messages')
+            if len(messages) != count:
+                raise _program_error(fn, "an at_level rule must have a message for each of its courses.")
+    else:  # together
+        r['courses'] = _string_list(fn, rule, 'together')
+        if len(r['courses']) < 2:
+            raise _program_error(fn, "a together rule must list two or more courses.")
+        r['alone'] = bool(rule.get('alone', False))
+        r['name'] = r['name'] or _and_list(r['courses'])
+        messages = ["you must take "+_and_list(r['courses'])+" in the same semester." for c in r['courses']]
+        if 'messages' in rule:
+            messages = _string_list(fn, rule, 'messages')
+            if len(messages) != len(r['courses']):
+                raise _program_error(fn, "a together rule must have a message for each of its courses.")
+        r['semester_message'] = rule.get('semester_message',
+                                         "you must take "+_and_list(r['courses'])+" in the same semester"+(", and those can be the only courses that you take in that semester." if r['alone'] else "."))
+    if 'message' in rule:
+        messages[0] = rule['message']
+    r['messages'] = messages
+    return r
+
+def read_program_file(fn):
+    """Read a program's definition from its file.  Return it as a dictionary
+    with the keys title, code, checks, and requirements, a list of rules as
+    from _read_rule().  Raise maedException if it is not right.
+    """
+    import json
+    try:
+        with open(fn, encoding='utf-8') as f:
+            d = json.load(f)
+    except ValueError as e:
+        raise _program_error(fn, str(e))
+    if not isinstance(d, dict):
+        raise _program_error(fn, "it must hold an object.")
+    title, code, checks = d.get('title'), d.get('code'), d.get('checks', {})
+    if not isinstance(title, str) or not title:
+        raise _program_error(fn, "it must give a title.")
+    if not isinstance(code, int) or not (0 <= code <= 255):
+        raise _program_error(fn, "it must give a code from 0 to 255.")
+    if not isinstance(checks, dict) or any(check not in PROGRAM_CHECKS or not isinstance(prefix, str) for (check, prefix) in checks.items()):
+        raise _program_error(fn, "its checks must be an object taking some of "+", ".join(PROGRAM_CHECKS)+" to strings.")
+    requirements = d.get('requirements')
+    if not isinstance(requirements, list):
+        raise _program_error(fn, "it must list the requirements.")
+    return {'title': title, 'code': code, 'checks': checks,
+            'requirements': [_read_rule(fn, rule, checks) for rule in requirements]}
+
+def _program_stamp(dirname):
+    """Return a tuple saying which program files there are, and when each was
+    last changed.
+    """
+    r = []
+    with os.scandir(dirname) as entries:
+        for entry in entries:
+            if entry.name.endswith(PROGRAM_SUFFIX):
+                st = entry.stat()
+                r.append((entry.name, st.st_mtime_ns, st.st_size))
+    return tuple(sorted(r))
+
+def _read_program_snapshot(fn):
+    """Return the contents of the programs' snapshot, or None.
+    """
+    try:
+        with open(fn, 'rb') as f:
+            snapshot = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(snapshot, tuple) or snapshot[0] != PROGRAM_SNAPSHOT_FORMAT:
+        return None
+    return snapshot
+
+def _write_program_snapshot(fn, stamp, definitions):
+    data = marshal.dumps((PROGRAM_SNAPSHOT_FORMAT, stamp, definitions))
+    tmp = fn+'.'+str(os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, fn)
+    except OSError as e:
+        if VERBOSE:
+            warn("unable to save the programs snapshot: "+str(e))
+
+def program_definitions(dirname=PROGRAM_DIR):
+    """Return the dictionary program name -> definition, as from
+    read_program_file(), for the files in the directory.  They are kept,
+    and read again when a file changes.
+    """
+    global _PROGRAMS
+    now = time.monotonic()
+    if _PROGRAMS is not None and _PROGRAMS[0][0] == dirname and now < _PROGRAMS[2]+PROGRAM_RECHECK:
+        return _PROGRAMS[1]
+    stamp = _program_stamp(dirname)
+    if _PROGRAMS is not None and _PROGRAMS[0] == (dirname, stamp):
+        _PROGRAMS = (_PROGRAMS[0], _PROGRAMS[1], now)
+        return _PROGRAMS[1]
+    snapshot_fn = os.path.join(dirname, os.path.basename(PROGRAM_SNAPSHOT))
+    snapshot = _read_program_snapshot(snapshot_fn)
+    if snapshot is not None and snapshot[1] == stamp:
+        definitions = snapshot[2]
+    else:
+        definitions = {}
+        codes = {}
+        for fn, mtime, size in stamp:
+            d = read_program_file(os.path.join(dirname, fn))
+            name = fn[:-len(PROGRAM_SUFFIX)]
+            if d['code'] in codes:
+                raise _program_error(os.path.join(dirname, fn), "its code is the same as that of "+codes[d['code']]+".")
+            codes[d['code']] = name
+            definitions[name] = d
+        _write_program_snapshot(snapshot_fn, stamp, definitions)
+    _PROGRAMS = ((dirname, stamp), definitions, now)
+    return definitions
+
+def programs_version():
+    """Return a value that changes when the files of the programs do, for
+    keeping things made from the programs.
+    """
+    program_definitions()
+    return _PROGRAMS[0]
+
+def program_names():
+    """Return the list of the names of the programs, in the order of their
+    codes.
+    """
+    definitions = program_definitions()
+    return sorted(definitions, key=lambda name: definitions[name]['code'])
+
+def _prefix_mask(courses, prefix):
+    """Return the bitmask of the courses whose designations start with the
+    prefix.  The ids are in the order of the designations, so these are a
+    run of them.
+    """
+    lo = bisect.bisect_left(courses.designations, prefix)
+    hi = bisect.bisect_left(courses.designations, prefix[:-1]+chr(ord(prefix[-1])+1))
+    return ((1 << hi)-1) ^ ((1 << lo)-1)
+
+class program_checker(object):
+    """A program's requirements compiled against a catalog, as made by 
+    compile_program().
+      name  string  the program
+      title  string  what the form calls it
+      code  integer  for it in plan codes
+      courses  catalog  the one it was compiled against
+      prefixes  dictionary  check -> string starting its messages
+      rules  dictionary  check -> list of pairs rule, index of its first slot
+      slots  dictionary  check -> list of requirement_slot instances
+      masks  dictionary  check -> bitmask of the courses in the catalog that 
+        its rules name or accept, so that only those can change its messages
+      fixed  dictionary  check -> list of triples slot index, catalogue
+        designation, bitmask, for the slots of one course that no other slot
+        of the check accepts, which are filled just when the plan has it
+      matched  dictionary  check -> list of the indexes of the other slots,
+        which match_slots() fills
+      match_masks  dictionary  check -> bitmask of the courses those accept
+      semester_rules  dictionary  check -> list of pairs together rule, set
+        of its courses
+      alone  list of tuples of catalogue designations  the groups of courses 
+        that must be alone in their semester
+    """
+    def __init__(self, name, definition, courses):
+        self.name = name
+        self.title = definition['title']
+        self.code = definition['code']
+        self.courses = courses
+        self.prefixes = definition['checks']
+        self.rules = dict((check, []) for check in PROGRAM_CHECKS)
+        self.slots = dict((check, []) for check in PROGRAM_CHECKS)
+        self.masks = dict((check, 0) for check in PROGRAM_CHECKS)
+        self.semester_rules = dict((check, []) for check in PROGRAM_CHECKS)
+        self.fixed = dict((check, []) for check in PROGRAM_CHECKS)
+        self.matched = dict((check, []) for check in PROGRAM_CHECKS)
+        self.match_masks = dict((check, 0) for check in PROGRAM_CHECKS)
+        self.alone = []
+        self._dependencies = {}
+        for rule in definition['requirements']:
+            check = rule['check']
+            m = courses.mask(cd for cd in rule['courses']+rule['substitutes'] if cd in courses)
+            for prefix in rule['prefixes']:
+                m |= _prefix_mask(courses, prefix)
+            self.masks[check] |= m
+            if rule['kind'] == 'together':
+                self.semester_rules[check].append((rule, set(rule['courses'])))
+                if rule['alone']:
+                    self.alone.append(tuple(rule['courses']))
+                self.rules[check].append((rule, None))
+                continue
+            slots = self.slots[check]
+            self.rules[check].append((rule, len(slots)))
+            for k in range(rule['count']):
+                slot_name = rule['name'] if k == 0 else rule['name']+", "+ORDINALS[k]
+                slots.append(requirement_slot(slot_name, rule['courses'], rule['prefixes']))
+        # A slot that only its own course fills needs no matching
+        for check, slots in self.slots.items():
+            for i, slot in enumerate(slots):
+                c = next(iter(slot.courses)) if len(slot.courses) == 1 and not slot.prefixes else None
+                if c is not None and c in courses and not any(other.accepts(c) for other in slots if other is not slot):
+                    self.fixed[check].append((i, c, 1 << courses.ids[c]))
+                else:
+                    self.matched[check].append(i)
+                    self.match_masks[check] |= courses.mask(cd for cd in slot.courses if cd in courses)
+                    for prefix in slot.prefixes:
+                        self.match_masks[check] |= _prefix_mask(courses, prefix)
+
+    def assignment(self, check, index):
+        """Return a list of pairs slot name, catalogue designation (or None)
+        saying which course fills each of the check's requirement slots.
+        """
+        slots = self.slots[check]
+        filled = [None]*len(slots)
+        for i, c, bit in self.fixed[check]:
+            if index.all_mask & bit:
+                filled[i] = c
+        matched = self.matched[check]
+        if matched:
+            candidates = self.courses.designations_in(index.all_mask & self.match_masks[check])
+            for i, c in zip(matched, match_slots([slots[i] for i in matched], candidates)):
+                filled[i] = c
+        return list(zip([slot.name for slot in slots], filled))
+
+    def overall_messages(self, check, index):
+        """Return the messages of the check about which courses are in the
+        plan, not when.
+        """
+        r = []
+        prefix = self.prefixes.get(check, '')
+        all_courses = index.all_courses
+        filled = [c for (slot_name, c) in self.assignment(check, index)]
+        for rule, first in self.rules[check]:
+            messages = rule['messages']
+            if first is None:  # together
+                for c, msg in zip(rule['courses'], messages):
+                    if c not in all_courses:
+                        r.append(diagnostic(prefix+msg, check, c))
+                        break
+            elif rule['kind'] == 'substitute':
+                if filled[first] is None:
+                    has_substitute = any(c in all_courses for c in rule['substitutes'])
+                    r.append(diagnostic(prefix+messages[1 if has_substitute else 0], check, rule['course']))
             else:
-                c2 = c
-    if c1 is None:
-        r.append(s+"you must take two additional classes numbered 200 or above.")
-    elif c2 is None:
-        r.append(s+"you must take an additional classes numbered 200 or above.")
-    if not(c1 is None):
-        all_courses.discard(c1)
-    if not(c2 is None):
-        all_courses.discard(c2)
-    # Return the list of error strings
+                for k in range(rule['count']):
+                    if filled[first+k] is None:
+                        r.append(diagnostic(prefix+messages[k], check, rule['course']))
+                        break
+        return r
+
+    def semester_messages(self, check, sem, index):
+        """Return the messages of the check about the courses of one
+        semester.
+        """
+        r = []
+        semester_courses = index.course_sets[sem]
+        for rule, group in self.semester_rules[check]:
+            if not semester_courses.isdisjoint(group):
+                if rule['alone']:
+                    ok = semester_courses == group
+                else:
+                    ok = group <= semester_courses
+                if not ok:
+                    r.append(diagnostic(self.prefixes.get(check, '')+rule['semester_message'], check, None, sem))
+        return r
+
+    def dependencies(self, c):
+        """Return the set of the checks whose messages can change when
+        course c is added to or dropped from the plan.
+        """
+        r = self._dependencies.get(c)
+        if r is None:
+            i = self.courses.ids.get(c)
+            r = frozenset(check for check in PROGRAM_CHECKS if i is not None and (self.masks[check] >> i) & 1)
+            self._dependencies[c] = r
+        return r
+
+# Compiled programs, by name, catalog version, and program files
+_CHECKERS = {}
+_CHECKERS_SIZE = 16
+
+def program_checker_for(program, courses):
+    """Return the program_checker for the program and the catalog.  Cached
+    by catalog version.  Raise maedException if there is no such program.
+    """
+    definitions = program_definitions()
+    if program not in definitions:
+        raise maedException("No such program: "+str(program))
+    version = getattr(courses, 'version', None)
+    key = (program, version, programs_version())
+    if version is not None and key in _CHECKERS:
+        return _CHECKERS[key]
+    checker = program_checker(program, definitions[program], courses)
+    if version is not None:
+        if len(_CHECKERS) >= _CHECKERS_SIZE:
+            _CHECKERS.clear()
+        _CHECKERS[key] = checker
+    return checker
+
+def program_courses(program):
+    """Return the set of the courses that a program's rules name.
+    """
+    r = set()
+    for rule in program_definitions()[program]['requirements']:
+        r.update(rule['courses'])
+        r.update(rule['substitutes'])
     return r
 
-def ed_requirements_test(student, courses, program):
+def program_requirements_test(check, student, courses, program, index=None):
+    """Check that the program's requirements of the check have been met.
+    Return a list of error strings.
+    """
+    if index is None:
+        index = plan_index(student, courses)
+    checker = program_checker_for(program, courses)
+    r = checker.overall_messages(check, index)
+    for sem in index.semesters:
+        r += checker.semester_messages(check, sem, index)
+    return r
+
+def math_requirements_test(student, courses, program, index=None):
+    """Check that the math requirements have been met.  Return a list of error
+    strings.
+    """
+    return program_requirements_test('math', student, courses, program, index)
+
+def ed_requirements_test(student, courses, program, index=None):
     """Check that the ed requirements have been met.  Return a list of error
     strings.
     """
+    return program_requirements_test('ed', student, courses, program, index)
+
+def academic_year(sem, year):
+    """Return the calendar year of the Fall of the academic year that the
+    program semester is in, or None for BEFORE and AFTER.
+    year  integer  the year the student starts
+    """
+    t = TERMS[sem]
+    if t.year is None:
+        return None
+    return year+t.year
+
+def semester_term(sem, year):
+    """Return the calendar term of the program semester, the pair calendar
+    year, season name (say 'FALL'), or None for BEFORE and AFTER.
+    year  integer  the year the student starts
+    """
+    t = TERMS[sem]
+    if t.season is None:
+        return None
+    return year+t.year+t.season.year_offset, t.season.name
+
+def parity_attribute(fall_year):
+    """Return the course attribute that says whether a course is given in
+    an academic year whose Fall is in the calendar year.
+    """
+    if (fall_year % 2) == 0:
+        return 'year_even_fall'
+    return 'year_odd_fall'
+
+def offered_attributes(ssn, fall_year):
+    """Return the tuple of the course attributes that must all be True for
+    a course to be given in the season of the academic year whose Fall is in
+    the calendar year.
+    ssn  season instance
+    """
+    if ssn.offered is None:
+        return (parity_attribute(fall_year),)
+    return (parity_attribute(fall_year), ssn.offered)
+
+class term_year(object):
+    """Where a program semester falls for a student starting in a given
+    year.
+      term  term instance
+      calendar_year  integer or None  the calendar year of the semester;
+        None for BEFORE and AFTER
+      offered  tuple of strings  the course attributes that must all be True
+        for a course to be given then, as from offered_attributes()
+    """
+    def __init__(self, t, year):
+        self.term = t
+        if t.season is None:
+            self.calendar_year = None
+            self.offered = ()
+        else:
+            self.calendar_year = year+t.year+t.season.year_offset
+            self.offered = offered_attributes(t.season, year+t.year)
+
+# Entry year -> dictionary semester -> term_year
+_TERM_TABLES = {}
+
+def term_table(year):
+    """Return the dictionary program semester -> term_year instance for a
+    student starting in the year.  These are made once for each year.
+    """
+    table = _TERM_TABLES.get(year)
+    if table is None:
+        table = _TERM_TABLES[year] = dict((t.name, term_year(t, year)) for t in TERM_CALENDAR)
+    return table
+
+def offered_mask(courses, sem, year):
+    """Return the bitmask of the courses offered in the program semester.
+    year  integer  the year the student starts
+    """
+    m = -1  # all courses
+    for attribute in term_table(year)[sem].offered:
+        m &= courses.offered[attribute]
+    return m
+
+def calendar_key(cal_year, season_name):
+    """Return a key that sorts calendar terms, pairs calendar year, season
+    name, in the order of the calendar.
+    """
+    for i, ssn in enumerate(SEASONS):
+        if ssn.name == season_name:
+            return cal_year, -ssn.year_offset, i
+    raise maedException("No such season: "+str(season_name))
+
+def offering_calendar(courses, cd, first, last):
+    """Return the list of calendar terms, pairs calendar year, season name,
+    in the calendar years from first to last, in which the catalog has the 
+    course given, in the order of the calendar.
+    """
+    c = courses[cd]
     r = []
-    s = "Education major requirement not met: " 
-    all_courses = get_all_courses(student,courses)
-    if program=='primary':
-        # Required courses
-        for c in ['ED231', 'ED251', 'ED300', 'ED325', 'ED335', 'ED339', 'ED340', 'ED427']:
-            if not(c) in all_courses:
-                r.append(s+"you must take "+c+".")
-            all_courses.discard(c)
-    else:  # program is 'secondary'
-        # Required courses
-        for c in ['ED231', 'ED271', 'ED343', 'ED361', 'ED370', 'ED423']:
-            if not(c) in all_courses:
-                r.append(s+"you must take "+c+".")
-            all_courses.discard(c)
-        # ED367
-        c = 'ED367'
-        if not(c) in all_courses:
-            if 'MA381' in all_courses:
-                r.append(s+"you must take "+c+", unless you get permission to substitute MA381.")
-            else:
-                r.append(s+"you must take "+c+", although if you take MA381 you may be allowed to substitute that course for this one.")
-        all_courses.discard(c)
-        # ED450
-        c = 'ED450'
-        if not(c) in all_courses:
-            if (('MA304' in all_courses)
-                or ('MA308' in all_courses)):
-                r.append(s+"you must take "+c+", unless you have permission to substitute MA304 or MA308 for it.")
-            else:
-                r.append(s+"you must take "+c+", although if you take MA304 or MA308 you may be allowed to substitute that course for this one.")
-        all_courses.discard(c)
-    # ED 428 and ED 475
-    c1, c2 = 'ED428', 'ED475'
-    these_two = {c1, c2}
-    if not(c1 in all_courses):
-        r.append(s+"you must take "+c1+" along with "+c2+", and you must take those two in the same semester, and they must be the only two courses that you take in that semester.")
-    elif not(c2 in all_courses):
-        r.append(s+"besides "+c1+" you must also take "+c2+", and you must take them in the same semester, and they must be the only two courses that you take in that semester.")
+    for fall_year in range(first-max(ssn.year_offset for ssn in SEASONS), last+1):
+        for ssn in SEASONS:
+            cal_year = fall_year+ssn.year_offset
+            if (first <= cal_year <= last
+                and all(getattr(c, attribute) for attribute in offered_attributes(ssn, fall_year))):
+                r.append((cal_year, ssn.name))
+    r.sort(key=lambda cal_term: calendar_key(*cal_term))
+    return r
+
+def suggest_courses(student, courses, year, index=None):
+    """Find, for each semester, the courses the student could add there: the
+    ones not yet taken whose prerequisites are met by the earlier semesters
+    and that are offered that semester.  Return a dictionary semester ->
+    sorted list of catalogue designations.
+    """
+    if index is None:
+        index = plan_index(student, courses)
+    r = {}
+    so_far = 0
     for sem in SEMESTERS:
-        if sem in student:
-            semester_courses = student[sem].courses  # set of cat designations of courses
-            if ((c1 in semester_courses)
-                or (c2 in semester_courses)):
-                if not set(semester_courses) == these_two:
-                    r.append(s+"you must take "+c1+" and "+c2+" in the same semester, and those can be the only courses that you take in that semester.")
-            if c1 in semester_courses:
-                all_courses.discard(c1)
-            if c2 in semester_courses:
-                all_courses.discard(c2)
+        prior = index.prior_masks.get(sem, so_far)
+        taken = prior | index.masks.get(sem, 0)
+        so_far = taken
+        m = courses.eligible(prior) & offered_mask(courses, sem, year) & ~taken
+        r[sem] = courses.designations_in(m)
     return r
 
-def semester_offered_test(student, courses, year):
+# Course search, for the type-ahead on the form.  Past LARGE_CATALOG courses
+# the form has search boxes in place of select lists of the whole catalog.
+SEARCH_LIMIT = 20
+SEARCH_BUDGET = 0.025  # secs; past this, return what has been found so far
+LARGE_CATALOG = 400
+
+def name_words(name):
+    """Return the list of the lowercase words in a course name.
+    """
+    import re
+    return re.findall(r'\w+', name.lower())
+
+def search_courses(courses, query, semester=None, year=THISYEAR, limit=SEARCH_LIMIT, budget=SEARCH_BUDGET):
+    """Find the courses matching the query, best first.  A query matches
+    a course if, with the spaces taken out, it starts the catalogue 
+    designation (so 'MA4' and 'ED 3' both work), or if each of its words 
+    is in the course name.  Designation matches come first, then courses
+    whose name has words starting with the query words, then the rest, 
+    each in catalogue order.  Return the pair list of catalogue designations,
+    boolean saying whether the time budget ran out before all of the 
+    candidates were looked at.
+    courses  catalog
+    query  string  what the user typed
+    semester  string or None  if given, only courses offered then
+    year  integer  year the student starts, for the courses offered in
+      alternate years
+    limit  integer  most courses to return
+    budget  float  seconds to spend looking at name matches
+    """
+    start_time = time.perf_counter()
+    allowed = -1
+    if semester is not None:
+        if semester not in SEMESTERS:
+            raise maedException("No such semester: "+str(semester))
+        allowed = offered_mask(courses, semester, year)
+    found = {}  # designation -> rank
+    # Designations, from the sorted list; ids are in the same order, so the
+    # first ones found are the ones to return
+    key = ''.join(query.split()).upper()
+    if key:
+        i = bisect.bisect_left(courses.designations, key)
+        offered = bin(allowed)[:1:-1] if allowed >= 0 else None
+        while (i < len(courses.designations) and len(found) < limit
+               and courses.designations[i].startswith(key)):
+            cd = courses.designations[i]
+            if offered is None or offered[i:i+1] == '1':
+                found[cd] = 0 if cd == key else 1
+            i += 1
+    # Names, from the trigrams and word starts
+    words = name_words(query)
+    partial = False
+    if words and len(found) < limit:
+        m = allowed
+        for word in words:
+            if len(word) < 3:
+                m &= courses.word_starts.get(word, 0)
+            else:
+                for i in range(len(word)-2):
+                    m &= courses.trigrams.get(word[i:i+3], 0)
+            if not m:
+                break
+        # Look at the candidates in catalogue order until there are enough
+        # of the best kind
+        bits = bin(m)[:1:-1] if m > 0 else ''
+        best = sum(1 for rank in found.values() if rank < 3)
+        n = 0
+        i = bits.find('1')
+        while i >= 0 and best < limit:
+            n += 1
+            if n % 64 == 0 and time.perf_counter()-start_time > budget:
+                partial = True
+                break
+            cd = courses.designations[i]
+            i = bits.find('1', i+1)
+            if cd in found:
+                continue
+            name = name_words(courses[cd].name)
+            if all(any(w.startswith(word) for w in name) for word in words):
+                found[cd] = 2
+                best += 1
+            elif all(len(word) >= 3 and any(word in w for w in name) for word in words):
+                found[cd] = 3
+    return sorted(found, key=lambda cd: (found[cd], cd))[:limit], partial
+
+def search_json(courses, query):
+    """Answer a course search.  Return the pair HTTP status, JSON string.
+    courses  catalog or None  if None, the catalog of the year asked about
+    query  dictionary  the fields of the query string, from parse_fields(), 
+      with q the text to search for, and optionally semester and year to limit
+      it to the courses offered then, and limit
+    """
+    import json
+    try:
+        q = query.get('q', [''])[0]
+        semester = query.get('semester', [None])[0] or None
+        year = int(query.get('year', [THISYEAR])[0])
+        limit = min(int(query.get('limit', [SEARCH_LIMIT])[0]), 100)
+        if courses is None:
+            courses = catalog_for(year)
+        found, partial = search_courses(courses, q, semester, year, limit)
+    except (ValueError, OSError, maedException) as e:
+        return '400 Bad Request', json.dumps({'error': str(e)})
+    r = {'query': q,
+         'partial': partial,
+         'courses': [{'course': cd, 'name': courses[cd].name.strip(), 'credits': courses[cd].credits} for cd in found]}
+    return '200 OK', json.dumps(r)
+
+def semester_offered_test(student, courses, year, index=None):
     """Check that the courses are offered in the semester they are being
     listed.
     """
+    if index is None:
+        index = plan_index(student, courses)
     r = []
-    s = "Problem with the semester or year that you've chosen a course: "
-    # Find which progam semesters have a Fall with an even-numbered year
-    odd, even = set(), set() 
-    for sem in SEMESTERS:
-        prefix = sem[:3]
-        if prefix in ['ONE', 'THR']:
-            if (year % 2) == 0:
-                even.add(sem)
-            else:
-                odd.add(sem)
-        elif prefix in ['TWO', 'FOU']: 
-            if (year % 2) == 0:
-                odd.add(sem)
-            else:
-                even.add(sem)
-    # print("odd is",str(odd))
     # Go through the semesters and see if the courses are offered then.
-    for sem in SEMESTERS:
-        if sem in student:
-            semester_courses = student[sem].courses  # set of cat designations of courses
-            # r.append("semester_courses is "+str(semester_courses))
-            for c in semester_courses:
-                course_instance = courses[c]
-                # r.append("  course_instance is "+str(course_instance))
-                # r.append("  course_instance.fall is "+str(course_instance.fall))
-                if ((sem in odd)
-                    and not(course_instance.year_odd_fall)):
-                    r.append(s+c+" is not given in odd-numbered years.")
-                if ((sem in even)
-                    and not(course_instance.year_even_fall)):
-                    r.append(s+c+" is not given in even-numbered years.")
-                if ((sem.endswith('FALL'))
-                    and not(course_instance.fall)):
-                    r.append(s+c+" is not given in the Fall semester.")
-                if ((sem.endswith('SPRING'))
-                    and not(course_instance.spring)):
-                    r.append(s+c+" is not given in the Spring semester.")
+    table = term_table(year)
+    for sem in index.semesters:
+        r += _offered_semester_test(sem, courses, index, table[sem])
     return r
 
-def requirements_test(student, year, program, submit, courses):
+# What semester_offered_test() says of a course without the attribute
+NOT_OFFERED = {'year_odd_fall': " is not given in odd-numbered years.",
+               'year_even_fall': " is not given in even-numbered years."}
+NOT_OFFERED.update((ssn.offered, " is not given in the "+ssn.long_name+" semester.") for ssn in SEASONS if ssn.offered)
+
+def _offered_semester_test(sem, courses, index, when):
+    """The semester_offered_test() messages for one semester.
+    when  term_year instance  for the semester, from term_table()
+    """
     r = []
-    r += prerequisites_test(student, courses)
-    r += math_requirements_test(student, courses, program)
-    r += ed_requirements_test(student, courses, program)    
-    r += semester_offered_test(student, courses, year)
-    r += credits_per_semester_test(student, courses)    
-    r += lsc_test(student, courses)
-    r += credits_test(student, courses)
+    s = "Problem with the semester or year that you've chosen a course: "
+    # Skip a semester whose courses are all offered then
+    m = -1
+    for attribute in when.offered:
+        m &= courses.offered[attribute]
+    if not(index.masks[sem] & ~m):
+        return r
+    semester_courses = index.course_lists[sem]  # list of cat designations of courses
+    for c in semester_courses:
+        course_instance = courses[c]
+        for attribute in when.offered:
+            if not(getattr(course_instance, attribute)):
+                r.append(diagnostic(s+c+NOT_OFFERED[attribute], 'offered', c, sem))
     return r
 
+def requirements_test(student, year, program, submit, courses, timer=None):
+    return requirements_results(student, year, program, courses, timer).messages()
+
+# -------------------------------------
+# Revalidate after an edit
+# The tests run by requirements_test(), in the order of their messages
+TESTS = ('prerequisites', 'math', 'ed', 'offered', 'credits_per_semester', 'lsc', 'credits')
+# The tests, or the parts of them, that look at one semester at a time
+SEMESTER_TESTS = ('prerequisites', 'math', 'ed', 'offered', 'credits_per_semester')
+
+class plan_results(object):
+    """The messages of requirements_test() for one plan, kept by test, and
+    for the semester by semester tests by semester, so that after an edit
+    revalidate() need only redo the parts that the edit affects.
+      student  dictionary  semester -> student_semester
+      year  integer  year the student starts
+      program  string  one of program_names()
+      index  plan_index instance
+      checker  program_checker instance  for the program
+      overall  dictionary  test -> list of strings
+      by_semester  dictionary  test -> dictionary semester -> list of strings
+      rerun  list of pairs  test, semester (or None) that were found afresh
+    """
+    def __init__(self, student, year, program, index, checker):
+        self.student = student
+        self.year = year
+        self.program = program
+        self.index = index
+        self.checker = checker
+        self.overall = {}
+        self.by_semester = dict((test, {}) for test in SEMESTER_TESTS)
+        self.rerun = []
+
+    def messages(self):
+        """Return the list of strings that requirements_test() gives.
+        """
+        r = []
+        for test in TESTS:
+            r += self.overall.get(test, [])
+            if test in self.by_semester:
+                by_sem = self.by_semester[test]
+                for sem in self.index.semesters:
+                    r += by_sem[sem]
+        return r
+
+    def run_overall(self, test, courses):
+        """Find the messages of the part of test that looks at the whole plan.
+        """
+        student, index = self.student, self.index
+        if test in PROGRAM_CHECKS:
+            r = self.checker.overall_messages(test, index)
+        elif test == 'lsc':
+            r = lsc_test(student, courses, index)
+        elif test == 'credits':
+            r = credits_test(student, courses, index)
+        else:
+            r = []
+        self.overall[test] = r
+        self.rerun.append((test, None))
+
+    def run_semester(self, test, sem, courses):
+        """Find the messages of test for one semester.
+        """
+        index = self.index
+        if test == 'prerequisites':
+            r = _prerequisites_semester_test(sem, courses, index)
+        elif test in PROGRAM_CHECKS:
+            r = self.checker.semester_messages(test, sem, index)
+        elif test == 'offered':
+            r = _offered_semester_test(sem, courses, index, term_table(self.year)[sem])
+        else:
+            r = _credits_semester_test(sem, index)
+        self.by_semester[test][sem] = r
+        self.rerun.append((test, sem))
+
+def requirements_results(student, year, program, courses, timer=None):
+    """Run all of the tests.  Return a plan_results instance.
+    timer  request_timer instance or None  if given, time indexing the plan
+      and each test
+    """
+    with stage(timer, 'index'):
+        results = plan_results(student, year, program, plan_index(student, courses), program_checker_for(program, courses))
+    for test in TESTS:
+        with stage(timer, 'check-'+test):
+            results.run_overall(test, courses)
+    for test in SEMESTER_TESTS:
+        with stage(timer, 'check-'+test):
+            for sem in results.index.semesters:
+                results.run_semester(test, sem, courses)
+    results.rerun = []
+    return results
+
+def test_dependencies(c, checker):
+    """Return the set of the whole-plan tests whose result can change when
+    course c is added to or dropped from the plan.  (The semester by semester
+    tests depend on the course through the semester it is in, and through the
+    prerequisites and corequisites of the later semesters' courses.)
+    c  string  catalogue designation
+    checker  program_checker instance  for the plan's program
+    """
+    r = {'credits'} | checker.dependencies(c)
+    if c in ('LSC004', 'LSC002'):
+        r.add('lsc')
+    return r
+
+def revalidate(results, delta, courses):
+    """Test a plan that differs from an already tested one in only a few
+    semesters, redoing only the tests and semesters that the change affects.
+    Return a plan_results instance whose messages() are the same as those of
+    requirements_test() on the new plan.
+    results  plan_results instance  for the earlier plan; it is not changed
+    delta  dictionary  semester -> list of catalogue designations, the new
+      courses for each semester that changed
+    courses  dictionary  catalogue_designation -> course
+    """
+    student = dict(results.student)
+    changed_sems = set()
+    changed = set()  # courses whose number of appearances in the plan changed
+    for sem, course_list in delta.items():
+        if sem not in student:
+            raise maedException("No such semester: "+str(sem))
+        new = student_semester(sem)
+        for c in course_list:
+            d = c.strip()
+            if d:
+                new.add_course(d)
+        old_list = student[sem].courses
+        if new.courses != old_list:
+            student[sem] = new
+            changed_sems.add(sem)
+            for c in set(old_list) | set(new.courses):
+                if old_list.count(c) != new.courses.count(c):
+                    changed.add(c)
+    old_index = results.index
+    new_results = plan_results(student, results.year, results.program, plan_index(student, courses), program_checker_for(results.program, courses))
+    new_index = new_results.index
+    new_results.overall = dict(results.overall)
+    new_results.by_semester = dict((test, dict(by_sem)) for (test, by_sem) in results.by_semester.items())
+    # The whole-plan tests that depend on a changed course
+    affected = set()
+    for c in changed:
+        affected |= test_dependencies(c, new_results.checker)
+    for test in TESTS:
+        if test in affected:
+            new_results.run_overall(test, courses)
+    # Every test for the changed semesters
+    for sem in new_index.semesters:
+        if sem in changed_sems:
+            for test in SEMESTER_TESTS:
+                new_results.run_semester(test, sem, courses)
+            continue
+        # A later semester's prerequisites, if what came before changed
+        # in a way that matters to one of its courses; the messages name
+        # the missing courses all along a prerequisite's chain
+        diff = old_index.prior_masks[sem] ^ new_index.prior_masks[sem]
+        if diff:
+            for c in new_index.course_sets[sem]:
+                crs = courses[c]
+                if (crs.prerequisite_mask | crs.corequisite_mask | crs.prerequisite_closure) & diff:
+                    new_results.run_semester('prerequisites', sem, courses)
+                    break
+    return new_results
+
 #==================================================================
-def main(args):
-    courses = read_coursefile()
-    # for c in courses:
-    #     print(repr(courses[c]))
-    # catalogue_designations = sorted(courses.keys())
-    # print(_make_select_tag('BEFORE',courses,catalogue_designations,'MA150'))
-    # ss = student_semester('BEFORE')
-    # print(make_html_semester(ss,courses))
-    student, year, program, name, submit = parse_data()
-    extra = requirements_test(student, year, program, submit, courses)
-    # extra.append("value of submit is "+str(submit))
+def validate_json(courses, body, timer=None):
+    """Test a plan sent as JSON, without making any of the page.  Return the
+    pair HTTP status, JSON string.  The answer lists the messages from
+    requirements_test() as objects with the keys check, course, semester,
+    and message.
+    courses  catalog or None  if None, the catalog of the plan's year
+    body  bytes or string  a JSON object like
+      {"year": 2024, "program": "secondary",
+       "plan": {"BEFORE": ["MA150"], "ONE_FALL": ["CS111", "MA160"], ..}}
+    """
+    import json
+    try:
+        with stage(timer, 'parse'):
+            record = json.loads(body)
+            if not isinstance(record, dict):
+                raise ValueError("The plan must be a JSON object.")
+            student, year, program = plan_from_record(record, courses)
+            if program not in program_definitions():
+                raise ValueError("No such program: "+program)
+        if courses is None:
+            with stage(timer, 'load'):
+                courses = catalog_for(year)
+        unknown = [c for sem in SEMESTERS for c in student[sem].courses if c not in courses]
+        if unknown:
+            raise ValueError("Unknown catalogue designation: "+', '.join(unknown))
+    except (ValueError, maedException) as e:
+        return '400 Bad Request', json.dumps({'error': str(e)})
+    # Past here an exception is the server's fault, not the request's
+    messages = requirements_test(student, year, program, None, courses, timer)
+    token = encode_plan(student, year, program, courses)
+    r = {'ok': not(messages),
+         'year': year,
+         'program': program,
+         'catalog': courses.version,
+         'token': token,
+         'diagnostics': [m.as_dict() for m in messages]}
+    return '200 OK', json.dumps(r)
+
+def respond(courses, form=None, header=True):
+    """Handle one request: parse the plan, test it, and produce the page.
+    Return the pair content type, page.
+    courses  catalog or None  if None, the catalog of the plan's year
+    form  form_data instance or None  If None, read the CGI request.
+    header  boolean  Start the page with the CGI Content-type line?
+    """
+    content_type, chunks = respond_chunks(courses, form, header)
+    return content_type, ''.join(chunks)
+
+def respond_chunks(courses, form=None, header=True, timer=None):
+    """As respond(), but return the pair content type, generator of the
+    pieces of the page.  The plan is parsed and tested before this returns,
+    so any problem with the request shows up before any of the page is sent.
+    A request with graph=math, graph=ed, or graph=plan gets that SVG instead.
+    timer  request_timer instance or None  if given, time the stages
+    """
+    with stage(timer, 'parse'):
+        if form is None:
+            form = read_form()
+        graph = form.getfirst('graph')
+        if graph and graph != 'plan':
+            import maed_graph
+            if graph not in maed_graph.GRAPHS:
+                raise bad_request("There is no graph "+graph+".")
+        student, year, program, name, submit = parse_data(form)
+    token = form.getfirst('plan')
+    if token:
+        # A plan from its link, in place of the form's fields
+        with stage(timer, 'load'):
+            student, year, program = decode_plan(token, courses)
+    if courses is None:
+        with stage(timer, 'load'):
+            courses = catalog_for(year)
+    unknown = drop_unknown_courses(student, courses)
+    if graph:
+        import maed_graph
+        with stage(timer, 'graph'):
+            if graph == 'plan':
+                svg = maed_graph.plan_svg(student, courses)
+            else:
+                svg = maed_graph.department_svg(courses, graph)
+        return 'image/svg+xml', iter([svg])
+    extra = unknown+requirements_test(student, year, program, submit, courses, timer)
+    if submit=='Done' and name and os.environ.get(STORE_VAR):
+        import maed_store
+        with stage(timer, 'store'):
+            maed_store.save_submitted(os.environ[STORE_VAR], name, year, program, student, courses)
     if submit=='Done':
-        print(make_plain(courses, student, year, program, name, submit, extra))
+        return 'text/plain', iter_plain(courses, student, year, program, name, submit, extra, header=header)
+    else:
+        return 'text/html', iter_html(courses, student, year, program, name, submit, extra, header=header)
+
+# -------------------------------------
+# Timing and profiling the requests
+# Set this to log a line of JSON to stderr with the times of each request
+TIMING_LOG_VAR = 'MAED_TIMING_LOG'
+# Set this to a fraction, such as 0.01, to profile that many of the requests
+PROFILE_VAR = 'MAED_PROFILE'
+# .. and this to the directory for the .pstats files (default: the temp dir)
+PROFILE_DIR_VAR = 'MAED_PROFILE_DIR'
+
+class request_timer(object):
+    """The time taken by each stage of handling one request.
+      start  float  when the request started, from time.perf_counter()
+      stages  list of pairs  stage name, seconds; a stage timed more than
+        once is added up
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = []
+        self._where = {}  # stage name -> index in stages
+
+    def add(self, name, secs):
+        if name in self._where:
+            i = self._where[name]
+            self.stages[i] = (name, self.stages[i][1]+secs)
+        else:
+            self._where[name] = len(self.stages)
+            self.stages.append((name, secs))
+
+    def stage(self, name):
+        """Return a context manager timing its block as the stage name.
+        """
+        return _timed_stage(self, name)
+
+    def timed_chunks(self, chunks, name='render'):
+        """Generate the pieces of a page, timing the making of them as the
+        stage name.
+        """
+        chunks = iter(chunks)
+        while True:
+            t = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                self.add(name, time.perf_counter()-t)
+                return
+            self.add(name, time.perf_counter()-t)
+            yield chunk
+
+    def server_timing(self):
+        """Return the value of a Server-Timing header, the times in ms.
+        """
+        return ', '.join("{name};dur={ms:.3f}".format(name=name, ms=1000*secs) for (name, secs) in self.stages)
+
+    def log_line(self, **fields):
+        """Return a line of JSON with the fields, the time of each stage and
+        the total, in ms.
+        """
+        import json
+        r = dict(fields)
+        r['total_ms'] = round(1000*(time.perf_counter()-self.start), 3)
+        r['stages'] = dict((name, round(1000*secs, 3)) for (name, secs) in self.stages)
+        return json.dumps(r, sort_keys=True)
+
+class _timed_stage(object):
+    """Time a block as a stage of a request_timer; see request_timer.stage().
+    A timer of None does nothing.
+    """
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.timer is not None:
+            self.timer.add(self.name, time.perf_counter()-self.start)
+        return False
+
+def stage(timer, name):
+    """Return a context manager timing the stage, or doing nothing if timer
+    is None.
+    """
+    return _timed_stage(timer, name)
+
+def start_profile():
+    """Start and return a cProfile.Profile for this request if it falls in
+    the fraction given by the environment variable, else return None.
+    """
+    try:
+        fraction = float(os.environ.get(PROFILE_VAR) or 0)
+    except ValueError:
+        return None
+    if fraction <= 0:
+        return None
+    import random
+    if random.random() >= fraction:
+        return None
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+def finish_request(timer, profile=None, **fields):
+    """After the request is sent: write the log line if that is asked for,
+    and save the profile, if any.
+    """
+    if profile is not None:
+        profile.disable()
+        import tempfile
+        directory = os.environ.get(PROFILE_DIR_VAR) or tempfile.gettempdir()
+        fn = os.path.join(directory, "maed-{t}-{pid}.pstats".format(t=time.strftime('%Y%m%d-%H%M%S'), pid=os.getpid()))
+        try:
+            profile.dump_stats(fn)
+        except OSError as e:
+            warn("unable to save the profile "+fn+": "+str(e))
+    if VERBOSE or os.environ.get(TIMING_LOG_VAR):
+        sys.stderr.write(timer.log_line(**fields)+"\n")
+        sys.stderr.flush()
+
+GZIP_LEVEL = 6
+
+def accepts_gzip(accept_encoding):
+    """Does the value of an Accept-Encoding header allow a gzipped answer?
+    accept_encoding  string  like 'gzip, deflate;q=0.5' (may be empty)
+    """
+    q = {}
+    for item in accept_encoding.split(','):
+        params = item.split(';')
+        coding = params[0].strip().lower()
+        if not coding:
+            continue
+        q[coding] = 1.0
+        for param in params[1:]:
+            k, sep, v = param.partition('=')
+            if k.strip().lower() == 'q':
+                try:
+                    q[coding] = float(v)
+                except ValueError:
+                    q[coding] = 0.0
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in q:
+            return q[coding] > 0
+    return False
+
+def encode_chunks(chunks, compress=False):
+    """Generate the pieces of a page as UTF-8 bytes, gzipped if compress.
+    Each piece is flushed through the compressor so it can go out at once.
+    chunks  iterable of strings
+    """
+    if not(compress):
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+        return
+    import zlib
+    z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16+zlib.MAX_WBITS)  # gzip wrapper
+    for chunk in chunks:
+        b = z.compress(chunk.encode('utf-8'))+z.flush(zlib.Z_SYNC_FLUSH)
+        if b:
+            yield b
+    yield z.flush()
+
+def report_exception(etype, value, tb):
+    """Show an exception that got this far on the page, with cgitb, which
+    is only loaded now.  For sys.excepthook.
+    """
+    try:
+        import cgitb
+    except ImportError:  # gone in Python 3.13
+        import traceback
+        sys.stdout.write("Content-type: text/plain\n\n")
+        traceback.print_exception(etype, value, tb, file=sys.stdout)
     else:
-        print(make_html(courses, student, year, program, name, submit, extra))
+        cgitb.handler((etype, value, tb))
 
+def main(args):
+    """CGI entry point; the long-running server is in maed_server.py
+    """
+    sys.excepthook = report_exception
+    timer = request_timer()
+    profile = start_profile()
+    # The catalog is read once the plan's year is known
+    if os.environ.get('PATH_INFO') == API_VALIDATE:
+        try:
+            status, body = validate_json(None, read_body(), timer)
+        except bad_request as e:
+            import json
+            status, body = e.status, json.dumps({'error': str(e)})
+        print("Status: "+status)
+        print("Server-Timing: "+timer.server_timing())
+        print("Content-type: application/json\n")
+        print(body)
+        finish_request(timer, profile, path=API_VALIDATE, status=status[:3])
+        return
+    if os.environ.get('PATH_INFO') == API_SEARCH:
+        with timer.stage('search'):
+            status, body = search_json(None, parse_fields(os.environ.get('QUERY_STRING', ''), {}))
+        print("Status: "+status)
+        print("Server-Timing: "+timer.server_timing())
+        print("Content-type: application/json\n")
+        print(body)
+        finish_request(timer, profile, path=API_SEARCH, status=status[:3])
+        return
+    try:
+        content_type, chunks = respond_chunks(None, header=False, timer=timer)
+    except bad_request as e:
+        print("Status: "+e.status)
+        print("Content-type: text/plain\n")
+        print(str(e))
+        finish_request(timer, profile, path=os.environ.get('PATH_INFO', ''), status=e.status[:3])
+        return
+    out = sys.stdout.buffer
+    # The page is made as it is sent, so its time is only in the log line
+    headers = ["Content-type: "+content_type+"; charset=utf-8",
+               "Vary: Accept-Encoding",
+               "Server-Timing: "+timer.server_timing()]
+    compress = accepts_gzip(os.environ.get('HTTP_ACCEPT_ENCODING', ''))
+    if compress:
+        headers.append("Content-Encoding: gzip")
+    out.write(("\n".join(headers)+"\n\n").encode('ascii'))
+    for b in encode_chunks(timer.timed_chunks(chunks), compress):
+        out.write(b)
+        out.flush()
+    finish_request(timer, profile, path=os.environ.get('PATH_INFO', ''), status='200')
 
 #==================================================================
 if __name__ == '__main__':
-    main(None)
-    # sys.exit(0)
-    # try:
-    #     start_time = time.time()
-    #     parser = argparse.ArgumentParser(description=globals()['__doc__'])
-    #     parser.add_argument('-v','--version', action='version', version='%(prog)s '+globals()['__version__'])
-    #     parser.add_argument('-D', '--debug', action='store_true', default=False, help='run debugging code')
-    #     parser.add_argument('-V', '--verbose', action='store_true', default=False, help='verbose output')
-    #     args = parser.parse_args()
-    #     args = vars(args)
-    #     if ('debug' in args) and args['debug']: 
-    #         DEBUG = True
-    #     if ('verbose' in args) and args['verbose']: 
-    #         VERBOSE = True
-    #     main(args)
-    #     if VERBOSE: 
-    #         print('elapsed secs: {:.2f}'.format(time.time()-start_time))
-    #     sys.exit(0)
-    # except KeyboardInterrupt as e:   # Ctrl-C
-    #     raise e
-    # except SystemExit as e:   # sys.exit()
-    #     raise e
-    # except Exception as e:
-    #     print('UNEXPECTED OUTCOME')
-    #     print(str(e))
-    #     traceback.print_exc()
-    #     os._exit(1)
+    import argparse
+    parser = argparse.ArgumentParser(description=globals()['__doc__'])
+    parser.add_argument('-v','--version', action='version', version='%(prog)s '+globals()['__version__'])
+    parser.add_argument('-V', '--verbose', action='store_true', default=False, help='log the time taken by each stage of the request')
+    # A web server may pass words of the query string as arguments
+    args, rest = parser.parse_known_args()
+    args = vars(args)
+    VERBOSE = args['verbose']
+    main(args)
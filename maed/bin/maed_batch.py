@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Check many MATH-ED plans at once, on a pool of processes.
+
+Plans are read from a JSONL file, one plan per line, like this.
+  {"name": "A. Student", "year": 2024, "program": "secondary",
+   "plan": {"BEFORE": ["MA150"], "ONE_FALL": ["CS111", "MA160"], ..}}
+or from a CSV file whose header line has the columns name, year, program,
+and one column per semester (BEFORE, ONE_FALL, ..) with the catalogue
+designations separated by spaces.  The results are written as JSONL.
+"""
+__version__ = '0.9.0'
+__author__ = 'Jim Hefferon'
+__license__ = 'GPL 3'
+
+import sys, os, csv, json, time, argparse
+import multiprocessing
+
+import maed
+
+WORKERS = os.cpu_count() or 1
+BATCH_SIZE = 256  # plans handed to each worker at a time
+
+# The catalog for this worker, if one was given; see _init_worker()
+courses = None
+
+
+def _init_worker(fn):
+    """Read the catalog, once per worker process.  With no course file the
+    catalog of each plan's year is used, read when first needed.
+    """
+    global courses
+    if fn is not None:
+        courses = maed.load_catalog(fn)
+
+def check_plan(item):
+    """Check one plan.  Return whether it passed, and the result as a line
+    of JSON.
+    item  pair  line number, and either a line of JSONL or a CSV row
+    """
+    line_number, record = item
+    result = {'line': line_number}
+    try:
+        if isinstance(record, str):
+            record = json.loads(record)
+        result['name'] = record.get('name', '')
+        student, year, program = maed.plan_from_record(record, courses)
+        result['year'], result['program'] = year, program
+        crs = courses if courses is not None else maed.catalog_for(year)
+        messages = maed.requirements_test(student, year, program, None, crs)
+        result['ok'] = not(messages)
+        result['messages'] = messages
+    except KeyError as e:
+        result['error'] = "Unknown catalogue designation "+str(e)
+    except (ValueError, AttributeError, OSError, maed.maedException) as e:
+        result['error'] = str(e)
+    return result.get('ok', False), json.dumps(result)
+
+def read_plans(f, fmt):
+    """Generate the pairs line number, record from the input file.
+    fmt  string  one of 'jsonl', 'csv'
+    """
+    if fmt == 'csv':
+        for line_number, row in enumerate(csv.DictReader(f), 2):  # after the header
+            yield line_number, row
+    else:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                yield line_number, line
+
+def batches(iterable, n):
+    """Generate lists of up to n items, so only that many are in memory.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def check_plans(infile, outfile, fmt, fn=None, workers=WORKERS, batch_size=BATCH_SIZE):
+    """Check the plans read from infile, writing the results to outfile.
+    Return the numbers of plans checked and passed, and the elapsed seconds.
+    """
+    start_time = time.perf_counter()
+    checked, passed = 0, 0
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(fn,)) as pool:
+        for batch in batches(read_plans(infile, fmt), batch_size*workers):
+            for ok, result in pool.imap(check_plan, batch, chunksize=batch_size):
+                outfile.write(result+"\n")
+                checked += 1
+                if ok:
+                    passed += 1
+            if maed.VERBOSE:
+                elapsed = time.perf_counter()-start_time
+                maed.warn("{n} plans checked, {r:.1f} plans/sec".format(n=checked, r=checked/elapsed))
+    return checked, passed, time.perf_counter()-start_time
+
+
+#==================================================================
+def main(args):
+    fmt = args['format']
+    if fmt is None:
+        if args['input'] != '-' and args['input'].lower().endswith('.csv'):
+            fmt = 'csv'
+        else:
+            fmt = 'jsonl'
+    if args['input'] == '-':
+        infile = sys.stdin
+    else:
+        infile = open(args['input'], newline='')
+    if args['output'] == '-':
+        outfile = sys.stdout
+    else:
+        outfile = open(args['output'], 'w')
+    with infile, outfile:
+        checked, passed, secs = check_plans(infile, outfile, fmt, args['catalog'], args['workers'], args['batch_size'])
+    sys.stderr.write("Checked {n} plans ({p} passed) in {secs:.2f} secs, {r:.1f} plans/sec\n".format(n=checked, p=passed, secs=secs, r=checked/secs if secs else 0.0))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=globals()['__doc__'], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v','--version', action='version', version='%(prog)s '+globals()['__version__'])
+    parser.add_argument('-V', '--verbose', action='store_true', default=False, help='report progress')
+    parser.add_argument('-f', '--format', choices=['jsonl', 'csv'], default=None, help='input format (default: from the file extension)')
+    parser.add_argument('-o', '--output', default='-', help='results file (default: standard output)')
+    parser.add_argument('-w', '--workers', type=int, default=WORKERS, help='number of worker processes (default: %(default)s)')
+    parser.add_argument('-b', '--batch-size', type=int, default=BATCH_SIZE, help='plans per task (default: %(default)s)')
+    parser.add_argument('-c', '--catalog', default=None, help='course data file for all plans (default: that of each plan\'s year)')
+    parser.add_argument('input', nargs='?', default='-', help='plans file (default: standard input)')
+    args = vars(parser.parse_args())
+    maed.VERBOSE = args['verbose']
+    main(args)
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time parts of the MATH-ED plan checker against catalogs of various sizes.
+
+The suite benchmark writes made-up course files in the maed.csv format, of
+50 to 50,000 courses, and times reading them, making the pages, and each of
+the tests, for plans from empty to full in both programs.  With --history
+its results are added to a JSON file and compared with the previous run.
+"""
+__version__ = '0.9.0'
+__author__ = 'Jim Hefferon'
+__license__ = 'GPL 3'
+
+import sys, os, io, csv, json, time, platform, random, timeit, tempfile, argparse
+import urllib.parse
+try:
+    import cgi  # only to compare the form parser with; gone in Python 3.13
+except ImportError:
+    cgi = None
+
+import maed
+
+SIZES = [50, 500, 5000]
+DEPTS = ['MA', 'ED', 'CS', 'PH', 'CH', 'BI', 'EN', 'HI']
+SUITE_SIZES = [50, 500, 5000, 50000]
+# Courses per semester in the suite's plans
+PLANS = [('empty', 0), ('half', 3), ('full', maed.COURSE_CHOICES)]
+TOLERANCE = 0.25  # slower than the last run by this fraction is a regression
+MIN_TIME = 0.05  # seconds that each timing should take, at least
+
+
+def synthetic_catalog(n, seed=0):
+    """Return a made-up catalog of n courses, with prerequisites on lower
+    numbered courses in the same department.
+    """
+    rng = random.Random(seed)
+    d = maed.catalog()
+    d.version = 'synthetic-{n}-{seed}'.format(n=n, seed=seed)
+    by_dept = dict((dept, []) for dept in DEPTS)
+    for i in range(n):
+        dept = DEPTS[i % len(DEPTS)]
+        num = 100+(i // len(DEPTS)) % 900
+        if dept+"{0:03d}".format(num) in d:
+            dept = dept+str(i // (len(DEPTS)*900))
+        prior = by_dept.setdefault(dept, [])
+        if prior and rng.random() < 0.6:
+            prerequisites = ' '.join(rng.sample(prior[-20:], min(len(prior[-20:]), rng.randint(1, 2))))
+        else:
+            prerequisites = ''
+        c = maed.course(dept, num, 'Course number '+str(i), rng.choice([2, 4, 4, 4]),
+                        rng.random() < 0.9, rng.random() < 0.9,
+                        rng.random() < 0.8, rng.random() < 0.8,
+                        '', prerequisites, '')
+        d[c.catalogue] = c
+        prior.append(c.catalogue)
+    d.index_courses()
+    return d
+
+def synthetic_student(courses, per_semester=4, seed=0):
+    """Return a plan with up to per_semester courses each semester.
+    """
+    rng = random.Random(seed)
+    student = {}
+    catalogue_designations = sorted(courses.keys())
+    for sem in maed.SEMESTERS:
+        student[sem] = maed.student_semester(sem)
+        for cd in rng.sample(catalogue_designations, min(per_semester, len(catalogue_designations))):
+            student[sem].add_course(cd)
+    return student
+
+def synthetic_csv(fn, n, seed=0):
+    """Write a course file of n courses in the maed.csv format: the courses
+    of maed.csv, then made-up ones.  The made-up ones are numbered by level,
+    have prerequisites in their department that are more likely at higher
+    levels, the occasional corequisite, a spread of credits and offerings,
+    and names and notes that need quoting.
+    fn  string  file name
+    """
+    rng = random.Random(seed)
+    with open(maed.COURSEFILE, newline='') as f:
+        rows = [row for row in csv.reader(f) if row and not(row[0].startswith('#'))]
+    rows = [[x.strip() for x in row] for row in rows[:n]]
+    used = set(r[0]+"{0:03d}".format(int(r[1])) for r in rows)
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    depts = DEPTS+[a+b for a in letters for b in letters if a+b not in DEPTS]+[a+b+c for a in letters for b in letters for c in letters]
+    by_level = {}  # (dept, level) -> list of catalogue designations
+    d, made = 0, 0
+    while len(rows) < n:
+        dept = depts[d]
+        for level in (100, 200, 300, 400):
+            for num in range(level, level+100):
+                if len(rows) >= n:
+                    break
+                cd = dept+"{0:03d}".format(num)
+                if cd in used or rng.random() < 0.2:
+                    continue
+                lower = [x for l in range(100, level, 100) for x in by_level.get((dept, l), [])]
+                prerequisites, corequisites = [], []
+                if lower and rng.random() < level/500.0:
+                    prerequisites = rng.sample(lower[-30:], min(len(lower[-30:]), rng.choice([1, 1, 2])))
+                same = by_level.get((dept, level), [])
+                if same and rng.random() < 0.03:
+                    corequisites = [rng.choice(same[-10:])]
+                parity = rng.random()
+                season = rng.random()
+                made += 1
+                if rng.random() < 0.1:
+                    notes = 'Cross-listed with "{d}{n}", by permission'.format(d=rng.choice(DEPTS), n=num)
+                else:
+                    notes = ''
+                rows.append([dept, str(num), 'Topics in {dept}, part {k}'.format(dept=dept, k=made),
+                             str(rng.choice([4, 4, 4, 4, 3, 2, 1])),
+                             str(parity >= 0.1), str(parity < 0.1 or parity >= 0.2),
+                             str(season >= 0.1), str(season < 0.1 or season >= 0.2),
+                             notes, ' '.join(sorted(prerequisites)), ' '.join(corequisites)])
+                used.add(cd)
+                by_level.setdefault((dept, level), []).append(cd)
+        d += 1
+    with open(fn, 'w', newline='') as f:
+        f.write("# dept, course num, name, credits, year_odd_fall, year_even_fall, fall, spring, notes, prerequisites (space-separated designations), corequisites (space-separated designations)\n")
+        csv.writer(f).writerows(rows)
+
+def best_of(fcn, number, repeat=5):
+    """Return the best per-call time of fcn, in seconds.
+    """
+    return min(timeit.repeat(fcn, number=number, repeat=repeat))/number
+
+def auto_time(fcn, repeat=3):
+    """Return the best per-call time of fcn, in seconds, calling it often
+    enough that each timing takes at least MIN_TIME.
+    """
+    fcn()  # warm any caches
+    number = 1
+    while True:
+        t = timeit.timeit(fcn, number=number)
+        if t >= MIN_TIME:
+            break
+        number *= 2 if t == 0 else max(2, int(1.2*MIN_TIME/t))
+    return min([t/number]+[timeit.timeit(fcn, number=number)/number for i in range(repeat-1)])
+
+def bench_render(sizes, number=10):
+    """Time the course-selection tables, with the option cache cold and warm.
+    """
+    print("{:>8} {:>14} {:>14}".format('courses', 'cold (ms)', 'cached (ms)'))
+    for n in sizes:
+        courses = synthetic_catalog(n)
+        student = synthetic_student(courses)
+        def cold():
+            maed._OPTIONS_CACHE.clear()
+            maed.make_html_tables(courses, student)
+        def warm():
+            maed.make_html_tables(courses, student)
+        print("{:8d} {:14.3f} {:14.3f}".format(n, 1000*best_of(cold, number), 1000*best_of(warm, number)))
+
+def _separate_checks(student, year, program, courses):
+    """The seven tests, each finding what it needs from the plan on its own
+    as they did before the plan index was shared.
+    """
+    r = []
+    r += maed.prerequisites_test(student, courses)
+    r += maed.math_requirements_test(student, courses, program)
+    r += maed.ed_requirements_test(student, courses, program)
+    r += maed.semester_offered_test(student, courses, year)
+    r += maed.credits_per_semester_test(student, courses)
+    r += maed.lsc_test(student, courses)
+    r += maed.credits_test(student, courses)
+    return r
+
+def bench_checks(sizes, number=10):
+    """Time requirements_test, with the tests sharing one plan index and
+    with each test indexing the plan itself.
+    """
+    print("{:>8} {:>14} {:>14} {:>8}".format('per sem', 'separate (ms)', 'shared (ms)', 'speedup'))
+    courses = maed.load_catalog()
+    for n in sizes:
+        student = synthetic_student(courses, per_semester=n)
+        if _separate_checks(student, 2024, 'secondary', courses) != maed.requirements_test(student, 2024, 'secondary', None, courses):
+            raise maed.maedException("The shared index changed the messages.")
+        separate = best_of(lambda: _separate_checks(student, 2024, 'secondary', courses), number)
+        shared = best_of(lambda: maed.requirements_test(student, 2024, 'secondary', None, courses), number)
+        print("{:8d} {:14.4f} {:14.4f} {:8.2f}".format(n, 1000*separate, 1000*shared, separate/shared))
+
+def _trial_suggestions(student, courses, year):
+    """The suggestions found by trying each course in each semester against
+    the prerequisite and offering tests, for comparison.
+    """
+    r = {}
+    for sem in maed.SEMESTERS:
+        r[sem] = []
+        prior = set()
+        for s in maed.SEMESTERS[:maed.SEMESTERS.index(sem)]:
+            prior |= set(student[s].courses)
+        for cd in sorted(courses.keys()):
+            if cd in prior or cd in student[sem].courses:
+                continue
+            trial = {sem: maed.student_semester(sem)}
+            trial[sem].add_course(cd)
+            if (courses[cd].prerequisites <= prior
+                and not(maed.semester_offered_test(trial, courses, year))):
+                r[sem].append(cd)
+    return r
+
+def bench_suggest(sizes, number=10):
+    """Time the suggestions for all the semesters of a plan, by trying each
+    course, and from the reverse-prerequisite index with the reachable sets
+    cold and remembered.
+    """
+    print("{:>8} {:>14} {:>14} {:>14}".format('courses', 'trial (ms)', 'cold (ms)', 'cached (ms)'))
+    for n in sizes:
+        courses = synthetic_catalog(n)
+        student = synthetic_student(courses, per_semester=2)
+        if _trial_suggestions(student, courses, 2024) != maed.suggest_courses(student, courses, 2024):
+            raise maed.maedException("The index gave different suggestions.")
+        def cold():
+            courses._eligible.clear()
+            maed.suggest_courses(student, courses, 2024)
+        trial = best_of(lambda: _trial_suggestions(student, courses, 2024), 1, repeat=1)
+        print("{:8d} {:14.3f} {:14.3f} {:14.3f}".format(n, 1000*trial, 1000*best_of(cold, number),
+                                                        1000*best_of(lambda: maed.suggest_courses(student, courses, 2024), number)))
+
+SEARCH_QUERIES = ['MA4', 'ed 3', 'calc', 'teaching math', 'e', 'xyz']
+
+def bench_search(sizes, number=10):
+    """Time course searches from the name index, over the whole catalog and
+    limited to one semester, against a scan of every course.
+    """
+    print("{:>8} {:>14} {:>14} {:>14}".format('courses', 'scan (ms)', 'index (ms)', 'semester (ms)'))
+    for n in sizes:
+        courses = synthetic_catalog(n)
+        def scan():
+            for q in SEARCH_QUERIES:
+                key, words = q.replace(' ', '').upper(), maed.name_words(q)
+                [cd for (cd, c) in sorted(courses.items()) 
+                 if cd.startswith(key) or all(w in c.name.lower() for w in words)][:maed.SEARCH_LIMIT]
+        def index(semester=None):
+            for q in SEARCH_QUERIES:
+                maed.search_courses(courses, q, semester, 2024)
+        print("{:8d} {:14.3f} {:14.3f} {:14.3f}".format(n, 1000*best_of(scan, 1, repeat=3)/len(SEARCH_QUERIES),
+                                                        1000*best_of(index, number)/len(SEARCH_QUERIES),
+                                                        1000*best_of(lambda: index('TWO_FALL'), number)/len(SEARCH_QUERIES)))
+
+def bench_form(sizes, number=200):
+    """Time reading a submitted form and getting the plan from it, with
+    cgi.FieldStorage and with maed.read_form().
+    """
+    courses = maed.read_coursefile()
+    print("{:>8} {:>8} {:>14} {:>14} {:>8}".format('per sem', 'bytes', 'cgi (ms)', 'maed (ms)', 'speedup'))
+    for n in sizes:
+        student = synthetic_student(courses, per_semester=n)
+        pairs = [('catalogue_year', '2024'), ('program', 'secondary'), ('name', 'A. Student'), ('submit', 'Check')]
+        for sem in maed.SEMESTERS:
+            pairs += [(sem, cd) for cd in student[sem].courses]
+            pairs += [(sem, '')]*(maed.COURSE_CHOICES-len(student[sem].courses))  # the empty boxes
+        body = urllib.parse.urlencode(pairs).encode('ascii')
+        environ = {'REQUEST_METHOD': 'POST', 
+                   'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+                   'CONTENT_LENGTH': str(len(body))}
+        parsed = maed.parse_data(maed.read_form(environ, io.BytesIO(body)))[0]
+        if any(parsed[sem].courses != student[sem].courses for sem in maed.SEMESTERS):
+            raise maed.maedException("The form parser gave a different plan.")
+        ours = best_of(lambda: maed.parse_data(maed.read_form(environ, io.BytesIO(body))), number)
+        if cgi is None:
+            print("{:8d} {:8d} {:>14} {:14.3f} {:>8}".format(n, len(body), '-', 1000*ours, '-'))
+        else:
+            theirs = best_of(lambda: maed.parse_data(cgi.FieldStorage(fp=io.BytesIO(body), environ=environ)), number)
+            print("{:8d} {:8d} {:14.3f} {:14.3f} {:7.1f}x".format(n, len(body), 1000*theirs, 1000*ours, theirs/ours))
+
+def single_course_edits(student, courses, n, seed=0):
+    """Return a list of n edits, each a delta for maed.revalidate() that
+    adds, drops, or replaces one course in one semester.
+    """
+    rng = random.Random(seed)
+    catalogue_designations = sorted(courses.keys())
+    r = []
+    for i in range(n):
+        sem = rng.choice(maed.SEMESTERS)
+        course_list = list(student[sem].courses)
+        op = rng.choice(['add', 'drop', 'replace'])
+        if op != 'add' and course_list:
+            del course_list[rng.randrange(len(course_list))]
+        if op != 'drop':
+            course_list.append(rng.choice(catalogue_designations))
+        r.append({sem: course_list})
+    return r
+
+def bench_revalidate(sizes, number=10):
+    """Time retesting a plan after a one-course edit, from scratch and
+    incrementally from the earlier results.
+    """
+    print("{:>8} {:>14} {:>14} {:>8} {:>8}".format('per sem', 'full (ms)', 'incr (ms)', 'speedup', 'reruns'))
+    courses = maed.load_catalog()
+    for n in sizes:
+        student = synthetic_student(courses, per_semester=n)
+        results = maed.requirements_results(student, 2024, 'secondary', courses)
+        edits = single_course_edits(student, courses, 50)
+        reruns = 0
+        for delta in edits:
+            after = maed.revalidate(results, delta, courses)
+            if after.messages() != maed.requirements_test(after.student, 2024, 'secondary', None, courses):
+                raise maed.maedException("Revalidating changed the messages.")
+            reruns += len(after.rerun)
+        def full():
+            for delta in edits:
+                edited = dict(student)
+                for sem, sem_courses in maed.make_student(delta).items():
+                    if sem in delta:
+                        edited[sem] = sem_courses
+                maed.requirements_test(edited, 2024, 'secondary', None, courses)
+        def incremental():
+            for delta in edits:
+                maed.revalidate(results, delta, courses)
+        f = best_of(full, number)/len(edits)
+        i = best_of(incremental, number)/len(edits)
+        print("{:8d} {:14.4f} {:14.4f} {:8.2f} {:8.1f}".format(n, 1000*f, 1000*i, f/i, reruns/len(edits)))
+
+def bench_stream(sizes, number=10):
+    """Time the page to its first piece and to its end, and compare its size
+    plain and gzipped.
+    """
+    print("{:>8} {:>14} {:>14} {:>12} {:>12}".format('per sem', 'first (ms)', 'whole (ms)', 'bytes', 'gzip bytes'))
+    courses = maed.load_catalog()
+    for n in sizes:
+        student = synthetic_student(courses, per_semester=n)
+        extra = maed.requirements_test(student, 2024, 'secondary', None, courses)
+        def page():
+            return maed.iter_html(courses, student, 2024, 'secondary', '', None, extra, header=False)
+        plain = b''.join(maed.encode_chunks(page()))
+        gzipped = b''.join(maed.encode_chunks(page(), True))
+        first = best_of(lambda: next(maed.encode_chunks(page(), True)), number)
+        whole = best_of(lambda: b''.join(maed.encode_chunks(page(), True)), number)
+        print("{:8d} {:14.3f} {:14.3f} {:12d} {:12d}".format(n, 1000*first, 1000*whole, len(plain), len(gzipped)))
+
+def _suite_functions(courses, student, program):
+    """Return the list of pairs name, function of no arguments to time for
+    one plan.
+    """
+    year = 2024
+    extra = maed.requirements_test(student, year, program, None, courses)
+    return [('make_html', lambda: maed.make_html(courses, student, year, program, '', None, extra, header=False)),
+            ('make_plain', lambda: maed.make_plain(courses, student, year, program, '', 'Done', extra, header=False)),
+            ('prerequisites_test', lambda: maed.prerequisites_test(student, courses)),
+            ('math_requirements_test', lambda: maed.math_requirements_test(student, courses, program)),
+            ('ed_requirements_test', lambda: maed.ed_requirements_test(student, courses, program)),
+            ('semester_offered_test', lambda: maed.semester_offered_test(student, courses, year)),
+            ('credits_per_semester_test', lambda: maed.credits_per_semester_test(student, courses)),
+            ('lsc_test', lambda: maed.lsc_test(student, courses)),
+            ('credits_test', lambda: maed.credits_test(student, courses)),
+            ('requirements_test', lambda: maed.requirements_test(student, year, program, None, courses))]
+
+def bench_suite(sizes, number=None):
+    """Time reading made-up course files, making the pages, and each test,
+    for empty to full plans in both programs.  Return a dictionary
+    name -> seconds per call.
+    """
+    results = {}
+    print("{:>8} {:>6} {:>10} {:>26} {:>12}".format('courses', 'plan', 'program', 'function', 'ms'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            fn = os.path.join(tmp, 'maed-{n}.csv'.format(n=n))
+            synthetic_csv(fn, n)
+            key = "{n}/read_coursefile".format(n=n)
+            results[key] = auto_time(lambda: maed.read_coursefile(fn))
+            print("{:8d} {:>6} {:>10} {:>26} {:12.3f}".format(n, '', '', 'read_coursefile', 1000*results[key]))
+            courses = maed.read_coursefile(fn)
+            for plan, per_semester in PLANS:
+                student = synthetic_student(courses, per_semester)
+                for program in maed.program_names():
+                    for name, fcn in _suite_functions(courses, student, program):
+                        key = "{n}/{plan}/{program}/{name}".format(n=n, plan=plan, program=program, name=name)
+                        results[key] = auto_time(fcn)
+                        print("{:8d} {:>6} {:>10} {:>26} {:12.3f}".format(n, plan, program, name, 1000*results[key]))
+            maed._OPTIONS_CACHE.clear()  # let the big catalogs go
+    return results
+
+def read_history(fn):
+    """Return the list of earlier runs in the history file, if any.
+    """
+    try:
+        with open(fn) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+def compare_runs(previous, results, tolerance=TOLERANCE):
+    """Return a list of strings, one for each timing that got slower than
+    the previous run's by more than the tolerance fraction.
+    previous, results  dictionaries  name -> seconds per call
+    """
+    r = []
+    for key in sorted(results):
+        if key in previous and previous[key] > 0:
+            ratio = results[key]/previous[key]
+            if ratio > 1+tolerance:
+                r.append("{key}: {old:.3f} ms -> {new:.3f} ms ({ratio:.2f}x)".format(key=key, old=1000*previous[key], new=1000*results[key], ratio=ratio))
+    return r
+
+def save_history(fn, runs, results):
+    """Add this run to the history file.
+    """
+    runs.append({'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(),
+                 'machine': platform.machine(),
+                 'results': results})
+    tmp = fn+'.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(runs, f, indent=1, sort_keys=True)
+    os.replace(tmp, fn)
+
+BENCHMARKS = {'render': (bench_render, SIZES),
+              'checks': (bench_checks, [0, 2, 4, 6]),
+              'suggest': (bench_suggest, SIZES),
+              'search': (bench_search, SIZES+[50000]),
+              'form': (bench_form, [0, 2, 4, 6]),
+              'revalidate': (bench_revalidate, [2, 4, 6]),
+              'stream': (bench_stream, [0, 2, 4]),
+              'suite': (bench_suite, SUITE_SIZES)}
+
+
+#==================================================================
+def main(args):
+    results = {}
+    for name in args['bench']:
+        fcn, sizes = BENCHMARKS[name]
+        print(name+": "+' '.join(fcn.__doc__.split()))
+        r = fcn(args['sizes'] or sizes, args['number'])
+        if r:
+            results.update(r)
+    if args['history'] and results:
+        runs = read_history(args['history'])
+        if runs:
+            regressions = compare_runs(runs[-1]['results'], results, args['tolerance'])
+            for s in regressions:
+                print("REGRESSION "+s)
+            if not(regressions):
+                print("No regressions against the run of "+runs[-1]['date'])
+        else:
+            regressions = []
+        save_history(args['history'], runs, results)
+        if regressions and args['check']:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=globals()['__doc__'])
+    parser.add_argument('-v','--version', action='version', version='%(prog)s '+globals()['__version__'])
+    parser.add_argument('-n', '--number', type=int, default=10, help='calls per timing (default: %(default)s)')
+    parser.add_argument('-b', '--bench', action='append', choices=sorted(BENCHMARKS), help='benchmark to run, may be repeated (default: all but suite)')
+    parser.add_argument('-H', '--history', default=None, help='JSON file of earlier results to compare with and add to')
+    parser.add_argument('-t', '--tolerance', type=float, default=TOLERANCE, help='fraction slower that counts as a regression (default: %(default)s)')
+    parser.add_argument('--check', action='store_true', default=False, help='exit with status 1 if there is a regression')
+    parser.add_argument('sizes', type=int, nargs='*', help='sizes: number of courses in the catalog for render, courses per semester for checks')
+    args = vars(parser.parse_args())
+    if not args['bench']:
+        args['bench'] = sorted(b for b in BENCHMARKS if b != 'suite')
+    main(args)
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CGI entry point for the MATH-ED plan checker.
+
+Point the web server at this rather than at maed.py.  Python compiles the
+script it is given on every run, and maed.py is large, while a module it
+imports is loaded from its compiled copy in __pycache__ (make that with
+  python3 -m compileall .
+if the web server cannot write there).  So this is kept small, and it
+imports nothing that maed.py does not need for a request.
+"""
+__version__ = '0.9.0'
+__author__ = 'Jim Hefferon'
+__license__ = 'GPL 3'
+
+import sys
+
+import maed
+
+if __name__ == '__main__':
+    # A web server may pass words of the query string as arguments, so
+    # these are looked for rather than parsed
+    maed.VERBOSE = ('-V' in sys.argv[1:]) or ('--verbose' in sys.argv[1:])
+    maed.main({'verbose': maed.VERBOSE})
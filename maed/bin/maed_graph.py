@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Draw prerequisite graphs as SVG, from the course catalog.
+
+The department graphs take the place of the hand-kept graphics/math.dot and
+ed.dot, and of running dot and convert on them.  The graph of a student's
+plan puts each semester's courses in a row.  A full course is a box and a
+half course an oval; a corequisite is a dashed line, and a prerequisite that
+is missing from the plan is drawn in red.
+"""
+__version__ = '0.9.0'
+__author__ = 'Jim Hefferon'
+__license__ = 'GPL 3'
+
+import sys, os
+from collections import OrderedDict
+from html import escape
+
+import maed
+
+# The department graphs: name -> departments whose courses are drawn
+GRAPHS = {'math': ('MA',), 'ed': ('ED',)}
+# The department graphs are also kept on disk, for the CGI script
+GRAPH_DIR = os.path.dirname(os.path.abspath(__file__))
+GRAPH_FILE = 'maed_graph_{name}.svg'
+
+NODE_WIDTH, NODE_HEIGHT = 64, 26
+H_GAP, V_GAP = 20, 52  # between the nodes of a row, and between rows
+MARGIN = 12
+LABEL_WIDTH = 130  # room for the row labels of a plan graph
+SWEEPS = 4  # passes ordering the rows to cut down on crossings
+
+_SVG_CACHE = OrderedDict()
+_SVG_CACHE_SIZE = 64
+
+
+def _cached(key, make):
+    """Return the SVG for key, from the cache or by calling make().
+    """
+    if key in _SVG_CACHE:
+        _SVG_CACHE.move_to_end(key)
+        return _SVG_CACHE[key]
+    svg = make()
+    _SVG_CACHE[key] = svg
+    if len(_SVG_CACHE) > _SVG_CACHE_SIZE:
+        _SVG_CACHE.popitem(last=False)
+    return svg
+
+def _order_rows(rows, edges):
+    """Reorder the nodes within each row so that each sits near the average
+    place of the nodes it is joined to in the rows above (and then below).
+    Return a new list of rows.
+    rows  list of lists of node keys
+    edges  list of triples  from key, to key, kind
+    """
+    rows = [sorted(row, key=str) for row in rows]
+    neighbors = {}
+    for a, b, kind in edges:
+        neighbors.setdefault(a, []).append(b)
+        neighbors.setdefault(b, []).append(a)
+    for sweep in range(SWEEPS):
+        where = {}
+        for row in rows:
+            for i, k in enumerate(row):
+                where[k] = i-(len(row)-1)/2.0  # centered, as drawn
+        order = range(1, len(rows)) if (sweep % 2) == 0 else range(len(rows)-2, -1, -1)
+        for r in order:
+            def place(k):
+                near = [where[n] for n in neighbors.get(k, []) if n in where and n not in rows[r]]
+                if not(near):
+                    return where[k]
+                return sum(near)/len(near)
+            rows[r] = sorted(rows[r], key=lambda k: (place(k), str(k)))
+            for i, k in enumerate(rows[r]):
+                where[k] = i-(len(rows[r])-1)/2.0
+    return rows
+
+def layered_svg(rows, edges, labels, shapes, row_labels=None, title=''):
+    """Return an SVG drawing of a graph whose nodes are laid out in rows.
+    rows  list of lists of node keys, the first row at the top
+    edges  list of triples  from key, to key, and 'prerequisite' or
+      'corequisite'
+    labels  dictionary  key -> pair text in the box, tooltip
+    shapes  dictionary  key -> 'full', 'half', or 'missing'
+    row_labels  list of strings or None  a label for each row
+    """
+    rows = _order_rows([row for row in rows], edges)
+    left = MARGIN+(LABEL_WIDTH if row_labels else 0)
+    widest = max([len(row) for row in rows]+[1])
+    width = left+widest*(NODE_WIDTH+H_GAP)-H_GAP+MARGIN
+    height = 2*MARGIN+len(rows)*(NODE_HEIGHT+V_GAP)-V_GAP
+    center = {}  # key -> x, y
+    for r, row in enumerate(rows):
+        y = MARGIN+r*(NODE_HEIGHT+V_GAP)+NODE_HEIGHT/2.0
+        start = left+(widest-len(row))*(NODE_WIDTH+H_GAP)/2.0
+        for i, k in enumerate(row):
+            center[k] = (start+i*(NODE_WIDTH+H_GAP)+NODE_WIDTH/2.0, y)
+    s = ["<svg xmlns='http://www.w3.org/2000/svg' width='{w:.0f}' height='{h:.0f}' viewBox='0 0 {w:.0f} {h:.0f}' font-family='sans-serif' font-size='11'>\n".format(w=width, h=max(height, 2*MARGIN))]
+    if title:
+        s.append("  <title>{t}</title>\n".format(t=escape(title)))
+    s.append("  <defs><marker id='arrow' viewBox='0 0 10 10' refX='10' refY='5' markerWidth='7' markerHeight='7' orient='auto'><path d='M0,0 L10,5 L0,10 z'/></marker></defs>\n")
+    if row_labels:
+        for r, text in enumerate(row_labels):
+            y = MARGIN+r*(NODE_HEIGHT+V_GAP)+NODE_HEIGHT/2.0
+            s.append("  <text x='{x}' y='{y:.1f}' dominant-baseline='middle' fill='#6D6D74'>{t}</text>\n".format(x=MARGIN, y=y, t=escape(text)))
+    for a, b, kind in edges:
+        (x1, y1), (x2, y2) = center[a], center[b]
+        dash = " stroke-dasharray='4,3'" if kind == 'corequisite' else ""
+        if y1 == y2:  # same row: arc over the top
+            y = y1-NODE_HEIGHT/2.0
+            if x1 > x2:
+                x1, x2 = x2, x1
+            s.append("  <path d='M{x1:.1f},{y:.1f} Q{xm:.1f},{yc:.1f} {x2:.1f},{y:.1f}' fill='none' stroke='black'{dash}/>\n".format(x1=x1, x2=x2, xm=(x1+x2)/2.0, y=y, yc=y-V_GAP/2.0, dash=dash))
+        else:
+            if y1 > y2:
+                (x1, y1), (x2, y2) = (x2, y2), (x1, y1)
+            s.append("  <line x1='{x1:.1f}' y1='{y1:.1f}' x2='{x2:.1f}' y2='{y2:.1f}' stroke='black' marker-end='url(#arrow)'{dash}/>\n".format(x1=x1, y1=y1+NODE_HEIGHT/2.0, x2=x2, y2=y2-NODE_HEIGHT/2.0, dash=dash))
+    for k, (x, y) in center.items():
+        text, tip = labels[k]
+        shape = shapes.get(k, 'full')
+        stroke = " stroke='red' stroke-dasharray='3,2'" if shape == 'missing' else " stroke='black'"
+        s.append("  <g><title>{tip}</title>".format(tip=escape(tip)))
+        if shape == 'half':
+            s.append("<ellipse cx='{x:.1f}' cy='{y:.1f}' rx='{rx}' ry='{ry}' fill='white'{stroke}/>".format(x=x, y=y, rx=NODE_WIDTH/2, ry=NODE_HEIGHT/2, stroke=stroke))
+        else:
+            s.append("<rect x='{x:.1f}' y='{y:.1f}' width='{w}' height='{h}' fill='white'{stroke}/>".format(x=x-NODE_WIDTH/2.0, y=y-NODE_HEIGHT/2.0, w=NODE_WIDTH, h=NODE_HEIGHT, stroke=stroke))
+        s.append("<text x='{x:.1f}' y='{y:.1f}' text-anchor='middle' dominant-baseline='middle'>{t}</text></g>\n".format(x=x, y=y, t=escape(text)))
+    s.append("  </svg>\n")
+    return ''.join(s)
+
+def _shape(c):
+    return 'full' if c.credits >= 4 else 'half'
+
+def program_courses():
+    """Return the set of courses that the programs name, which are drawn in
+    the department graphs even if no prerequisites join them to others.
+    """
+    r = set()
+    for program in maed.program_names():
+        r |= maed.program_courses(program)
+    return r
+
+def department_graph(courses, name, named=None):
+    """Return the rows, edges, labels, and shapes of the graph of the
+    departments' courses that are joined to another by a prerequisite or
+    corequisite, or that a program names.  Rows are by prerequisite depth.
+    named  set of catalogue designations or None  the courses the programs
+      name; if None, found from them
+    """
+    depts = GRAPHS[name]
+    if named is None:
+        named = program_courses()
+    edges = []
+    linked = set()
+    for cd, c in courses.items():
+        if c.dept not in depts:
+            continue
+        for p in c.prerequisites:
+            if courses[p].dept in depts:
+                edges.append((p, cd, 'prerequisite'))
+                linked |= {p, cd}
+        for q in c.corequisites:
+            if courses[q].dept in depts and (cd < q or cd not in courses[q].corequisites):
+                edges.append((q, cd, 'corequisite'))
+                linked |= {q, cd}
+    nodes = sorted(cd for cd in courses if courses[cd].dept in depts and (cd in linked or cd in named))
+    depth = {}
+    for cd in sorted(nodes, key=lambda cd: courses[cd].prerequisite_depth):
+        depth[cd] = 1+max([depth[p] for p in courses[cd].prerequisites if p in depth]+[-1])
+    rows = [[] for i in range(max(list(depth.values())+[-1])+1)]
+    for cd in nodes:
+        rows[depth[cd]].append(cd)
+    labels = dict((cd, (cd, cd+" "+courses[cd].name)) for cd in nodes)
+    shapes = dict((cd, _shape(courses[cd])) for cd in nodes)
+    return rows, edges, labels, shapes
+
+def department_svg(courses, name):
+    """Return the SVG of a department graph.  It is cached by catalog
+    version and the courses that the programs name, in memory and on disk,
+    so it is only drawn again when the course data or programs change.
+    name  string  one of GRAPHS
+    """
+    if name not in GRAPHS:
+        raise maed.maedException("No such graph: "+str(name))
+    named = tuple(sorted(program_courses()))
+    def make():
+        fn = os.path.join(GRAPH_DIR, GRAPH_FILE.format(name=name))
+        stamp = "<!-- catalog {v}, programs name {n} -->\n".format(v=courses.version, n=' '.join(named))
+        try:
+            with open(fn, encoding='utf-8') as f:
+                saved = f.read()
+            if saved.startswith(stamp):
+                return saved[len(stamp):]
+        except OSError:
+            pass
+        rows, edges, labels, shapes = department_graph(courses, name, set(named))
+        svg = layered_svg(rows, edges, labels, shapes, title=name.capitalize()+" prerequisite structure")
+        if courses.version is not None:
+            try:
+                tmp = fn+'.'+str(os.getpid())
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.write(stamp+svg)
+                os.replace(tmp, fn)
+            except OSError as e:
+                if maed.VERBOSE:
+                    maed.warn("unable to save the graph "+fn+": "+str(e))
+        return svg
+    return _cached((courses.version, name, named), make)
+
+def plan_graph(student, courses):
+    """Return the rows, edges, labels, shapes, and row labels of the graph
+    of a student's plan.  Each semester with courses is a row.  Prerequisites
+    and corequisites that the plan does not have in time are in a first row
+    of missing courses.
+    """
+    index = maed.plan_index(student, courses)
+    rows, row_labels, edges = [], [], []
+    labels, shapes = {}, {}
+    missing = []
+    where = {}  # course -> the node of its first time in the plan
+    for sem in index.semesters:
+        row = []
+        for n, cd in enumerate(index.course_lists[sem]):
+            k = (sem, n, cd)
+            row.append(k)
+            labels[k] = (cd, cd+" "+courses[cd].name)
+            shapes[k] = _shape(courses[cd])
+            where.setdefault(cd, k)
+        if row:
+            rows.append(row)
+            row_labels.append(maed.SEMESTERS_LONG[sem])
+    for row in rows:
+        sem = row[0][0]
+        prior = index.prior[sem]
+        for k in row:
+            c = courses[k[2]]
+            for p in sorted(c.prerequisites):
+                if p in prior:
+                    edges.append((where[p], k, 'prerequisite'))
+                else:
+                    edges.append((('missing', p), k, 'prerequisite'))
+                    missing.append(p)
+            for q in sorted(c.corequisites):
+                if q in prior or q in index.course_sets[sem]:
+                    # Draw two courses that are each other's corequisite once
+                    if not(where[q][0] == sem and c.catalogue in courses[q].corequisites and where[q] > k):
+                        edges.append((where[q], k, 'corequisite'))
+                else:
+                    edges.append((('missing', q), k, 'corequisite'))
+                    missing.append(q)
+    if missing:
+        row = []
+        for cd in sorted(set(missing)):
+            k = ('missing', cd)
+            row.append(k)
+            labels[k] = (cd, cd+" "+courses[cd].name+" (missing)")
+            shapes[k] = 'missing'
+        rows.insert(0, row)
+        row_labels.insert(0, "Missing")
+    return rows, edges, labels, shapes, row_labels
+
+def plan_svg(student, courses):
+    """Return the SVG of the graph of a student's plan, cached by catalog
+    version and plan.
+    """
+    key = tuple((sem, tuple(student[sem].courses)) for sem in maed.SEMESTERS if sem in student)
+    def make():
+        rows, edges, labels, shapes, row_labels = plan_graph(student, courses)
+        return layered_svg(rows, edges, labels, shapes, row_labels, title="Prerequisites in this plan")
+    return _cached((courses.version, 'plan', key), make)
+
+
+#==================================================================
+def main(args):
+    courses = maed.load_catalog(args['catalog'] or maed.COURSEFILE)
+    svg = department_svg(courses, args['graph'])
+    if args['output'] == '-':
+        sys.stdout.write(svg)
+    else:
+        with open(args['output'], 'w', encoding='utf-8') as f:
+            f.write(svg)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=globals()['__doc__'], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v','--version', action='version', version='%(prog)s '+globals()['__version__'])
+    parser.add_argument('-V', '--verbose', action='store_true', default=False, help='verbose output')
+    parser.add_argument('-g', '--graph', choices=sorted(GRAPHS), default='math', help='which graph (default: %(default)s)')
+    parser.add_argument('-o', '--output', default='-', help='SVG file (default: standard output)')
+    parser.add_argument('-c', '--catalog', default=None, help='course data file (default: maed.csv next to maed.py)')
+    args = vars(parser.parse_args())
+    maed.VERBOSE = args['verbose']
+    main(args)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Check that the CGI entry point starts quickly enough.
+
+This runs maed_cgi.py on a sample request under  python -X importtime ,
+adds up the time spent importing the modules that it loads beyond those
+Python itself starts with, and exits with status 1 if that is over the
+budget, or if the request loaded a module that it should not need.  Each
+run is repeated and the best taken, to cut down on noise.
+"""
+__version__ = '0.9.0'
+__author__ = 'Jim Hefferon'
+__license__ = 'GPL 3'
+
+import sys, os, subprocess, compileall, argparse
+
+import maed
+
+BIN_DIR = os.path.dirname(os.path.abspath(__file__))
+ENTRY = os.path.join(BIN_DIR, 'maed_cgi.py')
+BUDGET = 15.0  # ms of imports for a page
+RUNS = 5
+# A plan as the form sends it, so the page is made with its tests and samples
+QUERY = 'catalogue_year=2024&program=secondary&ONE_FALL=MA150&ONE_FALL=CS111&ONE_SPRING=MA160'
+# Modules that making a page should not load
+NOT_NEEDED = ['argparse', 'cgi', 'cgitb', 'csv', 'hashlib', 'json', 'pprint',
+              'random', 're', 'traceback', 'urllib.parse', 'zlib']
+
+
+def import_times(args, environ=None):
+    """Run python -X importtime with args.  Return a dictionary module ->
+    cumulative microseconds for the modules imported at the top level, and
+    the set of all modules imported.
+    """
+    env = dict(os.environ if environ is None else environ)
+    env['PYTHONPATH'] = BIN_DIR
+    p = subprocess.run([sys.executable, '-W', 'ignore', '-X', 'importtime']+args, env=env,
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                       universal_newlines=True)
+    top, loaded = {}, set()
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not cumulative_us.strip().isdigit():
+            continue  # the header
+        loaded.add(name.strip())
+        if not name[1:].startswith(' '):  # not nested under another
+            top[name.strip()] = int(cumulative_us)
+    return top, loaded
+
+def request_imports(query=QUERY, runs=RUNS):
+    """Return the best over the runs of the ms spent importing modules to
+    answer the request, with the dictionary module -> ms of that run, and
+    the set of the modules loaded beyond Python's own.
+    """
+    base_top, base_loaded = import_times(['-c', 'pass'])
+    environ = dict(os.environ, REQUEST_METHOD='GET', QUERY_STRING=query)
+    best = None
+    for i in range(runs):
+        top, loaded = import_times([ENTRY], environ)
+        ours = dict((m, us/1000) for (m, us) in top.items() if m not in base_loaded)
+        total = sum(ours.values())
+        if best is None or total < best[0]:
+            best = (total, ours, loaded-base_loaded)
+    return best
+
+
+#==================================================================
+def main(args):
+    # Measure the modules as they will be deployed, from compiled copies
+    compileall.compile_dir(BIN_DIR, maxlevels=0, quiet=1)
+    total, ours, loaded = request_imports(args['query'], args['runs'])
+    if maed.VERBOSE:
+        for m, ms in sorted(ours.items(), key=lambda item: -item[1]):
+            print("{ms:8.2f} ms  {m}".format(ms=ms, m=m))
+    print("imports for a page: {total:.2f} ms (budget {budget:.2f} ms)".format(total=total, budget=args['budget']))
+    failed = False
+    if total > args['budget']:
+        print("OVER BUDGET")
+        failed = True
+    extra = sorted(m for m in NOT_NEEDED if m in loaded)
+    if extra:
+        print("loaded modules that a page does not need: "+", ".join(extra))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=globals()['__doc__'], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v','--version', action='version', version='%(prog)s '+globals()['__version__'])
+    parser.add_argument('-V', '--verbose', action='store_true', default=False, help='list the time for each module')
+    parser.add_argument('-b', '--budget', type=float, default=BUDGET, help='most ms of imports allowed (default: %(default)s)')
+    parser.add_argument('-n', '--runs', type=int, default=RUNS, help='runs to take the best of (default: %(default)s)')
+    parser.add_argument('-q', '--query', default=QUERY, help='query string of the request')
+    args = vars(parser.parse_args())
+    maed.VERBOSE = args['verbose']
+    main(args)
@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generate a complete MATH-ED four-year plan.
+
+Given the courses transferred in, the entry year and the program, search for
+a plan that meets the requirements.  The plan must respect prerequisites and
+corequisites, the odd/even year and Fall/Spring offerings, the 12 to 18
+credits of a Fall or Spring semester, and the LSC counts.
+"""
+__version__ = '0.9.0'
+__author__ = 'Jim Hefferon'
+__license__ = 'GPL 3'
+
+import os, time, itertools
+import marshal  # saved sample plans
+
+import maed
+
+# Plans use the semesters with a full-time load, the Fall and Spring;
+# summers are left open
+TERMS = [t.name for t in maed.TERM_CALENDAR if t.season is not None and t.season.min_credits]
+MIN_CREDITS, MAX_CREDITS = 12, 18
+GRADUATION_CREDITS = 128
+LSC_FULL, LSC_HALF = 'LSC004', 'LSC002'
+LSC_FULL_NEEDED = 9  # and extra credits are made up with LSC courses
+
+OBJECTIVES = ('earliest', 'balanced')
+BUDGET = 2.0  # seconds
+CANDIDATES_PER_SLOT = 3  # courses tried for each open requirement
+OPTIONS_PER_SEMESTER = 40  # course sets tried for each semester
+BALANCED_SOLUTIONS = 200  # stop looking for a more balanced plan after this many
+
+
+class out_of_time(maed.maedException):
+    pass
+
+
+class generated_plan(object):
+    """A plan found by generate_plan().
+      plan  dictionary  semester -> list of catalogue designations
+      student  dictionary  semester -> student_semester
+      messages  list of strings  what requirements_test says about it
+      objective  string  one of OBJECTIVES
+      semesters_used  integer  number of Fall and Spring semesters with courses
+      nodes  integer  number of search steps
+      seconds  float  time taken
+    """
+    def __init__(self, plan, objective):
+        self.plan = plan
+        self.student = maed.make_student(plan)
+        self.objective = objective
+        self.messages = []
+        self.semesters_used = len([sem for sem in TERMS if plan.get(sem)])
+        self.nodes = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        r = []
+        for sem in maed.SEMESTERS:
+            if self.plan.get(sem):
+                r.append(maed.SEMESTERS_LONG[sem]+": "+", ".join(self.plan[sem]))
+        return "\n".join(r)
+
+
+def prerequisite_closure(courses, designations):
+    """Return the set of the courses and all their prerequisites and
+    corequisites, followed back as far as they go.
+    """
+    r, todo = set(), list(designations)
+    while todo:
+        cd = todo.pop()
+        if cd in r:
+            continue
+        r.add(cd)
+        if cd in courses:
+            todo.extend(courses[cd].prerequisites | courses[cd].corequisites)
+    return r
+
+def required_courses(program):
+    """Return the set of courses that a plan for the program must include
+    in any event: those its rules require, those that it requires unless a
+    substitution is approved, and those it requires together.
+    """
+    r = set()
+    for rule in maed.program_definitions()[program]['requirements']:
+        if rule['kind'] in ('required', 'substitute', 'together'):
+            r.update(rule['courses'])
+    r.add(LSC_HALF)
+    return r
+
+def target_sets(courses, program, before):
+    """Generate the sets of courses that would meet the requirements, best
+    first: each open mathematics requirement is filled by one of the few
+    candidates that need the fewest extra prerequisites.
+    before  set of catalogue designations transferred in
+    """
+    fixed = prerequisite_closure(courses, required_courses(program))-before
+    have = before | fixed
+    checker = maed.program_checker_for(program, courses)
+    open_slots = []
+    for check in maed.PROGRAM_CHECKS:
+        slots = checker.slots[check]
+        open_slots += [slot for (slot, c) in zip(slots, maed.match_slots(slots, have)) if c is None]
+    # Courses that could be matched to open slots, and what each would add
+    candidates = []
+    for slot in open_slots:
+        ranked = []
+        for cd in sorted(courses):
+            if cd in have or not(slot.accepts(cd)):
+                continue
+            extra = prerequisite_closure(courses, [cd])-have
+            if any(x not in courses for x in extra):
+                continue  # it can never be taken
+            # prefer courses that build on the others, and are often given
+            builds_on = len(courses[cd].prerequisites & have)
+            ranked.append((len(extra), -builds_on, -_semesters_offered(courses[cd]), cd, extra))
+        ranked.sort()
+        candidates.append(ranked[:CANDIDATES_PER_SLOT])
+    seen = []
+    combos = sorted(itertools.product(*candidates), key=lambda combo: sum(x[0] for x in combo))
+    for combo in combos:
+        chosen = [x[3] for x in combo]
+        if len(set(chosen)) < len(chosen):
+            continue
+        target = set(fixed)
+        for x in combo:
+            target |= x[4]
+        if target in seen:
+            continue
+        seen.append(target)
+        yield target
+
+def prerequisite_depth(courses, cd):
+    """Return the length of the longest chain of prerequisites leading to
+    the course, so that sorting by it puts prerequisites first.
+    """
+    c = courses.get(cd)
+    if c is None:
+        return 0
+    return c.prerequisite_depth
+
+def _semesters_offered(c):
+    """Number of the four kinds of semester (odd or even year, Fall or
+    Spring) in which the course is given.
+    """
+    return (c.year_odd_fall+c.year_even_fall)*(c.fall+c.spring)
+
+
+class _search(object):
+    """Place a target set of courses into the Fall and Spring semesters by
+    depth-first search.  Semesters are filled in order; for each, the
+    search tries sets of the eligible courses, the most urgent first.
+    States known to have no completion are remembered.
+    """
+    def __init__(self, courses, before, target, year, program, objective, deadline):
+        self.courses = courses
+        self.objective = objective
+        self.deadline = deadline
+        self.nodes = 0
+        self.offered = [maed.offered_mask(courses, sem, year) for sem in TERMS]
+        self.before_mask = courses.mask(before)
+        self.target_mask = courses.mask(target)
+        self.all_mask = self.before_mask | self.target_mask
+        # The first group of courses that must be alone in their semester,
+        # as student teaching is, goes in the last one
+        alone = maed.program_checker_for(program, courses).alone
+        self.block = courses.mask(alone[0] if alone else ()) & self.target_mask
+        self.before_credits = sum(courses[cd].credits for cd in before)
+        self.before_lsc = list(before).count(LSC_FULL)
+        self.ids = [courses.ids[cd] for cd in target]
+        self.credits = dict((courses.ids[cd], courses[cd].credits) for cd in target)
+        self.target_credits = sum(self.credits.values())
+        self.block_credits = sum(self.credits[i] for i in self.ids if (self.block >> i) & 1)
+        # prerequisites among the target courses, for the critical path
+        self.needs = dict((courses.ids[cd], courses[cd].prerequisite_mask & self.target_mask) for cd in target)
+        self.ids.sort(key=lambda i: prerequisite_depth(courses, courses.designations[i]))
+
+    def _chains(self, remaining):
+        """Return a dictionary id -> number of semesters needed for that
+        course and the remaining courses that follow from it.
+        """
+        chain = {}
+        def length(i):
+            if i not in chain:
+                chain[i] = 1+max([length(j) for j in self.ids
+                                  if (remaining >> j) & 1 and (self.needs[j] >> i) & 1] or [0])
+            return chain[i]
+        for i in self.ids:
+            if (remaining >> i) & 1:
+                length(i)
+        return chain
+
+    def _earliest(self, t, remaining, k):
+        """Return a dictionary id -> the earliest semester in which each
+        remaining course could be taken, given the prerequisites still to
+        take and when courses are offered; or None if some course can't
+        be fit into the first k semesters.
+        """
+        est = {}
+        for i in self.ids:  # prerequisites come first
+            bit = 1 << i
+            if not(remaining & bit):
+                continue
+            u = max([t]+[est[j]+1 for j in est if (self.needs[i] >> j) & 1])
+            while u < k and not(self.offered[u] & bit):
+                u += 1
+            if u >= k:
+                return None
+            est[i] = u
+        return est
+
+    def _options(self, t, remaining, k):
+        """Return the sets of courses to try in semester t, best first, as
+        pairs mask, credits.
+        """
+        prior = self.all_mask & ~remaining
+        offered = self.offered[t]
+        if remaining & self.block and t == k-1:
+            # student teaching is the last semester, and alone
+            if remaining == self.block and (offered & self.block) == self.block:
+                return [(self.block, self.block_credits)]
+            return []
+        chain = self._chains(remaining)
+        eligible = []
+        for i in self.ids:
+            bit = 1 << i
+            if (remaining & bit) and not(self.block & bit) and (offered & bit):
+                c = self.courses[self.courses.designations[i]]
+                if not(c.prerequisite_mask & ~prior):
+                    left = len([u for u in range(t, k) if self.offered[u] & bit])
+                    eligible.append((-chain[i], left, i))
+        eligible.sort()
+        eligible = [i for (x, y, i) in eligible]
+        subsets = []
+        def extend(j, m, credits):
+            if len(subsets) >= 4*OPTIONS_PER_SEMESTER:
+                return
+            if j == len(eligible):
+                subsets.append((m, credits))
+                return
+            i = eligible[j]
+            if credits+self.credits[i] <= MAX_CREDITS:
+                extend(j+1, m | (1 << i), credits+self.credits[i])
+            extend(j+1, m, credits)
+        extend(0, 0, 0)
+        # corequisites must come before or alongside
+        subsets = [(m, credits) for (m, credits) in subsets
+                   if all(not(self.courses[self.courses.designations[i]].corequisite_mask & ~(prior | m))
+                          for i in self.ids if (m >> i) & 1)]
+        if self.objective == 'balanced':
+            left = sum(self.credits[i] for i in self.ids if (remaining & ~self.block) >> i & 1)
+            goal = left/max(1, k-t-(1 if remaining & self.block else 0))
+            subsets.sort(key=lambda x: abs(x[1]-goal))
+        return subsets[:OPTIONS_PER_SEMESTER]
+
+    def _fillers(self, loads, k):
+        """Return the LSC credits to add to each semester so that each has 12
+        to 18 credits, there are enough LSC full courses, and there are
+        enough credits to graduate; or None if that can't be done.
+        loads  list  the credits in each semester, or None for the student
+          teaching semester
+        """
+        lo, hi = [], []
+        for t in range(len(TERMS)):
+            if t >= k or loads[t] is None:
+                lo.append(0)
+                hi.append(0)
+            else:
+                lo.append(max(0, MIN_CREDITS-loads[t]))
+                hi.append(MAX_CREDITS-loads[t])
+        if any(a > b for (a, b) in zip(lo, hi)):
+            return None
+        credits_needed = GRADUATION_CREDITS-self.before_credits-self.block_credits-sum(x for x in loads if x)
+        full_needed = LSC_FULL_NEEDED-self.before_lsc
+        fill = list(lo)
+        while sum(fill) < credits_needed or sum(f // 4 for f in fill) < full_needed:
+            # round a half course up to a full one, else add a full one, else a half
+            halves = [t for t in range(k) if fill[t] % 4 and fill[t]+2 <= hi[t]]
+            fulls = [t for t in range(k) if fill[t]+4 <= hi[t]]
+            if halves:
+                open_terms, step = halves, 2
+            elif fulls:
+                open_terms, step = fulls, 4
+            else:
+                open_terms, step = [t for t in range(k) if fill[t]+2 <= hi[t]], 2
+            if not(open_terms):
+                return None
+            if self.objective == 'balanced':
+                t = min(open_terms, key=lambda u: ((loads[u] or 0)+fill[u], u))
+            else:
+                t = open_terms[0]
+            fill[t] += step
+        return fill
+
+    def run(self, k, on_solution):
+        """Search for plans using the first k semesters.  Call on_solution
+        with the list of masks and the list of fillers for each plan found;
+        it returns True to keep looking.
+        """
+        failed = set()
+        chosen = [0]*len(TERMS)
+        loads = [0]*len(TERMS)
+
+        def step(t, remaining):
+            self.nodes += 1
+            if self.nodes % 256 == 0 and time.perf_counter() > self.deadline:
+                raise out_of_time("Out of time")
+            if not(remaining):
+                fill = self._fillers(loads, k)
+                if fill is None:
+                    return False
+                return not(on_solution(list(chosen), fill))
+            if t >= k or (t, remaining) in failed:
+                return False
+            # Not enough semesters left for the longest prerequisite chain?
+            if self._earliest(t, remaining & ~self.block, k-(1 if remaining & self.block else 0)) is None:
+                failed.add((t, remaining))
+                return False
+            # Or not enough room for the credits?
+            left = sum(self.credits[i] for i in self.ids if (remaining & ~self.block) >> i & 1)
+            if left > MAX_CREDITS*(k-t-(1 if remaining & self.block else 0)):
+                failed.add((t, remaining))
+                return False
+            for m, credits in self._options(t, remaining, k):
+                chosen[t] = m
+                loads[t] = None if m == self.block else credits
+                if step(t+1, remaining & ~m):
+                    return True
+            chosen[t], loads[t] = 0, 0
+            failed.add((t, remaining))
+            return False
+
+        step(0, self.target_mask & ~self.before_mask)
+
+
+def generate_plan(courses, before=(), year=maed.THISYEAR, program='secondary', objective='earliest', budget=BUDGET):
+    """Search for a plan.  Return a generated_plan, or None if none was
+    found within the time budget.
+    courses  catalog
+    before  list of catalogue designations transferred in
+    objective  string  'earliest' uses as few semesters as it can;
+      'balanced' evens out the credits across the semesters
+    budget  float  seconds to spend
+    """
+    if objective not in OBJECTIVES:
+        raise maed.maedException("Unknown objective "+str(objective))
+    start_time = time.perf_counter()
+    deadline = start_time+budget
+    before = list(before)
+    best = []  # [(score, masks, fills, search)]
+    nodes = [0]
+    try:
+        targets = list(target_sets(courses, program, set(before)))
+        if objective == 'earliest':
+            before_credits = sum(courses[cd].credits for cd in before)
+            k_min = max(1, 1+(-(-(GRADUATION_CREDITS-before_credits-8) // MAX_CREDITS)))
+            for k in range(min(k_min, len(TERMS)), len(TERMS)+1):
+                for target in targets:
+                    search = _search(courses, before, target, year, program, objective, deadline)
+                    def found(masks, fill):
+                        best.append((k, masks, fill, search))
+                        return False
+                    try:
+                        search.run(k, found)
+                    finally:
+                        nodes[0] += search.nodes
+                    if best:
+                        break
+                if best:
+                    break
+        else:
+            for target in targets:
+                search = _search(courses, before, target, year, program, objective, deadline)
+                count = [0]
+                def found(masks, fill):
+                    loads = [sum(search.credits[i] for i in search.ids if (m >> i) & 1)+f
+                             for (m, f) in zip(masks, fill) if m != search.block]
+                    score = max(loads)-min(loads)
+                    if not(best) or score < best[0][0]:
+                        best[:] = [(score, masks, fill, search)]
+                    count[0] += 1
+                    return count[0] < BALANCED_SOLUTIONS and score > 2
+                try:
+                    search.run(len(TERMS), found)
+                finally:
+                    nodes[0] += search.nodes
+    except out_of_time:
+        pass
+    if not(best):
+        return None
+    score, masks, fill, search = best[0]
+    plan = {'BEFORE': sorted(before)}
+    for t, sem in enumerate(TERMS):
+        plan[sem] = courses.designations_in(masks[t])+[LSC_FULL]*(fill[t] // 4)+[LSC_HALF]*(fill[t] % 4 // 2)
+    r = generated_plan(plan, objective)
+    r.messages = maed.requirements_test(r.student, year, program, None, courses)
+    r.nodes = nodes[0]
+    r.seconds = time.perf_counter()-start_time
+    return r
+
+
+# Sample plans shown on the form page, by (catalog version, programs'
+# version, year parity)
+_SAMPLES_CACHE = {}
+# The plans found are also saved here, since the CGI script starts afresh
+# for each request and finding them takes a second or two.  So is a search
+# that failed; delete the file to have it made again.
+SAMPLES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maed_plan.samples')
+
+def _read_saved_samples():
+    """Return the dictionary (catalog version, programs' version, parity) ->
+    list of triples program, text, plan saved in SAMPLES_FILE, or None if
+    the plans could not be found, or an empty dictionary.
+    """
+    try:
+        with open(SAMPLES_FILE, 'rb') as f:
+            saved = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+    if not isinstance(saved, dict):
+        return {}
+    return saved
+
+def _save_samples(key, plans):
+    """Add the plans found for key to SAMPLES_FILE, or None if they could
+    not be found, so that a CGI request does not search again.  A directory
+    that cannot be written only means the search is made again next time.
+    """
+    saved = _read_saved_samples()
+    if plans is None:
+        saved[key] = None
+    else:
+        saved[key] = [(program, text, r.plan) for (program, text, r) in plans]
+    tmp = SAMPLES_FILE+'.'+str(os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(marshal.dumps(saved))
+        os.replace(tmp, SAMPLES_FILE)
+    except OSError as e:
+        if maed.VERBOSE:
+            maed.warn("unable to save the sample plans: "+str(e))
+SAMPLE_BUDGET = 0.5  # seconds for each sample plan
+# The programs whose sample plans the form shows, in order
+SAMPLE_PROGRAMS = ['secondary', 'primary']
+SAMPLE_STARTS = [([], "This person begins with MA&nbsp;150, Calculus&nbsp;I."),
+                 (['MA150', 'LSC004'], "This person took Calculus&nbsp;I in high school, and also transferred in one LSC course.")]
+
+def _sample_course(courses, cd):
+    """How a course appears in a sample plan, such as MA 150.
+    """
+    c = courses[cd]
+    if c.dept == 'LSC':
+        if c.credits < 4:
+            return 'LSC half course'
+        return 'LSC'
+    return "{dept}&nbsp;{num:03d}".format(dept=c.dept, num=c.num)
+
+def _make_html_plan_table(courses, r, year):
+    """Return the HTML table for generated_plan r.
+    """
+    t = ["<table class='plans'>\n"]
+    if r.plan.get('BEFORE'):
+        t.append("  <tr>\n    <td>Transferred in</td>\n    <td colspan='2'>{c}</td>\n    </tr>\n".format(c=', '.join(_sample_course(courses, cd) for cd in r.plan['BEFORE'])))
+    t.append("  <tr>\n    <th></th>\n    <th>Fall</th>\n    <th>Spring</th>\n    </tr>\n")
+    for n, (y, label) in enumerate([('ONE', 'First year'), ('TWO', 'Sophmore'), ('THREE', 'Junior'), ('FOUR', 'Senior')]):
+        t.append("  <tr>\n    <td>{label}, {year}</td>\n".format(label=label, year=year+n))
+        for w in ['FALL', 'SPRING']:
+            sem_courses = sorted(r.plan.get(y+'_'+w, []), key=lambda cd: (courses[cd].dept == 'LSC', cd))
+            t.append("    <td>{c}</td>\n".format(c=', '.join(_sample_course(courses, cd) for cd in sem_courses)))
+        t.append("    </tr>\n")
+    t.append("  </table>\n")
+    return ''.join(t)
+
+def make_html_sample_plans(courses, year):
+    """Return the HTML for the sample plans, generated from the catalog, or
+    None if some plan could not be found in time.  The plans are the same
+    for all years of the same parity, so they are cached by that, and by
+    the versions of the catalog and the programs.
+    """
+    key = (courses.version, maed.programs_version(), year % 2)
+    if key not in _SAMPLES_CACHE:
+        saved = _read_saved_samples()
+        if key in saved:
+            if saved[key] is None:
+                _SAMPLES_CACHE[key] = None
+            else:
+                _SAMPLES_CACHE[key] = [(program, text, generated_plan(plan, 'balanced')) for (program, text, plan) in saved[key]]
+    if key not in _SAMPLES_CACHE:
+        plans = []
+        for program in [p for p in SAMPLE_PROGRAMS if p in maed.program_definitions()]:
+            for before, text in SAMPLE_STARTS:
+                r = generate_plan(courses, before, year, program, 'balanced', SAMPLE_BUDGET)
+                if r is None:
+                    plans = None  # remember that, too, rather than search again
+                    break
+                plans.append((program, text, r))
+            if plans is None:
+                break
+        _SAMPLES_CACHE[key] = plans
+        if courses.version is not None:
+            _save_samples(key, plans)
+    if _SAMPLES_CACHE[key] is None:
+        return None
+    definitions = maed.program_definitions()
+    h = []
+    for program, text, r in _SAMPLES_CACHE[key]:
+        if text == SAMPLE_STARTS[0][1]:
+            h.append("\n<h4>{title}</h4>\n".format(title=definitions[program]['title']))
+        h.append("\n<p>\n  {text}\n  </p>\n\n".format(text=text))
+        h.append(_make_html_plan_table(courses, r, year))
+    h.append("\n<p>\n  Filling the open slots with LSC courses is only one choice; you can take additional Math courses, or courses in Computer Science or a natural science, or whatever you like.\n  Any substitutions need to be discussed with your advisor and approved by the Department Chairs.\n  </p>\n")
+    return ''.join(h)
+
+
+#==================================================================
+def main(args):
+    courses = maed.load_catalog(args['catalog'] or maed.COURSEFILE)
+    r = generate_plan(courses, args['before'], args['year'], args['program'], args['objective'], args['budget'])
+    if r is None:
+        maed.error("No plan found in {budget} seconds.\n".format(budget=args['budget']))
+    print(maed.make_plain(courses, r.student, args['year'], args['program'], args['name'], None, r.messages, header=False))
+    if maed.VERBOSE:
+        maed.warn("{nodes} search steps in {seconds:.3f} secs".format(nodes=r.nodes, seconds=r.seconds))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=globals()['__doc__'])
+    parser.add_argument('-v','--version', action='version', version='%(prog)s '+globals()['__version__'])
+    parser.add_argument('-V', '--verbose', action='store_true', default=False, help='verbose output')
+    parser.add_argument('-y', '--year', type=int, default=maed.THISYEAR, help='entry year (default: %(default)s)')
+    parser.add_argument('-p', '--program', choices=maed.program_names(), default='secondary', help='program (default: %(default)s)')
+    parser.add_argument('-o', '--objective', choices=OBJECTIVES, default='earliest', help='what to optimize (default: %(default)s)')
+    parser.add_argument('-b', '--budget', type=float, default=BUDGET, help='seconds to search (default: %(default)s)')
+    parser.add_argument('-n', '--name', default=None, help='name for the summary')
+    parser.add_argument('-c', '--catalog', default=None, help='course data file (default: maed.csv next to maed.py)')
+    parser.add_argument('before', nargs='*', help='catalogue designations transferred in, such as MA150')
+    args = vars(parser.parse_args())
+    maed.VERBOSE = args['verbose']
+    main(args)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Serve the MATH-ED plan checker from a long-running process.
+
+This is a WSGI application, plus a small pre-fork HTTP server to run it.  The
+course catalogs are read once in each worker, rather than once per request as
+with the CGI script maed.py.  A worker reads the catalog of a year only when
+a plan from that year comes in, and keeps the few most recently used; see
+maed.catalog_for().
+
+A POST to /api/validate of a plan as JSON gets back the test results as
+JSON, without the page being made; see maed.validate_json().  A GET of
+/api/search?q=.. finds courses for the type-ahead; see maed.search_json().
+"""
+__version__ = '0.9.0'
+__author__ = 'Jim Hefferon'
+__license__ = 'GPL 3'
+
+import sys, os, signal, argparse
+
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+import maed
+
+WORKERS = 4
+HOST = ''
+PORT = 8000
+
+# The course file given on the command line, if any; see load_courses()
+coursefile = None
+
+
+def load_courses():
+    """Return the catalog of the course file that the server was given, 
+    reading it if this worker has not yet.  Return None if it was not given
+    one, so that each plan is tested against the catalog of its own year.
+    """
+    if coursefile is None:
+        return None
+    return maed.catalog_for(maed.THISYEAR, coursefile)
+
+def api_validate(environ, start_response, timer):
+    """Answer a POST of a plan as JSON with the test results as JSON.
+    """
+    if environ.get('REQUEST_METHOD') != 'POST':
+        start_response('405 Method Not Allowed', [('Allow', 'POST'), ('Content-Type', 'text/plain')])
+        return [b"Send the plan as a POST.\n"]
+    try:
+        data = maed.read_body(environ, environ['wsgi.input'])
+    except maed.bad_request as e:
+        import json
+        status, answer = e.status, json.dumps({'error': str(e)})
+    else:
+        with timer.stage('load'):
+            crs = load_courses()
+        status, answer = maed.validate_json(crs, data, timer)
+    body = answer.encode('utf-8')
+    start_response(status, [('Content-Type', 'application/json'),
+                            ('Content-Length', str(len(body))),
+                            ('Server-Timing', timer.server_timing())])
+    return [body]
+
+def api_search(environ, start_response, timer):
+    """Answer a GET of a course search with the courses found as JSON.
+    """
+    with timer.stage('load'):
+        crs = load_courses()
+    with timer.stage('search'):
+        status, answer = maed.search_json(crs, maed.parse_fields(environ.get('QUERY_STRING', ''), {}))
+    body = answer.encode('utf-8')
+    start_response(status, [('Content-Type', 'application/json'),
+                            ('Content-Length', str(len(body))),
+                            ('Server-Timing', timer.server_timing())])
+    return [body]
+
+def _finished(chunks, timer, profile, **fields):
+    """Generate the pieces of the answer, and once they are all sent, log
+    the timings and save the profile.
+    """
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        maed.finish_request(timer, profile, **fields)
+
+def application(environ, start_response):
+    """The WSGI callable.
+    """
+    timer = maed.request_timer()
+    profile = maed.start_profile()
+    path = environ.get('PATH_INFO', '')
+    if path == maed.API_VALIDATE:
+        return _finished(api_validate(environ, start_response, timer), timer, profile, path=path)
+    if path == maed.API_SEARCH:
+        return _finished(api_search(environ, start_response, timer), timer, profile, path=path)
+    with timer.stage('load'):
+        crs = load_courses()
+    try:
+        with timer.stage('parse'):
+            form = maed.read_form(environ, environ['wsgi.input'])
+        content_type, chunks = maed.respond_chunks(crs, form, header=False, timer=timer)
+    except maed.bad_request as e:
+        start_response(e.status, [('Content-Type', 'text/plain')])
+        return _finished([(str(e)+"\n").encode('utf-8')], timer, profile, path=path)
+    # The page is made as it is sent, so its time is only in the log line
+    headers = [('Content-Type', content_type+'; charset=utf-8'),
+               ('Vary', 'Accept-Encoding'),
+               ('Server-Timing', timer.server_timing())]
+    compress = maed.accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING', ''))
+    if compress:
+        headers.append(('Content-Encoding', 'gzip'))
+    start_response('200 OK', headers)
+    return _finished(maed.encode_chunks(timer.timed_chunks(chunks), compress), timer, profile, path=path)
+
+
+class quiet_handler(WSGIRequestHandler):
+    """Log requests only when verbose.
+    """
+    def log_message(self, format, *args):
+        if maed.VERBOSE:
+            WSGIRequestHandler.log_message(self, format, *args)
+
+
+def _run_worker(server):
+    """Serve requests in a forked child until killed.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    maed.catalog_for(maed.THISYEAR, coursefile)  # the one most asked for
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+def serve(host=HOST, port=PORT, workers=WORKERS, fn=None):
+    """Listen on host:port and hand the connections to a pool of forked
+    workers, restarting any worker that dies.
+    workers  positive integer  number of worker processes
+    fn  string or None  file name of the course data, for all years; if None,
+      each year's own
+    """
+    global coursefile
+    if workers < 1:
+        raise maed.maedException("There must be at least one worker.")
+    coursefile = fn
+    server = make_server(host, port, application, handler_class=quiet_handler)
+    children = set()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(server)
+        children.add(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for i in range(workers):
+        spawn()
+    if maed.VERBOSE:
+        maed.warn("serving on port {port} with {n} workers".format(port=port, n=workers))
+    while True:
+        pid, status = os.wait()
+        children.discard(pid)
+        maed.warn("worker {pid} exited; starting a new one".format(pid=pid))
+        spawn()
+
+
+#==================================================================
+def main(args):
+    serve(args['host'], args['port'], args['workers'], args['catalog'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=globals()['__doc__'])
+    parser.add_argument('-v','--version', action='version', version='%(prog)s '+globals()['__version__'])
+    parser.add_argument('-V', '--verbose', action='store_true', default=False, help='verbose output')
+    parser.add_argument('--host', default=HOST, help='address to listen on (default: all)')
+    parser.add_argument('-p', '--port', type=int, default=PORT, help='port to listen on (default: %(default)s)')
+    parser.add_argument('-w', '--workers', type=int, default=WORKERS, help='number of worker processes (default: %(default)s)')
+    parser.add_argument('-c', '--catalog', default=None, help='course data file for all years (default: maed-<year>.csv or maed.csv next to maed.py)')
+    args = vars(parser.parse_args())
+    maed.VERBOSE = args['verbose']
+    main(args)
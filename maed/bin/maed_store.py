@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Keep students' plans in a SQLite file, and forecast course demand from them.
+
+A plan is stored under the student's name and the year they start, so a
+later plan for the same student and year replaces the earlier one.  Plans
+get in by  import  from a JSONL or CSV file in the format of maed_batch.py,
+or, if the environment variable MAED_STORE names the store, from the web
+page each time a plan with a name is submitted as Done.
+
+  impact  compares two versions of the course data, say maed.csv before
+and after an edit, as in  impact -c new-maed.csv maed.csv .  It finds the courses that changed, takes from an index
+of course -> plans just the stored plans that have those courses (or
+courses that depend on them), and tests only those against both versions.
+It reports the plans that passed before and fail now, with their new 
+messages.
+
+  forecast  counts, for each course and each calendar term, the stored
+plans that have the course then, so a chair can see how many students
+will want MA403 in Fall 2027.  A course that is wanted in a term when it
+is not offered, as with the courses given only in odd- or even-Fall years,
+is marked.  The counting uses NumPy if it is installed.
+"""
+__version__ = '0.9.0'
+__author__ = 'Jim Hefferon'
+__license__ = 'GPL 3'
+
+import sys, os, csv, json, time, sqlite3
+import datetime
+
+import maed
+
+STORE_FILE = os.path.join(os.path.dirname(maed.COURSEFILE), "maed_store.sqlite")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+  name TEXT NOT NULL,
+  year INTEGER NOT NULL,
+  program TEXT NOT NULL,
+  plan TEXT NOT NULL,  -- JSON object semester -> list of catalogue designations
+  catalog TEXT,  -- version of the catalog it was tested against
+  saved TEXT NOT NULL,
+  PRIMARY KEY (name, year));
+-- The inverted index: for each course, the plans that have it
+CREATE TABLE IF NOT EXISTS plan_courses (
+  plan INTEGER NOT NULL,  -- rowid in plans
+  course TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS plan_courses_course ON plan_courses (course);
+CREATE INDEX IF NOT EXISTS plan_courses_plan ON plan_courses (plan);
+"""
+
+
+def connect(fn=STORE_FILE):
+    """Open the store, making it if need be.  Return a sqlite3 connection.
+    """
+    db = sqlite3.connect(fn, timeout=10)
+    indexed = db.execute("SELECT 1 FROM sqlite_master WHERE name='plan_courses'").fetchone()
+    db.executescript(SCHEMA)
+    if not indexed:
+        index_plans(db)  # a store made before there was an index
+    return db
+
+def plan_courses(plan):
+    """Return the set of catalogue designations in a plan given as JSON.
+    """
+    return set(cd for designations in json.loads(plan).values() for cd in designations)
+
+def index_plans(db):
+    """Make the course -> plans index afresh from the stored plans.
+    """
+    with db:
+        db.execute("DELETE FROM plan_courses")
+        db.executemany("INSERT INTO plan_courses (plan, course) VALUES (?, ?)",
+                       ((rowid, cd) for (rowid, plan) in db.execute("SELECT rowid, plan FROM plans").fetchall() for cd in plan_courses(plan)))
+
+def plan_json(student):
+    """Return the plan as JSON, listing only the semesters with courses.
+    """
+    return json.dumps(dict((sem, student[sem].courses) for sem in maed.SEMESTERS if student[sem].courses), sort_keys=True)
+
+def save_plans(db, plans):
+    """Store the plans, replacing any earlier ones for the same student and
+    year.  Return how many were stored.
+    plans  iterable of tuples  name, year, program, student, catalog version
+    """
+    saved = datetime.datetime.now().isoformat(timespec='seconds')
+    n = 0
+    with db:
+        for (name, year, program, student, version) in plans:
+            plan = plan_json(student)
+            # An update keeps the rowid, which the index refers to
+            db.execute("INSERT INTO plans (name, year, program, plan, catalog, saved) VALUES (?, ?, ?, ?, ?, ?)"
+                       " ON CONFLICT (name, year) DO UPDATE SET program=excluded.program, plan=excluded.plan, catalog=excluded.catalog, saved=excluded.saved",
+                       (name, year, program, plan, version, saved))
+            rowid = db.execute("SELECT rowid FROM plans WHERE name=? AND year=?", (name, year)).fetchone()[0]
+            db.execute("DELETE FROM plan_courses WHERE plan=?", (rowid,))
+            db.executemany("INSERT INTO plan_courses (plan, course) VALUES (?, ?)", ((rowid, cd) for cd in plan_courses(plan)))
+            n += 1
+    return n
+
+def save_submitted(fn, name, year, program, student, courses):
+    """Store a plan submitted from the web page.  A store that cannot be
+    written is reported but does not stop the page.
+    """
+    try:
+        db = connect(fn)
+        try:
+            save_plans(db, [(name, year, program, student, courses.version)])
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        maed.warn("unable to store the plan of "+name+": "+str(e))
+
+def import_plans(db, infile, fmt):
+    """Store the plans read from a file in the format of maed_batch.py.
+    Plans without a name are skipped, as there is nothing to key them by,
+    and so are those that cannot be read or are for no known program.
+    Return the numbers of plans stored and skipped, and the list of pairs
+    line number, error for those that could not be read.
+    fmt  string  one of 'jsonl', 'csv'
+    """
+    import maed_batch
+    def plans():
+        for line_number, record in maed_batch.read_plans(infile, fmt):
+            try:
+                if isinstance(record, str):
+                    record = json.loads(record)
+                if not isinstance(record, dict):
+                    raise ValueError("The plan must be a JSON object.")
+                student, year, program = maed.plan_from_record(record)
+                if program not in maed.program_definitions():
+                    raise maed.maedException("No such program: "+str(program))
+                name = record.get('name')
+            except KeyError as e:
+                bad.append((line_number, "Unknown catalogue designation "+str(e)))
+                continue
+            except (ValueError, OSError, maed.maedException) as e:
+                bad.append((line_number, str(e)))
+                continue
+            if not name:
+                skipped.append(line_number)
+                continue
+            yield name, year, program, student, None
+    skipped, bad = [], []
+    stored = save_plans(db, plans())
+    return stored, len(skipped), bad
+
+# -------------------------------------
+# What a change to the course data does to the stored plans
+# The course attributes that the tests look at, and the others
+TESTED_FIELDS = ('dept', 'credits', 'year_odd_fall', 'year_even_fall', 'fall', 'spring', 'prerequisites', 'corequisites')
+OTHER_FIELDS = ('name', 'notes')
+
+def catalog_changes(old, new):
+    """Return a dictionary catalogue designation -> list of what changed
+    about it between two catalogs: the names of the fields, or 'added' or
+    'removed'.
+    """
+    r = {}
+    for cd in sorted(set(old) | set(new)):
+        if cd not in old:
+            r[cd] = ['added']
+        elif cd not in new:
+            r[cd] = ['removed']
+        else:
+            fields = [f for f in TESTED_FIELDS+OTHER_FIELDS if getattr(old[cd], f) != getattr(new[cd], f)]
+            if fields:
+                r[cd] = fields
+    return r
+
+def affected_courses(old, new, changes):
+    """Return the set of courses whose changes can alter a plan's results:
+    those with a tested field changed, added, or removed, and those that 
+    have one of them as a prerequisite, however far back, in either catalog,
+    since the messages about a missing prerequisite name the chain.
+    """
+    changed = set(cd for (cd, fields) in changes.items() if any(f not in OTHER_FIELDS for f in fields))
+    r = set(changed)
+    for courses in (old, new):
+        m = courses.mask(cd for cd in changed if cd in courses)
+        r.update(cd for (cd, c) in courses.items() if c.prerequisite_closure & m)
+    return r
+
+def test_plan(record, courses):
+    """Return the messages from testing a stored plan against the catalog,
+    starting with any about courses that the catalog does not have.
+    record  tuple  name, year, program, plan as JSON
+    """
+    name, year, program, plan = record
+    student = maed.make_student(json.loads(plan))
+    unknown = maed.drop_unknown_courses(student, courses)
+    return unknown+maed.requirements_test(student, year, program, None, courses)
+
+def impact(db, old, new):
+    """Test against both catalogs the stored plans that the changes from the
+    old one to the new one can affect.  Return the changes, the number of
+    plans tested, a list of those that the new catalog gives messages
+    that the old did not, each the tuple name, year, program, whether it
+    passed before, the new messages, and a list of those that could not be
+    tested, each the tuple name, year, program, why.
+    """
+    changes = catalog_changes(old, new)
+    affected = sorted(affected_courses(old, new, changes))
+    changed, untestable, tested = [], [], 0
+    if affected:
+        rows = db.execute("SELECT name, year, program, plan FROM plans WHERE rowid IN"
+                          " (SELECT plan FROM plan_courses WHERE course IN ("+','.join('?'*len(affected))+"))"
+                          " ORDER BY year, name", affected)
+        for record in rows:
+            tested += 1
+            try:
+                before = test_plan(record, old)
+                after = test_plan(record, new)
+            except maed.maedException as e:  # such as a program since removed
+                untestable.append(tuple(record[:3])+(str(e),))
+                continue
+            messages = [msg for msg in after if msg not in before]
+            if messages:
+                changed.append(tuple(record[:3])+(not before, messages))
+    return changes, tested, changed, untestable
+
+def write_impact(f, changes, tested, total, changed, untestable=(), everything=False):
+    """Write the report of impact(): the plans that passed before and fail
+    now, or if everything is True, all that have new messages, and then
+    those that could not be tested.
+    """
+    f.write("Courses changed:\n")
+    for cd, fields in changes.items():
+        f.write("  {cd}: {fields}\n".format(cd=cd, fields=', '.join(fields)))
+    if not changes:
+        f.write("  none\n")
+    broken = [plan for plan in changed if plan[3]]
+    f.write("\n{t} of the {n} stored plans have affected courses.  {c} of those have new messages,"
+            " and {b} passed before and fail now.\n".format(t=tested, n=total, c=len(changed), b=len(broken)))
+    for name, year, program, passed, messages in (changed if everything else broken):
+        f.write("\n{name} ({year}, {program}){passed}\n".format(name=name, year=year, program=program,
+                                                              passed=", passed before" if passed else ""))
+        for msg in messages:
+            f.write("  "+msg+"\n")
+    if untestable:
+        f.write("\n{u} of the plans with affected courses could not be tested:\n".format(u=len(untestable)))
+        for name, year, program, why in untestable:
+            f.write("  {name} ({year}, {program}): {why}\n".format(name=name, year=year, program=program, why=why))
+
+# -------------------------------------
+# Forecasting
+def read_terms(db):
+    """Read the stored plans.  Return the list of catalogue designations and
+    the list of terms (calendar year, season) that occur, and the parallel
+    lists of plan numbers, course numbers, and term numbers, one entry for
+    each course in each semester of each plan.  BEFORE and AFTER are left out.
+    """
+    # The term of each semester is its year offset plus the entry year
+    offsets = dict((sem, maed.semester_term(sem, 0)) for sem in maed.SEMESTERS if maed.semester_term(sem, 0))
+    course_numbers, term_numbers = {}, {}
+    plan_list, course_list, term_list = [], [], []
+    for i, (year, plan) in enumerate(db.execute("SELECT year, plan FROM plans")):
+        for sem, designations in json.loads(plan).items():
+            if sem not in offsets:
+                continue
+            offset, season = offsets[sem]
+            term = (year+offset, season)
+            t = term_numbers.setdefault(term, len(term_numbers))
+            for cd in designations:
+                plan_list.append(i)
+                course_list.append(course_numbers.setdefault(cd, len(course_numbers)))
+                term_list.append(t)
+    courses = sorted(course_numbers, key=course_numbers.get)
+    terms = sorted(term_numbers, key=term_numbers.get)
+    return courses, terms, plan_list, course_list, term_list
+
+def count_demand(n_courses, n_terms, plan_list, course_list, term_list):
+    """Return the table course number -> term number -> how many plans have
+    the course in that term, counting a plan once even if it lists a course
+    twice in a semester.
+    """
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is None:
+        counts = [[0]*n_terms for c in range(n_courses)]
+        for key in set(zip(plan_list, course_list, term_list)):
+            counts[key[1]][key[2]] += 1
+        return counts
+    # The plans x courses x terms incidence matrix, kept as the flat index
+    # of each nonzero entry
+    plans = numpy.asarray(plan_list, dtype=numpy.int64)
+    cells = numpy.asarray(course_list, dtype=numpy.int64)*n_terms+numpy.asarray(term_list, dtype=numpy.int64)
+    incidence = numpy.unique(plans*(n_courses*n_terms)+cells)
+    counts = numpy.bincount(incidence % (n_courses*n_terms), minlength=n_courses*n_terms)
+    return counts.reshape(n_courses, n_terms).tolist()
+
+def forecast(db, courses, only=None, first=None, last=None):
+    """Return the terms, in calendar order, and a list of rows, each the
+    catalogue designation, then for each term the pair how many plans have
+    the course then, whether the catalog offers it then.
+    courses  catalog  for when courses are offered
+    only  list of catalogue designations or None  the courses to report
+    first, last  integers or None  the calendar years to report
+    """
+    designations, terms, plan_list, course_list, term_list = read_terms(db)
+    counts = count_demand(len(designations), len(terms), plan_list, course_list, term_list)
+    keep = [t for t in range(len(terms))
+            if (first is None or terms[t][0] >= first) and (last is None or terms[t][0] <= last)]
+    keep.sort(key=lambda t: maed.calendar_key(*terms[t]))
+    years = [terms[t][0] for t in keep] or [0]
+    rows = []
+    for c in sorted(range(len(designations)), key=lambda c: designations[c]):
+        cd = designations[c]
+        if only and cd not in only:
+            continue
+        offered = set(maed.offering_calendar(courses, cd, min(years), max(years))) if cd in courses else set()
+        row = [(counts[c][t], terms[t] in offered) for t in keep]
+        if any(n for (n, offered) in row):
+            rows.append([cd]+row)
+    return [terms[t] for t in keep], rows
+
+def write_forecast(f, terms, rows, fmt='text'):
+    """Write the forecast as a table, or as CSV.
+    """
+    headings = ["{season} {year}".format(season=season.capitalize(), year=year) for (year, season) in terms]
+    if fmt == 'csv':
+        w = csv.writer(f)
+        w.writerow(['course']+headings+['not offered'])
+        for row in rows:
+            w.writerow([row[0]]+[n for (n, offered) in row[1:]]+[' '.join(h for (h, (n, offered)) in zip(headings, row[1:]) if n and not offered)])
+        return
+    width = max([len(h) for h in headings]+[4])+2
+    f.write("{:8}".format('course')+''.join((h+' ').rjust(width) for h in headings)+"\n")
+    marked = False
+    for row in rows:
+        cells = []
+        for n, offered in row[1:]:
+            if not n:
+                cells.append('. ')
+            elif offered:
+                cells.append(str(n)+' ')
+            else:
+                cells.append(str(n)+'*')
+                marked = True
+        f.write("{:8}".format(row[0])+''.join(c.rjust(width) for c in cells)+"\n")
+    if marked:
+        f.write("* the course is not offered that term\n")
+
+
+#==================================================================
+def main(args):
+    db = connect(args['store'])
+    command = args['command']
+    if command == 'import':
+        fmt = 'csv' if args['file'].lower().endswith('.csv') else 'jsonl'
+        start_time = time.perf_counter()
+        if args['file'] == '-':
+            stored, skipped, bad = import_plans(db, sys.stdin, fmt)
+        else:
+            with open(args['file'], newline='') as f:
+                stored, skipped, bad = import_plans(db, f, fmt)
+        for line_number, error in bad:
+            sys.stderr.write("line {n}: {error}\n".format(n=line_number, error=error))
+        lines = ''
+        if bad:
+            lines = ': line '+', '.join(str(n) for (n, error) in bad)
+        sys.stderr.write("Stored {n} plans ({s} without a name skipped, {b} not read{lines}) in {secs:.2f} secs\n".format(n=stored, s=skipped, b=len(bad), lines=lines, secs=time.perf_counter()-start_time))
+    elif command == 'list':
+        for name, year, program, saved in db.execute("SELECT name, year, program, saved FROM plans ORDER BY year, name"):
+            print("{year}  {program:9}  {saved}  {name}".format(year=year, program=program, saved=saved, name=name))
+    elif command == 'impact':
+        start_time = time.perf_counter()
+        old = maed.load_catalog(args['file'])
+        new = maed.load_catalog(args['catalog'] or maed.COURSEFILE)
+        changes, tested, changed, untestable = impact(db, old, new)
+        total = db.execute("SELECT count(*) FROM plans").fetchone()[0]
+        write_impact(sys.stdout, changes, tested, total, changed, untestable, args['all'])
+        if maed.VERBOSE:
+            maed.warn("impact in {secs:.2f} secs".format(secs=time.perf_counter()-start_time))
+    elif command == 'forecast':
+        start_time = time.perf_counter()
+        courses = maed.catalog_for(maed.THISYEAR, args['catalog'])
+        terms, rows = forecast(db, courses, args['course'], args['first'], args['last'])
+        write_forecast(sys.stdout, terms, rows, 'csv' if args['csv'] else 'text')
+        if maed.VERBOSE:
+            maed.warn("forecast in {secs:.2f} secs".format(secs=time.perf_counter()-start_time))
+    db.close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=globals()['__doc__'], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v','--version', action='version', version='%(prog)s '+globals()['__version__'])
+    parser.add_argument('-V', '--verbose', action='store_true', default=False, help='report timings')
+    parser.add_argument('-s', '--store', default=os.environ.get(maed.STORE_VAR) or STORE_FILE, help='store file (default: $MAED_STORE, or maed_store.sqlite next to maed.py)')
+    commands = parser.add_subparsers(dest='command', metavar='command', help='what to do')
+    commands.required = True
+    p = commands.add_parser('import', help='store the plans in a file')
+    p.add_argument('file', nargs='?', default='-', help='JSONL or CSV file of plans (default: standard input)')
+    p = commands.add_parser('list', help='list the stored plans')
+    p = commands.add_parser('impact', help='test the stored plans against a new version of the course data')
+    p.add_argument('-c', '--catalog', default=None, help='the new course data file (default: maed.csv)')
+    p.add_argument('-a', '--all', action='store_true', default=False, help='list every plan with new messages, not just those that passed before')
+    p.add_argument('file', help='the old course data file')
+    p = commands.add_parser('forecast', help='count the plans that have each course in each term')
+    p.add_argument('-c', '--catalog', default=None, help='course data file, for when courses are offered (default: maed.csv or this year\'s)')
+    p.add_argument('-C', '--course', action='append', default=None, help='forecast only this course, may be repeated')
+    p.add_argument('--first', type=int, default=None, help='first calendar year to forecast')
+    p.add_argument('--last', type=int, default=None, help='last calendar year to forecast')
+    p.add_argument('--csv', action='store_true', default=False, help='write the forecast as CSV')
+    args = vars(parser.parse_args())
+    maed.VERBOSE = args['verbose']
+    main(args)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the parts of maed.py where a silent break loses data: plan codes,
+which are in links that students have saved, reading the form, and the
+matching of courses to the mathematics requirements.
+
+Run  python3 -m unittest test_maed  here, or pytest.
+"""
+__version__ = '0.9.0'
+__author__ = 'Jim Hefferon'
+__license__ = 'GPL 3'
+
+import io, random, unittest
+
+import maed
+
+def random_plan(courses, rnd):
+    """Return a plan, a dictionary semester -> list of catalogue designations,
+    with a few courses chosen at random for some of the semesters.
+    """
+    designations = sorted(courses)
+    plan = {}
+    for sem in maed.SEMESTERS:
+        if rnd.random() < 0.7:
+            plan[sem] = rnd.sample(designations, rnd.randint(0, 6))
+    return plan
+
+class test_plan_codes(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.courses = maed.load_catalog(maed.COURSEFILE)
+
+    def test_round_trip(self):
+        rnd = random.Random(1)
+        programs = maed.program_names()
+        for k in range(500):
+            plan = random_plan(self.courses, rnd)
+            year = rnd.randint(maed.FIRST_YEAR, maed.LAST_YEAR)
+            program = rnd.choice(programs)
+            token = maed.encode_plan(maed.make_student(plan), year, program, self.courses)
+            self.assertRegex(token, r'^[A-Za-z0-9_-]+$')
+            student, y, p = maed.decode_plan(token, self.courses)
+            self.assertEqual((y, p), (year, program))
+            for sem in maed.SEMESTERS:
+                self.assertEqual(sorted(student[sem].courses), sorted(plan.get(sem, [])))
+
+    def test_changed_character(self):
+        rnd = random.Random(2)
+        alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'
+        for k in range(50):
+            plan = random_plan(self.courses, rnd)
+            token = maed.encode_plan(maed.make_student(plan), 2024, 'secondary', self.courses)
+            # The last character can have bits that are not used
+            for i in range(len(token)-1):
+                c = rnd.choice(alphabet.replace(token[i], ''))
+                with self.assertRaises(maed.bad_request):
+                    maed.decode_plan(token[:i]+c+token[i+1:], self.courses)
+
+    def test_other_catalog(self):
+        token = maed.encode_plan(maed.make_student({'ONE_FALL': ['MA150']}), 2024, 'secondary', self.courses)
+        other = maed.load_catalog(maed.COURSEFILE)
+        other.version = 'another version'
+        with self.assertRaises(maed.bad_request):
+            maed.decode_plan(token, other)
+
+    def test_year_out_of_range(self):
+        for year in (-5, maed.FIRST_YEAR-1, maed.LAST_YEAR+1, 99999, 'x'):
+            with self.assertRaises(maed.bad_request):
+                maed.plan_from_record({'year': year, 'plan': {}})
+
+class test_form(unittest.TestCase):
+
+    def test_parse_fields(self):
+        fields = maed.parse_fields('ONE_FALL=MA150&ONE_FALL=ma+160&name=J%C3%BCrgen+S&blank=&&ONE_FALL=%41', {})
+        self.assertEqual(fields, {'ONE_FALL': ['MA150', 'ma 160', 'A'], 'name': ['Jürgen S']})
+
+    def test_too_many_fields(self):
+        maed.parse_fields('&'.join(['a=1']*maed.MAX_FIELDS), {})
+        with self.assertRaises(maed.bad_request) as e:
+            maed.parse_fields('&'.join(['a=1']*(maed.MAX_FIELDS+1)), {})
+        self.assertTrue(e.exception.status.startswith('413'))
+        # The query string counts with the body
+        environ = {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': '3', 'QUERY_STRING': '&'.join(['a=1']*maed.MAX_FIELDS)}
+        with self.assertRaises(maed.bad_request):
+            maed.read_form(environ, io.BytesIO(b'b=2'))
+
+    def test_read_form(self):
+        body = b'program=primary&catalogue_year=2024&ONE_FALL=MA150&ONE_FALL=ma+160'
+        environ = {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': str(len(body)),
+                   'CONTENT_TYPE': 'application/x-www-form-urlencoded', 'QUERY_STRING': 'name=J'}
+        form = maed.read_form(environ, io.BytesIO(body))
+        student, year, program, name, submit = maed.parse_data(form)
+        self.assertEqual((year, program, name, submit), (2024, 'primary', 'J', None))
+        self.assertEqual(student['ONE_FALL'].courses, ['MA150', 'MA160'])
+
+    def test_body_too_large(self):
+        body = b'a=1&'*(maed.MAX_BODY//4+1)
+        environ = {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': str(len(body))}
+        with self.assertRaises(maed.bad_request) as e:
+            maed.read_form(environ, io.BytesIO(body))
+        self.assertTrue(e.exception.status.startswith('413'))
+        with self.assertRaises(maed.bad_request) as e:
+            maed.read_body({'CONTENT_LENGTH': 'lots'}, io.BytesIO(b''))
+        self.assertTrue(e.exception.status.startswith('400'))
+
+class test_matching(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.courses = maed.load_catalog(maed.COURSEFILE)
+
+    def math_messages(self, designations):
+        student = maed.make_student({'AFTER': designations})
+        return [m for m in maed.requirements_test(student, 2024, 'secondary', None, self.courses) if m.check == 'math']
+
+    def test_each_course_meets_one_requirement(self):
+        required = ['MA150', 'CS111', 'MA160', 'MA211', 'MA213', 'MA240', 'MA380', 'MA410']
+        # MA401 meets "one of MA401, MA406" and MA406 the 400-level class,
+        # whichever order they are looked at in
+        self.assertEqual(self.math_messages(required+['MA401', 'MA406', 'MA208', 'MA251']), [])
+        self.assertEqual(self.math_messages(required+['MA406', 'MA401', 'MA251', 'MA208']), [])
+        # Without one of the two 200-level classes, one message
+        self.assertEqual(len(self.math_messages(required+['MA401', 'MA406', 'MA208'])), 1)
+        # The same course cannot count twice
+        self.assertEqual(len(self.math_messages(required+['MA401', 'MA208', 'MA251'])), 1)
+
+if __name__ == '__main__':
+    unittest.main()